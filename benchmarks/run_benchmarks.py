@@ -0,0 +1,48 @@
+"""Measures the throughput and peak memory of each pipeline stage on generated Divvy trips.
+
+Usage (from the repository root):
+    PYTHONPATH=src python benchmarks/run_benchmarks.py --rows 100000 1000000 --output report.json
+    PYTHONPATH=src python benchmarks/run_benchmarks.py --rows 100000 --compare report.json
+
+Each size runs in a fresh process so the peak memory of one size does not leak into the next.
+"""
+import argparse
+from concurrent.futures import ProcessPoolExecutor
+import tempfile
+from helpers.util_benchmark import compare_reports, environment, load_report, run_benchmark, save_report, schema_memory_report
+
+
+def benchmark_size(num_rows: int, seed: int) -> dict[str, dict[str, float]]:
+    with tempfile.TemporaryDirectory() as workdir:
+        return run_benchmark(num_rows, workdir, seed)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--rows', type=int, nargs='+', default=[100_000, 1_000_000, 10_000_000], help="number of trips of each run")
+    parser.add_argument('--seed', type=int, default=0, help="seed of the trip generator")
+    parser.add_argument('--output', default='benchmark_report.json', help="path of the JSON report")
+    parser.add_argument('--compare', help="JSON report of a previous run to compare with")
+    parser.add_argument('--memory-report', action='store_true', help="print the memory saved by the trip schema on the smallest size")
+    args = parser.parse_args()
+
+    if args.memory_report:
+        print(schema_memory_report(min(args.rows), args.seed))
+
+    report = {'environment': environment(), 'seed': args.seed, 'results': {}}
+    for num_rows in args.rows:
+        with ProcessPoolExecutor(max_workers=1) as executor:
+            stages = executor.submit(benchmark_size, num_rows, args.seed).result()
+        report['results'][str(num_rows)] = stages
+        for stage, measures in stages.items():
+            print(f"{num_rows:>10,} {stage:<32} {measures['seconds']:>8.2f}s {measures['rows_per_sec']:>12,.0f} rows/s "
+                  f"{measures['peak_rss_mb']:>8,.0f} MB")
+    save_report(report, args.output)
+    print(f"Report saved to {args.output}")
+
+    if args.compare:
+        print(compare_reports(load_report(args.compare), report))
+
+
+if __name__ == '__main__':
+    main()
@@ -1,32 +1,37 @@
+from etl import instrument
 from etl.extract import download_file_from_web, extract_all_files_in_directory
-from helpers.util_transform import extract_divvy_biketrip_dataset, transform_data
-from etl.load import send_to_csv
-from datetime import datetime
+from etl.schema import memory_usage
+from helpers.util_extract import extract_divvy_biketrip_dataset
+from helpers.util_transform import build_station_df, filepath_station_cache, transform_data
+from helpers.util_schema import date_format, parse_dates, raw_trip_dtype
+from helpers.util_rollup import build_rollups, export_rollups, send_rollups
+from helpers.util_validate import export_quarantine_counts, send_quarantine, validate_trips
+from helpers.util_pipeline import duckdb_divvy_pipeline, raw_memory_report, run_incremental_pipeline, run_pipelined_pipeline, send_trips, stream_divvy_pipeline
 import os
 from pathlib import Path
 
 
-def main() -> None:
+def main(incremental: bool = True, streaming: bool = True, chunksize: int | None = 1_000_000, file_format: str = 'csv',
+         profile: bool = False, backend: str = 'pandas', pipelined: bool = False) -> None:
+  """Runs the Divvy pipeline over the date range.
+
+  Only one pipeline runs: the DuckDB backend or the pipelined one when asked for, otherwise the incremental
+  one (the default), the streaming one or the in-memory one.
+
+  Raises:
+    ValueError: If the backend is not one of the valid backends.
+  """
+  if backend not in ('pandas', 'duckdb'):
+    raise ValueError(f"Invalid backend '{backend}'. Valid backends are 'pandas', 'duckdb'")
   # Extract variables
   start_date, end_date = "2020-04-01", "2022-12-01"
-  dtype = {
-    "ride_id" : str,
-    "rideable_type" : str,
-    "start_station_name" : str,
-    "end_station_name" : str,
-    "start_station_id" : str,
-    "end_station_id" : str,
-    "start_lat" : float,
-    "start_lng" : float,
-    "end_lat" : float,
-    "end_lng" : float,
-    "member_casual" : str,
-    }
-
-  date_parser  = lambda date: datetime.strptime(date, '%Y-%m-%d %H:%M:%S')
-  parse_dates : list[str] = ['started_at', 'ended_at']
+  # Categorical strings and float32 coordinates, see helpers.util_schema
+  dtype = raw_trip_dtype
+  # Parsed months are kept as memory-mapped Arrow files next to the csv files, see etl.extract.read_cached_table
+  raw_cache = True
   file_ext = ".csv" 
   sub_dir = ['2020', '2021', '2022']
+  workers = os.cpu_count() or 1
 
   neighborhood_url ='https://data.cityofchicago.org/api/geospatial/bbvz-uum9?method=export&format=GeoJSON'
   state_url = 'https://www2.census.gov/geo/tiger/GENZ2018/shp/cb_2018_us_state_500k.zip'
@@ -43,21 +48,101 @@ def main() -> None:
 
   # Load variables 
   divvy_final_destination = os.path.join(destination, 'final')
-  output_filename = 'divvy_final.csv'
+  # csv for Tableau, parquet (partitioned by year/month) for helpers.util_load.query_trips
+  output_filename = 'divvy_final.csv' if file_format == 'csv' else 'divvy_final.parquet'
+  manifest_path = os.path.join(destination, 'manifest.json')
+  # Timing, rows and memory of every transform step, see etl.instrument
+  trace_path = os.path.join(destination, 'profile_trace.json')
+
+  if profile:
+    instrument.enable()
 
 
-  extract_divvy_biketrip_dataset(start_date, end_date, divvy_initial_destination, date_format="%Y-%m-%d")
   download_file_from_web(neighborhood_url, neighborhood_filename, neighborhood_initial_destination)
   download_file_from_web(state_url, state_filename, state_initial_destination)
 
-  raw_divvy_df = extract_all_files_in_directory(divvy_initial_destination, 
-                                                file_ext=file_ext, 
-                                                sub_dir=sub_dir,
-                                                dtype=dtype,
-                                                parse_dates=parse_dates,
-                                                date_parser=date_parser)
-  transformed_df = transform_data(raw_divvy_df)
-  send_to_csv(transformed_df, output_filename, divvy_final_destination)
+  if backend == 'duckdb':
+    extract_divvy_biketrip_dataset(start_date, end_date, divvy_initial_destination, date_format="%Y-%m-%d")
+    # Out-of-core: DuckDB scans the raw files and spills to disk, see etl.sql (pip install duckdb)
+    duckdb_divvy_pipeline(divvy_initial_destination,
+                          output_filename,
+                          divvy_final_destination,
+                          file_ext=file_ext,
+                          sub_dir=sub_dir,
+                          file_format=file_format,
+                          station_cache_path=filepath_station_cache,
+                          date_format=date_format)
+  elif pipelined:
+    # Months flow through download -> parse -> enrich -> write, the stages overlap (see etl.scheduler)
+    run_pipelined_pipeline(start_date,
+                           end_date,
+                           divvy_initial_destination,
+                           output_filename,
+                           divvy_final_destination,
+                           filepath_station_cache,
+                           file_format=file_format,
+                           dtype=dtype,
+                           parse_dates=parse_dates,
+                           date_format=date_format,
+                           cache=raw_cache)
+  elif incremental:
+    # Only fetch, transform and load the months that are new or changed since the last run
+    run_incremental_pipeline(start_date,
+                             end_date,
+                             divvy_initial_destination,
+                             output_filename,
+                             divvy_final_destination,
+                             manifest_path,
+                             file_format=file_format,
+                             station_cache_path=filepath_station_cache,
+                             dtype=dtype,
+                             parse_dates=parse_dates,
+                             date_format=date_format,
+                             cache=raw_cache)
+  elif streaming:
+    extract_divvy_biketrip_dataset(start_date, end_date, divvy_initial_destination, date_format="%Y-%m-%d")
+    # Month by month (chunk by chunk) so peak memory does not grow with the date range
+    stream_divvy_pipeline(divvy_initial_destination,
+                          output_filename,
+                          divvy_final_destination,
+                          file_ext=file_ext,
+                          sub_dir=sub_dir,
+                          chunksize=chunksize,
+                          file_format=file_format,
+                          station_cache_path=filepath_station_cache,
+                          dtype=dtype,
+                          parse_dates=parse_dates,
+                          date_format=date_format,
+                          cache=raw_cache)
+  else:
+    extract_divvy_biketrip_dataset(start_date, end_date, divvy_initial_destination, date_format="%Y-%m-%d")
+    raw_divvy_df = extract_all_files_in_directory(divvy_initial_destination, 
+                                                  file_ext=file_ext, 
+                                                  sub_dir=sub_dir,
+                                                  dtype=dtype,
+                                                  parse_dates=parse_dates,
+                                                  date_format=date_format,
+                                                  cache=raw_cache,
+                                                  workers=workers,
+                                                  executor='process')
+    print(f"Trips in memory: {memory_usage(raw_divvy_df) / 2**20:,.0f} MB")
+    station_df = build_station_df(raw_divvy_df, filepath_station_cache)
+    # Trips breaking a data-quality rule are set aside with their reasons, see helpers.util_validate
+    raw_divvy_df, rejected_df = validate_trips(raw_divvy_df)
+    send_quarantine(rejected_df, divvy_final_destination)
+    export_quarantine_counts(divvy_final_destination)
+    transformed_df = transform_data(raw_divvy_df, station_df)
+    # The csv is formatted by one process per core, see etl.load.send_to_csv
+    send_trips(transformed_df, output_filename, divvy_final_destination, file_format, workers=workers)
+    # Daily and hourly aggregates for the dashboard, see helpers.util_rollup
+    send_rollups(build_rollups(transformed_df), divvy_final_destination)
+    export_rollups(divvy_final_destination)
+
+  if profile:
+    print(instrument.report())
+    instrument.save_chrome_trace(trace_path)
+    # Memory of a month of trips per column, with and without the schema dtypes
+    print(raw_memory_report(divvy_initial_destination, file_ext, sub_dir, parse_dates=parse_dates, date_format=date_format))
 
 if __name__ == "__main__":
   main() # ~ 30 minutes to run
\ No newline at end of file
@@ -1,50 +1,484 @@
-import subprocess
+import http.client
+import json
 import os
-from typing import List
+import threading
+import time
+import urllib.parse
+import urllib.request
+import zipfile
+from concurrent.futures import Executor, ProcessPoolExecutor, ThreadPoolExecutor
+from functools import partial
+from typing import TYPE_CHECKING, BinaryIO, Iterator, List, Optional, Tuple
 import pandas as pd
+from pandas.api.types import union_categoricals
+import pyarrow as pa
 import glob
+from etl.manifest import config_hash
 
+if TYPE_CHECKING:
+    import geopandas as gpd
 
-def download_file_from_web(url: str, filename: str, destination: str, compressed=True) -> None:
+REDIRECT_CODES = {301, 302, 303, 307, 308}
+MAX_REDIRECTS = 5
+BLOCK_SIZE = 1 << 20
+
+# One open connection per (scheme, host) and per thread, reused across downloads
+_connections = threading.local()
+
+
+class DownloadError(Exception):
+    """Raised when a file cannot be downloaded."""
+
+
+def get_connection(scheme: str, netloc: str, timeout: float) -> http.client.HTTPConnection:
+    """Returns the open connection of the current thread to a host, creating it if needed.
+
+    The connection goes through the proxy of the environment (`https_proxy`/`http_proxy`) when one is set.
+
+    Args:
+        scheme (str): Either 'http' or 'https'.
+        netloc (str): The host (and port) to connect to.
+        timeout (float): Socket timeout in seconds.
+
+    Returns:
+        http.client.HTTPConnection: A keep-alive connection to the host.
+    """
+    pool: dict[Tuple[str, str], http.client.HTTPConnection] = _connections.__dict__.setdefault('pool', {})
+    if (scheme, netloc) not in pool:
+        connection_class = http.client.HTTPSConnection if scheme == 'https' else http.client.HTTPConnection
+        proxy = urllib.request.getproxies().get(scheme)
+        if proxy and not urllib.request.proxy_bypass(netloc):
+            conn = connection_class(urllib.parse.urlsplit(proxy).netloc, timeout=timeout)
+            conn.set_tunnel(netloc)
+        else:
+            conn = connection_class(netloc, timeout=timeout)
+        pool[(scheme, netloc)] = conn
+    return pool[(scheme, netloc)]
+
+
+def close_connection(scheme: str, netloc: str) -> None:
+    """Closes and forgets the connection of the current thread to a host."""
+    conn = _connections.__dict__.get('pool', {}).pop((scheme, netloc), None)
+    if conn is not None:
+        conn.close()
+
+
+def open_url(url: str, offset: int = 0, timeout: float = 60) -> Tuple[http.client.HTTPResponse, Tuple[str, str]]:
+    """Sends a GET request over a reused connection, following redirects.
+
+    Args:
+        url (str): URL of the file.
+        offset (int, optional): First byte to request, a `Range` header is sent when positive. Defaults to 0.
+        timeout (float, optional): Socket timeout in seconds. Defaults to 60.
+
+    Returns:
+        tuple: The response and the (scheme, host) of the connection it was received on.
+
+    Raises:
+        DownloadError: If the URL is invalid or redirects too many times.
+    """
+    headers = {'Range': f'bytes={offset}-'} if offset > 0 else {}
+    for _ in range(MAX_REDIRECTS + 1):
+        parts = urllib.parse.urlsplit(url)
+        if parts.scheme not in ('http', 'https') or not parts.netloc:
+            raise DownloadError(f"Invalid url '{url}'")
+        conn = get_connection(parts.scheme, parts.netloc, timeout)
+        path = urllib.parse.urlunsplit(('', '', parts.path or '/', parts.query, ''))
+        try:
+            conn.request('GET', path, headers=headers)
+            response = conn.getresponse()
+        except (OSError, http.client.HTTPException):
+            close_connection(parts.scheme, parts.netloc)
+            raise
+        if response.status not in REDIRECT_CODES:
+            return response, (parts.scheme, parts.netloc)
+        response.read()
+        url = urllib.parse.urljoin(url, response.headers['Location'])
+    raise DownloadError(f"Too many redirects for '{url}'")
+
+
+def fetch_url(url: str, sink: BinaryIO, retries: int = 3, backoff: float = 1.0, timeout: float = 60) -> None:
+    """Streams the content of a URL into a binary sink.
+
+    Bytes already in the sink are kept: the transfer resumes from the end of the sink with an HTTP range
+    request, after an interrupted attempt as well as for a partial file left by a previous run. Failed
+    attempts are retried with exponential backoff.
+
+    Args:
+        url (str): URL of the file.
+        sink (BinaryIO): Seekable binary stream receiving the content, positioned at its end.
+        retries (int, optional): Number of retries after a failed attempt. Defaults to 3.
+        backoff (float, optional): Delay in seconds before the first retry, doubled at each retry. Defaults to 1.0.
+        timeout (float, optional): Socket timeout in seconds. Defaults to 60.
+
+    Raises:
+        DownloadError: If the server rejects the request or every attempt fails.
+    """
+    for attempt in range(retries + 1):
+        offset = sink.tell()
+        scheme_netloc: Optional[Tuple[str, str]] = None
+        try:
+            response, scheme_netloc = open_url(url, offset, timeout)
+            if response.status == 416 and offset > 0:
+                # The partial content is already complete
+                response.read()
+                return
+            if response.status >= 400:
+                response.read()
+                if response.status < 500:
+                    raise DownloadError(f"Error {response.status} {response.reason} for '{url}'")
+                raise http.client.HTTPException(f"Error {response.status} {response.reason}")
+            if response.status == 200 and offset > 0:
+                # The server ignored the range, start over
+                sink.seek(0)
+                sink.truncate()
+            for block in iter(lambda: response.read(BLOCK_SIZE), b''):
+                sink.write(block)
+            if response.length:
+                # The connection was closed before the announced Content-Length
+                raise http.client.IncompleteRead(b'', response.length)
+            return
+        except (OSError, http.client.HTTPException) as e:
+            if scheme_netloc is not None:
+                close_connection(*scheme_netloc)
+            if attempt == retries:
+                raise DownloadError(f"Failed to download '{url}': {e}") from e
+            print(f"Error: {e}, retrying")
+            time.sleep(backoff * 2 ** attempt)
+
+
+def download_file_from_web(url: str, filename: str, destination: str, compressed=True, retries: int = 3, backoff: float = 1.0,
+                           timeout: float = 60) -> None:
     """Download a file from a URL and save it in a destination directory.
 
+    The file is written to `<filename>.part` first, so an interrupted download resumes where it stopped, in
+    the same call or in a later one. Once complete, the content of a compressed file is extracted into the
+    destination and the archive is removed, other files are renamed.
+
     Args:
         url (str): URL to download the file.
         filename (str): Name of the file to save.
         destination (str): Directory where the file should be saved.
         compressed (bool, optional): Whether the file is compressed. Defaults to True.
+        retries (int, optional): Number of retries after a failed attempt. Defaults to 3.
+        backoff (float, optional): Delay in seconds before the first retry, doubled at each retry. Defaults to 1.0.
+        timeout (float, optional): Socket timeout in seconds. Defaults to 60.
+
+    Raises:
+        DownloadError: If the file cannot be downloaded or is not a valid zip file.
     """
+    data_path = os.path.join(destination, filename)
+    partial_path = f"{data_path}.part"
+    try:
+        with open(partial_path, 'ab') as f:
+            fetch_url(url, f, retries, backoff, timeout)
+    except DownloadError:
+        # Received bytes are kept for the next call, an empty file is not
+        if os.path.getsize(partial_path) == 0:
+            os.remove(partial_path)
+        raise
+    if not compressed:
+        os.replace(partial_path, data_path)
+        return
     try:
-        data_path = os.path.join(destination, filename)
-        # Download data
-        subprocess.run(f'curl -sSL {url} > {data_path}', shell=True, check=True)
-        if compressed:
-            # Extract zipfile content
-            subprocess.run(f'unzip -o {data_path} -d {destination}', shell=True, check=True)
-            # Remove zipfile
-            subprocess.run(f'rm {data_path}', shell=True, check=True)
-    except subprocess.CalledProcessError as e:
-        print(f"Error: {e}")
-        raise subprocess.CalledProcessError(e.returncode, "Invalid url")
-
-
-def extract_all_files_in_directory(input_dir: str, file_ext: str = '.csv', sub_dir: List[str] = [], **kwargs) -> pd.DataFrame:
+        with zipfile.ZipFile(partial_path) as archive:
+            members = [member for member in archive.namelist() if not member.startswith('__MACOSX/')]
+            archive.extractall(destination, members)
+    except zipfile.BadZipFile as e:
+        # Resuming a corrupt archive would not fix it, the next call starts over
+        os.remove(partial_path)
+        raise DownloadError(f"Invalid zip file from '{url}'") from e
+    os.remove(partial_path)
+
+
+def download_files_from_web(files: List[Tuple[str, str, str]], workers: int = 4, **kwargs) -> None:
+    """Download several files concurrently, each thread reusing its connections between files.
+
+    Args:
+        files (list of tuple): The (url, filename, destination) of each file.
+        workers (int, optional): The number of files downloaded at once. Defaults to 4.
+        **kwargs: Keyword arguments to pass to `download_file_from_web`.
+
+    Raises:
+        DownloadError: If any of the files cannot be downloaded.
+    """
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        futures = [pool.submit(download_file_from_web, url, filename, destination, **kwargs) for url, filename, destination in files]
+        for future in futures:
+            future.result()
+
+
+def list_files_in_directory(input_dir: str, file_ext: str = '.csv', sub_dir: List[str] = []) -> List[str]:
+    """Lists all files with a matching file extension in a given directory.
+
+    Args:
+      input_dir (str): The directory to search for files in.
+      file_ext (str, optional): The file extension to search for. Defaults to '.csv'.
+      sub_dir (list, optional): Specified sub-directories to search for files in. Defaults to None.
+
+    Returns:
+      List[str]: Paths of the matching files, sub-directory by sub-directory.
+    """
+    if len(sub_dir) > 0 and type(sub_dir) == list:
+        files = [file for dir in sub_dir for file in glob.glob(f"{input_dir}/{dir}/*{file_ext}")]
+    else:
+        files = glob.glob(f"{input_dir}/*{file_ext}")
+    return [file for file in files if file.endswith(file_ext)]
+
+
+def parse_date_columns(df: pd.DataFrame, parse_dates: List[str], date_format: str) -> pd.DataFrame:
+    """Converts columns to datetimes with one vectorized fixed-format parse per column.
+
+    Args:
+      df (pd.DataFrame): The DataFrame holding the date columns as strings.
+      parse_dates (list of str): The columns to convert.
+      date_format (str): strftime format of the columns.
+
+    Returns:
+      pd.DataFrame: The same DataFrame with the columns converted.
+    """
+    for col in parse_dates:
+        df[col] = pd.to_datetime(df[col], format=date_format)
+    return df
+
+
+def read_file(file: str, date_format: Optional[str] = None, cache: bool = False, **kwargs) -> pd.DataFrame:
+    """Reads a csv file into a Pandas DataFrame.
+
+    When a date format is given, the `parse_dates` columns are converted after reading with a single
+    vectorized fixed-format parse per column instead of a Python call per value.
+
+    Args:
+      file (str): Path of the file to read.
+      date_format (str, optional): strftime format of the `parse_dates` columns. Defaults to None.
+      cache (bool, optional): Whether to read (and create) the binary copy of the file, see `read_cached_table`. Defaults to False.
+      **kwargs: Keyword arguments to pass to `pd.read_csv`.
+
+    Returns:
+      pd.DataFrame: The content of the file.
+    """
+    if cache:
+        return table_to_pandas(read_cached_table(file, date_format, **kwargs))
+    parse_dates = kwargs.pop('parse_dates', []) if date_format else []
+    df = pd.read_csv(file, **kwargs)
+    return parse_date_columns(df, parse_dates, date_format) if date_format else df
+
+
+def read_file_in_chunks(file: str, chunksize: int, date_format: Optional[str] = None, cache: bool = False,
+                        **kwargs) -> Iterator[pd.DataFrame]:
+    """Reads a csv file into Pandas DataFrames of at most `chunksize` rows.
+
+    Args:
+      file (str): Path of the file to read.
+      chunksize (int): The maximum number of rows per DataFrame.
+      date_format (str, optional): strftime format of the `parse_dates` columns. Defaults to None.
+      cache (bool, optional): Whether to read (and create) the binary copy of the file, see `read_cached_table`. Defaults to False.
+      **kwargs: Keyword arguments to pass to `pd.read_csv`.
+
+    Yields:
+      pd.DataFrame: The next chunk of the file.
+    """
+    if cache:
+        table = read_cached_table(file, date_format, **kwargs)
+        for offset in range(0, table.num_rows, chunksize):
+            yield table_to_pandas(table.slice(offset, chunksize))
+        return
+    parse_dates = kwargs.pop('parse_dates', []) if date_format else []
+    with pd.read_csv(file, chunksize=chunksize, **kwargs) as reader:
+        for df in reader:
+            yield parse_date_columns(df, parse_dates, date_format) if date_format else df
+
+
+def read_cached_table(file: str, date_format: Optional[str] = None, **kwargs) -> pa.Table:
+    """Memory-maps the binary copy of a csv file, parsing the file and saving the copy first when needed.
+
+    The copy is an uncompressed Arrow IPC file next to the original (`<name>.arrow`) holding every column
+    parsed with the given options. It is parsed again when the original is modified or the options change.
+    Reads map the file instead of loading it, so numeric, datetime and pyarrow string columns are used
+    in place without a copy, and processes reading the same file share its pages.
+
+    Args:
+      file (str): Path of the csv file.
+      date_format (str, optional): strftime format of the `parse_dates` columns. Defaults to None.
+      **kwargs: Keyword arguments to pass to `pd.read_csv`. `usecols` and `nrows` select from the copy.
+
+    Returns:
+      pa.Table: The (memory-mapped) content of the file.
+    """
+    usecols, nrows = kwargs.pop('usecols', None), kwargs.pop('nrows', None)
+    options = config_hash({'date_format': date_format, **kwargs}).encode()
+    cache_path = f"{os.path.splitext(file)[0]}.arrow"
+
+    table = None
+    if os.path.exists(cache_path) and os.path.getmtime(cache_path) >= os.path.getmtime(file):
+        table = pa.ipc.open_file(pa.memory_map(cache_path)).read_all()
+        if (table.schema.metadata or {}).get(b'read_options') != options:
+            table = None
+    if table is None:
+        df = read_file(file, date_format, **kwargs)
+        arrow_strings = [col for col, dtype in df.dtypes.items() if dtype == 'string[pyarrow]']
+        table = pa.Table.from_pandas(df, preserve_index=False)
+        table = table.replace_schema_metadata({**(table.schema.metadata or {}), b'read_options': options,
+                                               b'arrow_strings': json.dumps(arrow_strings).encode()})
+        temp_path = f"{cache_path}.tmp"
+        with pa.OSFile(temp_path, 'wb') as sink, pa.ipc.new_file(sink, table.schema) as writer:
+            writer.write_table(table)
+        os.replace(temp_path, cache_path)
+        table = pa.ipc.open_file(pa.memory_map(cache_path)).read_all()
+
+    if usecols is not None:
+        # Same column order as `pd.read_csv`, the order of the file
+        table = table.select([col for col in table.column_names if col in usecols])
+    return table.slice(0, nrows) if nrows is not None else table
+
+
+def table_to_pandas(table: pa.Table) -> pd.DataFrame:
+    """Converts a table from `read_cached_table` to a DataFrame with the dtypes it was saved with.
+
+    Columns are not consolidated into blocks, so the ones that can (numbers and datetimes without
+    nulls, pyarrow strings) keep pointing at the memory of the table.
+    """
+    arrow_strings = [col for col in json.loads((table.schema.metadata or {}).get(b'arrow_strings', b'[]')) if col in table.column_names]
+    df = table.drop(arrow_strings).to_pandas(split_blocks=True)
+    for col in arrow_strings:
+        df[col] = pd.arrays.ArrowStringArray(table.column(col))
+    return df[table.column_names]
+
+
+def read_geo_file(filepath: str, fast_copy: bool = True) -> 'gpd.GeoDataFrame':
+    """Reads a vector file (shapefile, GeoJSON, ...) into a GeoDataFrame.
+
+    The first read also saves a Feather copy of the file next to it (`<name>.feather`), later reads load
+    the copy instead of parsing the original again as long as the original is not modified. geopandas is
+    only imported here, so reading and downloading trips does not load it.
+
+    Args:
+      filepath (str): Path of the vector file.
+      fast_copy (bool, optional): Whether to use and create the Feather copy. Defaults to True.
+
+    Returns:
+      gpd.GeoDataFrame: The content of the file.
+    """
+    import geopandas as gpd
+
+    feather_path = f"{os.path.splitext(filepath)[0]}.feather"
+    if fast_copy and os.path.exists(feather_path) and os.path.getmtime(feather_path) >= os.path.getmtime(filepath):
+        return gpd.read_feather(feather_path)
+
+    gdf = gpd.read_file(filepath)
+    if fast_copy:
+        temp_path = f"{feather_path}.tmp"
+        gdf.to_feather(temp_path)
+        os.replace(temp_path, feather_path)
+    return gdf
+
+
+def concat_dataframes(df_list: List[pd.DataFrame]) -> pd.DataFrame:
+    """Concatenates DataFrames row-wise while keeping categorical columns categorical.
+
+    `pd.concat` falls back to object dtype when the categories of the frames differ, so the
+    categories are unioned first.
+
+    Args:
+      df_list (list of pd.DataFrame): The DataFrames to concatenate.
+
+    Returns:
+      pd.DataFrame: The concatenated DataFrame with a fresh index.
+    """
+    if len(df_list) > 1:
+        categorical_cols = [col for col, dtype in df_list[0].dtypes.items() if isinstance(dtype, pd.CategoricalDtype)]
+        for col in categorical_cols:
+            categories = union_categoricals([df[col] for df in df_list], ignore_order=True).categories
+            df_list = [df.assign(**{col: df[col].cat.set_categories(categories)}) for df in df_list]
+    return pd.concat(df_list, axis=0, ignore_index=True)
+
+
+def get_executor(workers: int, executor: str = 'thread') -> Executor:
+    """Creates the pool used to run tasks in parallel.
+
+    Args:
+      workers (int): The number of workers of the pool.
+      executor (str, optional): The kind of pool, either 'thread' or 'process'. Defaults to 'thread'.
+
+    Returns:
+      Executor: A thread or process pool.
+
+    Raises:
+      ValueError: If the executor is not one of the valid executors.
+    """
+    match executor:
+        case "thread":
+            return ThreadPoolExecutor(max_workers=workers)
+        case "process":
+            return ProcessPoolExecutor(max_workers=workers)
+        case _:
+            raise ValueError(f"Invalid executor '{executor}'. Valid executors are 'thread', 'process'")
+
+
+def extract_all_files_in_directory(input_dir: str, file_ext: str = '.csv', sub_dir: List[str] = [], workers: int = 1,
+                                   executor: str = 'thread', **kwargs) -> pd.DataFrame:
     """Reads all files with a matching file extension in a given directory and returns them as a Pandas DataFrame.
 
     Args:
       input_dir (str): The directory to search for files in.
       file_ext (str, optional): The file extension to search for. Defaults to '.csv'.
       sub_dir (list, optional): Specified sub-directories to search for files in. Defaults to None.
+      workers (int, optional): The number of files read in parallel. Defaults to 1.
+      executor (str, optional): The kind of pool used when workers > 1, either 'thread' or 'process'. Defaults to 'thread'.
+      **kwargs: Keyword arguments to pass to `read_file`.
 
     Returns:
       pd.DataFrame: A concatenated Pandas DataFrame containing data from all matching files in the specified directory/sub-directories.
     """
     print("Starting to combine files together ... ")
-    if len(sub_dir) > 0 and type(sub_dir) == list:
-        df_list = [pd.read_csv(file, **kwargs) for dir in sub_dir for file in glob.glob(f"{input_dir}/{dir}/*{file_ext}") if file.endswith('.csv')]
+    files = list_files_in_directory(input_dir, file_ext, sub_dir)
+    if workers > 1:
+        with get_executor(workers, executor) as pool:
+            df_list = list(pool.map(partial(read_file, **kwargs), files))
     else:
-        df_list = [pd.read_csv(file, **kwargs) for file in glob.glob(f"{input_dir}/*{file_ext}") if file.endswith(file_ext)]
+        df_list = [read_file(file, **kwargs) for file in files]
 
-    combined_df = pd.concat(df_list, axis=0, ignore_index=True)
+    combined_df = concat_dataframes(df_list)
     print("Finished combining files together")
     return combined_df
+
+
+def iter_files(files: List[str], chunksize: Optional[int] = None, **kwargs) -> Iterator[pd.DataFrame]:
+    """Reads files one at a time.
+
+    Only one file (or one chunk of `chunksize` rows) is held in memory at once. The index of each chunk
+    continues where the previous one stopped, so the labels match the ones a single concatenated
+    DataFrame of the same rows would have.
+
+    Args:
+      files (list of str): Paths of the files to read, in order.
+      chunksize (int, optional): The maximum number of rows per chunk, whole files when None. Defaults to None.
+      **kwargs: Keyword arguments to pass to `read_file`.
+
+    Yields:
+      pd.DataFrame: The next file or chunk.
+    """
+    offset = 0
+    for file in files:
+        chunks = read_file_in_chunks(file, chunksize, **kwargs) if chunksize else iter([read_file(file, **kwargs)])
+        for df in chunks:
+            df.index = pd.RangeIndex(offset, offset + len(df))
+            offset += len(df)
+            yield df
+
+
+def iter_files_in_directory(input_dir: str, file_ext: str = '.csv', sub_dir: List[str] = [], chunksize: Optional[int] = None,
+                            **kwargs) -> Iterator[pd.DataFrame]:
+    """Reads all files with a matching file extension in a given directory one at a time, see `iter_files`.
+
+    Args:
+      input_dir (str): The directory to search for files in.
+      file_ext (str, optional): The file extension to search for. Defaults to '.csv'.
+      sub_dir (list, optional): Specified sub-directories to search for files in. Defaults to None.
+      chunksize (int, optional): The maximum number of rows per chunk, whole files when None. Defaults to None.
+      **kwargs: Keyword arguments to pass to `read_file`.
+
+    Returns:
+      Iterator[pd.DataFrame]: The files or chunks, in order.
+    """
+    return iter_files(list_files_in_directory(input_dir, file_ext, sub_dir), chunksize, **kwargs)
@@ -0,0 +1,186 @@
+from contextlib import contextmanager
+import functools
+import json
+import os
+import resource
+import threading
+import time
+from typing import Any, Callable, Iterator, List, Optional, TypeVar
+import pandas as pd
+
+F = TypeVar('F', bound=Callable[..., Any])
+
+_enabled = False
+_records: List[dict[str, Any]] = []
+_local = threading.local()
+_origin = time.perf_counter()
+_page_size = os.sysconf('SC_PAGE_SIZE') if hasattr(os, 'sysconf') else 4096
+
+
+def enable() -> None:
+    """Starts recording the steps run through `instrumented` functions and `step` blocks."""
+    global _enabled
+    _enabled = True
+
+
+def disable() -> None:
+    """Stops recording, the records collected so far are kept."""
+    global _enabled
+    _enabled = False
+
+
+def is_enabled() -> bool:
+    return _enabled
+
+
+def reset() -> None:
+    """Drops every record."""
+    _records.clear()
+
+
+def records() -> List[dict[str, Any]]:
+    """The recorded steps in the order they finished, see `step` for their fields."""
+    return list(_records)
+
+
+def current_rss() -> int:
+    """Resident memory of the process in bytes."""
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * _page_size
+    except OSError:
+        return peak_rss()
+
+
+def reset_peak_rss() -> None:
+    """Resets the peak RSS of the process to its current RSS (Linux only, no-op elsewhere)."""
+    try:
+        with open('/proc/self/clear_refs', 'w') as f:
+            f.write('5')
+    except OSError:
+        pass
+
+
+def peak_rss() -> int:
+    """Peak resident memory of the process in bytes since the last `reset_peak_rss`.
+
+    Falls back to the peak since the process started where /proc is not available.
+    """
+    try:
+        with open('/proc/self/status') as f:
+            for line in f:
+                if line.startswith('VmHWM:'):
+                    return int(line.split()[1]) * 1024
+    except OSError:
+        pass
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+
+@contextmanager
+def step(name: str, rows_in: Optional[int] = None) -> Iterator[dict[str, Any]]:
+    """Records the wall time, row counts and memory of a block of code, when recording is enabled.
+
+    The yielded record can be updated by the block, e.g. with its 'rows_out'. Once the block ends it holds
+    the 'name', 'start' and 'seconds' (since the module was imported), 'rows_in', 'rows_out', 'rss_delta_mb'
+    (resident memory after minus before), 'peak_rss_mb' (peak resident memory during the block), 'depth'
+    (number of enclosing steps), 'pid' and 'thread'.
+
+    Args:
+        name (str): Name of the step.
+        rows_in (int, optional): Number of input rows. Defaults to None.
+
+    Yields:
+        dict: The record of the step, a throwaway dict when recording is disabled.
+    """
+    if not _enabled:
+        yield {}
+        return
+
+    stack = _local.__dict__.setdefault('stack', [])
+    record: dict[str, Any] = {'name': name, 'rows_in': rows_in, 'rows_out': None, 'depth': len(stack),
+                              'pid': os.getpid(), 'thread': threading.get_ident()}
+    stack.append(0)
+    rss_before = current_rss()
+    reset_peak_rss()
+    start = time.perf_counter()
+    try:
+        yield record
+    finally:
+        seconds = time.perf_counter() - start
+        # Nested steps reset the peak, so their own peaks are carried up the stack
+        peak = max(peak_rss(), stack.pop())
+        if stack:
+            stack[-1] = max(stack[-1], peak)
+        record.update({'start': round(start - _origin, 6), 'seconds': round(seconds, 6),
+                       'rss_delta_mb': round((current_rss() - rss_before) / 2**20, 1), 'peak_rss_mb': round(peak / 2**20, 1)})
+        _records.append(record)
+
+
+def instrumented(func: F) -> F:
+    """
+    Records every call of a DataFrame function with `step` while recording is enabled.
+
+    The input rows are the rows of the first argument and the output rows the rows of the result, when
+    they are DataFrames. When recording is disabled the only overhead is one flag check per call.
+
+    Args:
+        func (callable): The function to wrap.
+
+    Returns:
+        callable: The wrapped function.
+    """
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        if not _enabled:
+            return func(*args, **kwargs)
+        rows_in = len(args[0]) if args and isinstance(args[0], pd.DataFrame) else None
+        with step(func.__name__, rows_in) as record:
+            result = func(*args, **kwargs)
+            if isinstance(result, pd.DataFrame):
+                record['rows_out'] = len(result)
+        return result
+    return wrapper  # type: ignore
+
+
+def report(records: Optional[List[dict[str, Any]]] = None) -> str:
+    """Formats the records as a table, in the order the steps started, nested steps indented.
+
+    Args:
+        records (list of dict, optional): The records to format. Defaults to every recorded step.
+
+    Returns:
+        str: The table, with the total time of each step name at the end.
+    """
+    records = _records if records is None else records
+    lines = [f"{'step':<40} {'seconds':>9} {'rows in':>12} {'rows out':>12} {'rss delta MB':>13} {'peak MB':>9}"]
+    for record in sorted(records, key=lambda x: float(x['start'])):
+        name = '  ' * record['depth'] + record['name']
+        rows_in = f"{record['rows_in']:,}" if record['rows_in'] is not None else '-'
+        rows_out = f"{record['rows_out']:,}" if record['rows_out'] is not None else '-'
+        lines.append(f"{name:<40} {record['seconds']:>9.3f} {rows_in:>12} {rows_out:>12} {record['rss_delta_mb']:>13,.1f} "
+                     f"{record['peak_rss_mb']:>9,.1f}")
+
+    totals: dict[str, List[float]] = {}
+    for record in records:
+        totals.setdefault(record['name'], []).append(record['seconds'])
+    lines.append('')
+    lines.append(f"{'total by step':<40} {'seconds':>9} {'calls':>12}")
+    for name, seconds in sorted(totals.items(), key=lambda x: -sum(x[1])):
+        lines.append(f"{name:<40} {sum(seconds):>9.3f} {len(seconds):>12}")
+    return '\n'.join(lines)
+
+
+def save_json(filepath: str) -> None:
+    """Writes the records as a JSON list."""
+    with open(filepath, 'w') as f:
+        json.dump(_records, f, indent=2)
+
+
+def save_chrome_trace(filepath: str) -> None:
+    """Writes the records in the Chrome trace event format, to open in chrome://tracing or Perfetto."""
+    events = [{'name': record['name'], 'ph': 'X', 'ts': record['start'] * 1e6, 'dur': record['seconds'] * 1e6,
+               'pid': record['pid'], 'tid': record['thread'],
+               'args': {key: record[key] for key in ['rows_in', 'rows_out', 'rss_delta_mb', 'peak_rss_mb']}}
+              for record in _records]
+    with open(filepath, 'w') as f:
+        json.dump({'traceEvents': events, 'displayTimeUnit': 'ms'}, f)
@@ -1,7 +1,154 @@
+import glob
 import os
+import shutil
+import time
+import uuid
+from collections import deque
+from concurrent.futures import Future
+from typing import Deque, Iterator, List, Optional
 import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+from etl.extract import get_executor
 
 
-def send_to_csv(df: pd.DataFrame, filename: str, destination: str) -> None:
+def send_to_csv(df: pd.DataFrame, filename: str, destination: str, append: bool = False, workers: int = 1, chunksize: int = 250_000,
+                compression: Optional[str] = None, executor: str = 'process', verbose: bool = False) -> None:
+    """Write a DataFrame to a csv file in a destination directory.
+
+    The rows are formatted (and compressed) in chunks, by a pool of workers when workers > 1, and the chunks
+    are written in order as they finish, so the file is the same as with a single `df.to_csv`. A new file is
+    written to a temporary file and renamed at the end, so a crash never leaves a truncated file. When the
+    formatting fails, the temporary file is removed, or the appended rows are cut from the existing file.
+
+    Args:
+        df (pd.DataFrame): The DataFrame to write.
+        filename (str): Name of the file to write, it is not changed by the compression (e.g. pass "trips.csv.gz").
+        destination (str): Directory where the file should be saved.
+        append (bool, optional): Append the rows to an existing file instead of overwriting it. The header is
+            only written when the file does not exist yet. Defaults to False.
+        workers (int, optional): The number of chunks formatted in parallel. Defaults to 1.
+        chunksize (int, optional): The number of rows per chunk. Defaults to 250,000.
+        compression (str, optional): Either 'gzip' or 'zstd', each chunk is a complete gzip member or zstd frame,
+            which the gzip and zstd tools read back as a single stream. Defaults to None (plain text).
+        executor (str, optional): The kind of pool used when workers > 1, either 'thread' or 'process'. Defaults
+            to 'process', formatting holds the GIL.
+        verbose (bool, optional): Print the size written and the throughput. Defaults to False.
+
+    Raises:
+        ValueError: If the compression is not one of the valid compressions.
+    """
+    if compression not in (None, 'gzip', 'zstd'):
+        raise ValueError(f"Invalid compression '{compression}'. Valid compressions are 'gzip', 'zstd'")
     filepath = os.path.join(destination, filename)
-    df.to_csv(filepath, index=False)
+    header = not (append and os.path.exists(filepath))
+    temp_filepath = f"{filepath}.tmp" if header else filepath
+
+    start, size = time.perf_counter(), 0
+    initial_size = 0 if header else os.path.getsize(filepath)
+    try:
+        with open(temp_filepath, 'wb' if header else 'ab') as out:
+            for data in iter_csv_chunks(df, chunksize, header, compression, workers, executor):
+                out.write(data)
+                size += len(data)
+    except BaseException:
+        if header:
+            os.remove(temp_filepath)
+        else:
+            os.truncate(filepath, initial_size)
+        raise
+    if header:
+        os.replace(temp_filepath, filepath)
+    if not verbose:
+        return
+    elapsed = time.perf_counter() - start
+    print(f"Wrote {len(df):,} rows ({size / 2**20:,.1f} MB) to {filename} in {elapsed:.1f}s ({size / 2**20 / max(elapsed, 1e-6):,.1f} MB/s)")
+
+
+def format_csv(df: pd.DataFrame, header: bool = True, compression: Optional[str] = None) -> bytes:
+    """Formats rows as csv bytes, compressed into a complete gzip member or zstd frame when a compression is given."""
+    data: bytes = df.to_csv(index=False, header=header).encode()
+    if compression is not None:
+        data = pa.compress(data, codec=compression, asbytes=True)
+    return data
+
+
+def iter_csv_chunks(df: pd.DataFrame, chunksize: int, header: bool = True, compression: Optional[str] = None, workers: int = 1,
+                    executor: str = 'process') -> Iterator[bytes]:
+    """Yields the csv bytes of consecutive chunks of rows, in order, see `send_to_csv`.
+
+    At most twice as many chunks as workers are in flight, so memory does not grow with the size of df.
+    """
+    chunks = (df.iloc[i:i + chunksize] for i in range(0, max(len(df), 1), chunksize))
+    if workers <= 1:
+        for i, chunk in enumerate(chunks):
+            yield format_csv(chunk, header and i == 0, compression)
+        return
+    with get_executor(workers, executor) as pool:
+        pending: Deque[Future[bytes]] = deque()
+        for i, chunk in enumerate(chunks):
+            pending.append(pool.submit(format_csv, chunk, header and i == 0, compression))
+            if len(pending) > 2 * workers:
+                yield pending.popleft().result()
+        while pending:
+            yield pending.popleft().result()
+
+
+def merge_csv_files(files: List[str], filename: str, destination: str) -> None:
+    """Concatenate csv files sharing the same header into one csv file in a destination directory.
+
+    The files are copied byte for byte, only the header of the first file is kept. The output is
+    written to a temporary file and renamed at the end, so a crash never leaves a truncated file.
+
+    Args:
+        files (list of str): Paths of the csv files, in output order.
+        filename (str): Name of the file to write.
+        destination (str): Directory where the file should be saved.
+    """
+    filepath = os.path.join(destination, filename)
+    temp_filepath = f"{filepath}.tmp"
+    with open(temp_filepath, 'wb') as out:
+        for i, file in enumerate(files):
+            with open(file, 'rb') as f:
+                header = f.readline()
+                if i == 0:
+                    out.write(header)
+                shutil.copyfileobj(f, out)
+    os.replace(temp_filepath, filepath)
+
+
+def send_to_parquet(df: pd.DataFrame, dirname: str, destination: str, date_column: Optional[str] = None, append: bool = False,
+                    file_prefix: Optional[str] = None, row_group_size: int = 100_000) -> None:
+    """Write a DataFrame to a Parquet dataset in a destination directory.
+
+    When a date column is given, the rows are partitioned into `year=YYYY/month=M` sub-directories so
+    readers can skip whole months, and sorted by the date within the files so the min/max statistics of
+    each row group let readers skip the rest (see `etl.query`). Categorical columns are stored
+    dictionary-encoded and datetime columns as typed timestamps.
+
+    Args:
+        df (pd.DataFrame): The DataFrame to write.
+        dirname (str): Name of the dataset directory.
+        destination (str): Directory where the dataset should be saved.
+        date_column (str, optional): Datetime column used to partition the rows by year and month. Defaults to None.
+        append (bool, optional): Add files next to the existing ones instead of replacing the dataset. Defaults to False.
+        file_prefix (str, optional): Prefix of the written file names. When appending, existing files with the same
+            prefix are deleted first, so writing the same prefix again replaces its rows. Defaults to a random prefix.
+        row_group_size (int, optional): Most rows per row group, the unit readers can skip. Defaults to 100,000.
+    """
+    path = os.path.join(destination, dirname)
+    if not append and os.path.exists(path):
+        shutil.rmtree(path)
+    elif file_prefix is not None:
+        for file in glob.glob(os.path.join(path, '**', f'{file_prefix}-*.parquet'), recursive=True):
+            os.remove(file)
+
+    partition_cols = None
+    if date_column is not None:
+        if not df[date_column].is_monotonic_increasing:
+            df = df.sort_values(date_column, kind='stable')
+        df = df.assign(year=df[date_column].dt.year, month=df[date_column].dt.month)
+        partition_cols = ['year', 'month']
+    table = pa.Table.from_pandas(df, preserve_index=False)
+    pq.write_to_dataset(table, path, partition_cols=partition_cols, existing_data_behavior='overwrite_or_ignore',
+                        basename_template=f"{file_prefix or uuid.uuid4().hex}-{{i}}.parquet", row_group_size=row_group_size)
@@ -0,0 +1,121 @@
+import hashlib
+import json
+import os
+import urllib.request
+from typing import Any, Optional
+
+
+def file_checksum(filepath: str, block_size: int = 1 << 20) -> str:
+    """Computes the sha256 checksum of a file without loading it in memory.
+
+    Args:
+        filepath (str): Path of the file.
+        block_size (int, optional): Number of bytes read at once. Defaults to 1 MiB.
+
+    Returns:
+        str: The hex digest of the file content.
+    """
+    digest = hashlib.sha256()
+    with open(filepath, 'rb') as f:
+        for block in iter(lambda: f.read(block_size), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def config_hash(config: dict[str, Any]) -> str:
+    """Computes a stable hash of a configuration.
+
+    Args:
+        config (dict): The configuration, values that are not JSON serializable are hashed through `str`.
+
+    Returns:
+        str: The hex digest of the configuration.
+    """
+    payload = json.dumps(config, sort_keys=True, default=str)
+    return hashlib.sha256(payload.encode()).hexdigest()
+
+
+def get_remote_metadata(url: str, timeout: float = 30) -> dict[str, Optional[str]]:
+    """Fetches the ETag, size and modification date of a remote file with a HEAD request.
+
+    Args:
+        url (str): URL of the file.
+        timeout (float, optional): Timeout of the request in seconds. Defaults to 30.
+
+    Returns:
+        dict: The 'etag', 'content_length' and 'last_modified' headers, None when a header is missing.
+    """
+    request = urllib.request.Request(url, method='HEAD')
+    with urllib.request.urlopen(request, timeout=timeout) as response:
+        headers = response.headers
+        return {
+            'etag': headers.get('ETag'),
+            'content_length': headers.get('Content-Length'),
+            'last_modified': headers.get('Last-Modified'),
+        }
+
+
+def load_manifest(filepath: str) -> dict[str, dict[str, Any]]:
+    """Reads a manifest file, an empty manifest is returned when the file does not exist.
+
+    Args:
+        filepath (str): Path of the manifest.
+
+    Returns:
+        dict: The manifest entries keyed by item (e.g. month).
+    """
+    if not os.path.exists(filepath):
+        return {}
+    with open(filepath, 'r') as f:
+        manifest: dict[str, dict[str, Any]] = json.load(f)
+    return manifest
+
+
+def save_manifest(manifest: dict[str, dict[str, Any]], filepath: str) -> None:
+    """Writes a manifest file. The file is replaced atomically so a crash never leaves a truncated manifest.
+
+    Args:
+        manifest (dict): The manifest entries keyed by item (e.g. month).
+        filepath (str): Path of the manifest.
+    """
+    temp_filepath = f"{filepath}.tmp"
+    with open(temp_filepath, 'w') as f:
+        json.dump(manifest, f, indent=2, sort_keys=True)
+    os.replace(temp_filepath, filepath)
+
+
+def is_remote_unchanged(entry: Optional[dict[str, Any]], remote: dict[str, Optional[str]]) -> bool:
+    """Checks if a remote file still matches the metadata recorded in a manifest entry.
+
+    The ETag is compared when the server sends one, the size and modification date otherwise.
+
+    Args:
+        entry (dict, optional): The manifest entry, None when the item was never processed.
+        remote (dict): The output of `get_remote_metadata`.
+
+    Returns:
+        bool: True if the remote file is known and unchanged, False otherwise.
+    """
+    if entry is None:
+        return False
+    if remote.get('etag'):
+        return bool(entry.get('etag') == remote['etag'])
+    return bool(entry.get('content_length') == remote.get('content_length') and entry.get('last_modified') == remote.get('last_modified'))
+
+
+def is_up_to_date(entry: Optional[dict[str, Any]], checksum: str, transform_hash: str) -> bool:
+    """Checks if an item was already processed from the same input with the same configuration.
+
+    Args:
+        entry (dict, optional): The manifest entry, None when the item was never processed.
+        checksum (str): The checksum of the current input file.
+        transform_hash (str): The hash of the current transform configuration.
+
+    Returns:
+        bool: True if the recorded output can be reused, False otherwise.
+    """
+    if entry is None:
+        return False
+    return bool(entry.get('checksum') == checksum
+                and entry.get('config_hash') == transform_hash
+                and os.path.exists(entry.get('output', '')))
@@ -0,0 +1,91 @@
+from datetime import datetime
+from typing import Any, List, Optional
+import pandas as pd
+import pyarrow.compute as pc
+import pyarrow.dataset as ds
+
+
+def match_filter(column: str, value: Any) -> pc.Expression:
+    """
+    Builds the filter of the rows whose column equals a value, or one of several values.
+
+    Args:
+        column (str): The column to filter on.
+        value (any): A single value, or a list / tuple / set of values.
+
+    Returns:
+        pc.Expression: The filter.
+    """
+    if isinstance(value, (list, tuple, set)):
+        return pc.field(column).isin(list(value))
+    return pc.field(column) == value
+
+
+def any_filter(*filters: pc.Expression) -> pc.Expression:
+    """Combines filters with OR, e.g. to match a station at either end of a trip."""
+    expression = filters[0]
+    for other in filters[1:]:
+        expression = expression | other
+    return expression
+
+
+def all_filter(filters: List[pc.Expression]) -> Optional[pc.Expression]:
+    """Combines filters with AND, None when there are no filters."""
+    if not filters:
+        return None
+    expression = filters[0]
+    for other in filters[1:]:
+        expression = expression & other
+    return expression
+
+
+def date_range_filter(column: str, start_date: Optional[datetime] = None, end_date: Optional[datetime] = None,
+                      partitioned: bool = False) -> List[pc.Expression]:
+    """
+    Builds the filters of the rows whose date is in [start_date, end_date).
+
+    Args:
+        column (str): The datetime column.
+        start_date (datetime, optional): First date of the range. Defaults to None (unbounded).
+        end_date (datetime, optional): End of the range, excluded. Defaults to None (unbounded).
+        partitioned (bool, optional): The dataset is partitioned by the year and month of the column (see
+            `send_to_parquet`), the months out of the range are then skipped without opening their files.
+            Defaults to False.
+
+    Returns:
+        list of pc.Expression: The filters, to combine with `all_filter`.
+    """
+    year, month = pc.field('year'), pc.field('month')
+    filters = []
+    if start_date is not None:
+        start = pd.Timestamp(start_date)
+        filters.append(pc.field(column) >= start.to_datetime64())
+        if partitioned:
+            filters.append((year > start.year) | ((year == start.year) & (month >= start.month)))
+    if end_date is not None:
+        end = pd.Timestamp(end_date)
+        filters.append(pc.field(column) < end.to_datetime64())
+        if partitioned:
+            # The month of an end date on the first of the month at midnight holds no row of the range
+            last = end - pd.Timedelta(1, 'ns')
+            filters.append((year < last.year) | ((year == last.year) & (month <= last.month)))
+    return filters
+
+
+def query_dataset(path: str, columns: Optional[List[str]] = None, filter: Optional[pc.Expression] = None) -> pd.DataFrame:
+    """
+    Reads the rows of a (hive partitioned) Parquet dataset that match a filter.
+
+    The filter is pushed down to the scan: partitions are pruned from their directory names, row groups
+    whose min/max statistics cannot match are skipped, and only the requested columns are decoded.
+
+    Args:
+        path (str): Path of the dataset directory.
+        columns (list of str, optional): Columns to read. Defaults to all columns.
+        filter (pc.Expression, optional): The row filter. Defaults to None (every row).
+
+    Returns:
+        pd.DataFrame: The matching rows, categorical columns stay categorical.
+    """
+    dataset = ds.dataset(path, format='parquet', partitioning='hive')
+    return dataset.to_table(columns=columns, filter=filter).to_pandas()
@@ -0,0 +1,166 @@
+from typing import Any, List, Sequence, Tuple
+import numpy as np
+import numpy.typing as npt
+import pandas as pd
+from etl.transform import lookup_positions
+
+
+def histogram_columns(value: str, edges: Sequence[float]) -> List[str]:
+    """
+    Names the bins of a histogram sketch: `<value>_lt_<edge>` for the values below each edge (and at or
+    above the previous one) and `<value>_ge_<last edge>` for the rest.
+    """
+    return [f"{value}_lt_{edge:g}" for edge in edges] + [f"{value}_ge_{edges[-1]:g}"]
+
+
+def aggregate(df: pd.DataFrame, keys: List[str], value: str, edges: Sequence[float]) -> pd.DataFrame:
+    """
+    Rolls a DataFrame up to one row per observed combination of keys.
+
+    Each row holds the 'count' of rows, the sum, min and max of the value, and a histogram of the value
+    over fixed bins. All of them are mergeable: rollups of disjoint rows combine into the rollup of all the
+    rows with `merge_rollups`, and quantiles are estimated from the histogram with `histogram_quantile`.
+
+    Args:
+        df (pd.DataFrame): The rows to roll up.
+        keys (list of str): The grouping columns, rows with a null key are dropped.
+        value (str): The numeric column to summarize.
+        edges (sequence of float): Increasing bin edges of the histogram.
+
+    Returns:
+        pd.DataFrame: The keys, 'count', `<value>_sum`, `<value>_min`, `<value>_max` and the histogram
+        columns (see `histogram_columns`), sorted by keys.
+    """
+    grouped = df.groupby(keys, observed=True, sort=True)
+    # Rows with a null key have no group (a NaN group number)
+    codes = grouped.ngroup().to_numpy(dtype=float)
+    rows = ~np.isnan(codes)
+    codes, values = codes[rows].astype(np.intp), df[value].to_numpy(dtype=float)[rows]
+    num_groups, num_bins = grouped.ngroups, len(edges) + 1
+
+    result = grouped.size().reset_index(name='count')
+    result[f'{value}_sum'] = np.bincount(codes, weights=values, minlength=num_groups)
+    result[f'{value}_min'] = grouped[value].min().to_numpy()
+    result[f'{value}_max'] = grouped[value].max().to_numpy()
+    bins = np.searchsorted(np.asarray(edges), values, side='right')
+    histogram = np.bincount(codes * num_bins + bins, minlength=num_groups * num_bins).reshape(num_groups, num_bins)
+    return pd.concat([result, pd.DataFrame(histogram, columns=histogram_columns(value, edges))], axis=1)
+
+
+def shared_codes(origin: pd.Series, destination: pd.Series) -> Tuple[npt.NDArray[np.intp], npt.NDArray[np.intp], pd.Index]:
+    """
+    Encodes two key columns as integer codes into the same labels, -1 for null keys.
+
+    Non-negative integer keys (e.g. station ids) are their own codes, other keys are looked up in the union
+    of the values of both columns, categorical keys through their categories only (see `lookup_positions`).
+
+    Returns:
+        tuple: The codes of origin, the codes of destination and the labels of the codes.
+    """
+    if pd.api.types.is_integer_dtype(origin) and pd.api.types.is_integer_dtype(destination):
+        if not ((origin < 0).any() or (destination < 0).any()):
+            codes = [keys.to_numpy(dtype=np.intp, na_value=-1) for keys in (origin, destination)]
+            return codes[0], codes[1], pd.RangeIndex(max(codes[0].max(initial=-1), codes[1].max(initial=-1)) + 1)
+    labels = pd.Index(pd.concat([unique_values(origin), unique_values(destination)]).drop_duplicates())
+    return lookup_positions(origin, labels), lookup_positions(destination, labels), labels
+
+
+def unique_values(keys: pd.Series) -> pd.Series:
+    """The distinct non-null values of a column, the categories of a categorical."""
+    values = keys.cat.categories.to_series() if isinstance(keys.dtype, pd.CategoricalDtype) else keys.drop_duplicates()
+    return values.dropna()
+
+
+def od_matrix(df: pd.DataFrame, origin: str, destination: str, values: List[str] = [], max_dense: int = 2**24) -> pd.DataFrame:
+    """
+    Counts the rows of each origin-destination pair (e.g. start and end station) and sums values over them.
+
+    The matrix is sparse: only the observed pairs are returned, one row each. Both keys are encoded as codes
+    into the same labels (see `shared_codes`) and each pair as the single integer origin * labels + destination,
+    the counts and sums are then computed with `np.bincount`, over every possible pair when there are at most
+    `max_dense` of them and over the distinct pairs (`np.unique`) otherwise. Like `aggregate`, matrices of
+    disjoint rows combine with `merge_rollups`.
+
+    Args:
+        df (pd.DataFrame): The rows, e.g. trips.
+        origin (str): The origin key column, rows with a null key are dropped.
+        destination (str): The destination key column.
+        values (list of str, optional): Numeric columns to sum, null values count as 0. Defaults to no column.
+        max_dense (int, optional): Most possible pairs counted with a dense array. Defaults to 2**24.
+
+    Returns:
+        pd.DataFrame: The origin, the destination (categorical for categorical keys), 'count' and `<value>_sum`
+        of each value, sorted by origin then destination codes.
+    """
+    origin_codes, destination_codes, labels = shared_codes(df[origin], df[destination])
+    valid = (origin_codes >= 0) & (destination_codes >= 0)
+    # Every row is kept as is when no key is null
+    rows: Any = slice(None) if valid.all() else np.flatnonzero(valid)
+    num_labels = len(labels)
+    pairs = origin_codes[rows].astype(np.int64) * num_labels + destination_codes[rows]
+    if num_labels * num_labels <= max_dense:
+        keys, inverse = np.arange(num_labels * num_labels), pairs
+    else:
+        keys, inverse = np.unique(pairs, return_inverse=True)
+    counts = np.bincount(inverse, minlength=len(keys))
+    observed = np.flatnonzero(counts)
+
+    categorical = isinstance(df[origin].dtype, pd.CategoricalDtype) or isinstance(df[destination].dtype, pd.CategoricalDtype)
+    origin_keys, destination_keys = np.divmod(keys[observed], num_labels)
+    result = pd.DataFrame({col: pd.Categorical.from_codes(codes, labels) if categorical else labels.take(codes)
+                           for col, codes in [(origin, origin_keys), (destination, destination_keys)]})
+    result['count'] = counts[observed]
+    for value in values:
+        weights = df[value].to_numpy(dtype=float, na_value=np.nan)[rows]
+        weights = np.where(np.isnan(weights), 0, weights)
+        result[f'{value}_sum'] = np.bincount(inverse, weights=weights, minlength=len(keys))[observed]
+    return result
+
+
+def merge_rollups(rollups: List[pd.DataFrame], keys: List[str]) -> pd.DataFrame:
+    """
+    Combines rollups of disjoint rows (e.g. of the chunks of a file) into the rollup of all of them.
+
+    Counts, sums and histogram bins add up, `_min` and `_max` columns keep the smallest and largest value.
+
+    Args:
+        rollups (list of pd.DataFrame): Rollups from `aggregate` with the same keys, value and edges.
+        keys (list of str): The grouping columns.
+
+    Returns:
+        pd.DataFrame: The merged rollup, sorted by keys.
+    """
+    df = pd.concat(rollups, ignore_index=True)
+    functions = {col: 'min' if col.endswith('_min') else 'max' if col.endswith('_max') else 'sum' for col in df.columns if col not in keys}
+    return df.groupby(keys, observed=True, sort=True).agg(functions).reset_index()
+
+
+def histogram_quantile(rollup: pd.DataFrame, value: str, edges: Sequence[float], q: float) -> pd.Series:
+    """
+    Estimates a quantile of the value for each row of a rollup, interpolating linearly within the bin
+    holding the quantile. The outer bins are bounded by the min and max of the row, so the error is at most
+    the width of one bin.
+
+    Args:
+        rollup (pd.DataFrame): A rollup from `aggregate` or `merge_rollups`.
+        value (str): The summarized column.
+        edges (sequence of float): The bin edges of the rollup.
+        q (float): The quantile, between 0 and 1.
+
+    Returns:
+        pd.Series: The estimated quantile of each row.
+    """
+    histogram = rollup[histogram_columns(value, edges)].to_numpy(dtype=float)
+    cumulative = histogram.cumsum(axis=1)
+    target = q * cumulative[:, -1]
+    # First bin whose cumulative count reaches the target
+    bins = (cumulative < target[:, None]).sum(axis=1).clip(max=len(edges))
+    rows = np.arange(len(rollup))
+
+    bounds = np.concatenate([[-np.inf], np.asarray(edges, dtype=float), [np.inf]])
+    low = np.maximum(bounds[bins], rollup[f'{value}_min'].to_numpy(dtype=float))
+    high = np.minimum(bounds[bins + 1], rollup[f'{value}_max'].to_numpy(dtype=float))
+    below = cumulative[rows, bins] - histogram[rows, bins]
+    with np.errstate(invalid='ignore', divide='ignore'):
+        fraction = np.nan_to_num((target - below) / histogram[rows, bins]).clip(0, 1)
+    return pd.Series(low + fraction * (high - low), index=rollup.index, name=f'{value}_q{q:g}')
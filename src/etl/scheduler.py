@@ -0,0 +1,145 @@
+import queue
+import threading
+from typing import Any, Callable, Iterable, List, NamedTuple
+from etl import instrument
+
+# Marks the end of the items in a queue
+_DONE = object()
+
+
+class Stage(NamedTuple):
+    """A step of `run_stages`: a function of one item, run by `workers` threads at once.
+
+    An ordered stage runs one item at a time in the order of the items, whatever order the previous
+    stages finish them in, e.g. for a stage that updates state shared by all the items.
+    """
+    name: str
+    func: Callable[[Any], Any]
+    workers: int = 1
+    ordered: bool = False
+
+
+def run_stages(items: Iterable[Any], stages: List[Stage], queue_size: int = 2, poll_interval: float = 0.1) -> List[Any]:
+    """
+    Passes each item through a chain of stages, all stages running at the same time on different items.
+
+    Stages are connected by bounded queues, so while item N is in the last stage, item N+1 can be in
+    the one before and so on, and wall time approaches the time of the slowest stage instead of the sum
+    of all stages. A full queue blocks the stage feeding it, which bounds the number of items in flight
+    (and the memory they hold). Stages run in threads, which suits stages that wait on the network or the
+    disk or spend their time in code that releases the GIL (e.g. pandas parsing and numpy). Every call is
+    recorded by `etl.instrument` under the name of its stage.
+
+    An ordered stage holds the items that arrive before their turn until the earlier ones have passed.
+    To bound these held items, no new item enters the first stage while it is more than the items the
+    stages and the queues can hold ahead of the next item of the ordered stages.
+
+    Args:
+        items (iterable): The items, e.g. months.
+        stages (list of Stage): The stages, in order, each stage gets the output of the previous one.
+        queue_size (int, optional): Most items waiting between two stages. Defaults to 2.
+        poll_interval (float, optional): Seconds between checks for a failure while waiting. Defaults to 0.1.
+
+    Returns:
+        list: The output of the last stage for each item, in the order of the items.
+
+    Raises:
+        ValueError: If an ordered stage has more than one worker.
+        Exception: The first exception raised by a stage, once every stage has stopped.
+    """
+    for stage in stages:
+        if stage.ordered and stage.workers != 1:
+            raise ValueError(f"Invalid number of workers {stage.workers} for ordered stage '{stage.name}'. Ordered stages have one worker")
+    queues: List[queue.Queue[Any]] = [queue.Queue(maxsize=queue_size) for _ in stages]
+    results: dict[int, Any] = {}
+    errors: List[BaseException] = []
+    stop = threading.Event()
+    lock = threading.Lock()
+    remaining = [stage.workers for stage in stages]
+    # One slot per item the stages and the queues hold, taken when an item is fed and given back once
+    # it has passed every ordered stage
+    last_ordered = max((index for index, stage in enumerate(stages) if stage.ordered), default=-1)
+    window = threading.Semaphore(sum(stage.workers for stage in stages) + queue_size * len(stages))
+
+    def put(q: queue.Queue[Any], item: Any) -> bool:
+        while not stop.is_set():
+            try:
+                q.put(item, timeout=poll_interval)
+                return True
+            except queue.Full:
+                pass
+        return False
+
+    def get(q: queue.Queue[Any]) -> Any:
+        while not stop.is_set():
+            try:
+                return q.get(timeout=poll_interval)
+            except queue.Empty:
+                pass
+        return _DONE
+
+    def acquire(semaphore: threading.Semaphore) -> bool:
+        while not stop.is_set():
+            if semaphore.acquire(timeout=poll_interval):
+                return True
+        return False
+
+    def feed() -> None:
+        try:
+            for i, item in enumerate(items):
+                if last_ordered >= 0 and not acquire(window):
+                    return
+                if not put(queues[0], (i, item)):
+                    return
+        except BaseException as e:
+            errors.append(e)
+            stop.set()
+        put(queues[0], _DONE)
+
+    def work(index: int) -> None:
+        stage = stages[index]
+        # Items of an ordered stage waiting for their turn, by position
+        held: dict[int, Any] = {}
+        next_i = 0
+        try:
+            while (task := get(queues[index])) is not _DONE:
+                if stage.ordered:
+                    held[task[0]] = task[1]
+                    tasks = []
+                    while next_i in held:
+                        tasks.append((next_i, held.pop(next_i)))
+                        next_i += 1
+                else:
+                    tasks = [task]
+                for i, item in tasks:
+                    with instrument.step(stage.name):
+                        output = stage.func(item)
+                    if index == last_ordered:
+                        window.release()
+                    if index + 1 < len(stages):
+                        put(queues[index + 1], (i, output))
+                    else:
+                        results[i] = output
+        except BaseException as e:
+            with lock:
+                errors.append(e)
+            stop.set()
+        # Let the other workers of the stage see the end, the last one passes it on
+        put(queues[index], _DONE)
+        with lock:
+            remaining[index] -= 1
+            last = remaining[index] == 0
+        if last and index + 1 < len(stages):
+            put(queues[index + 1], _DONE)
+
+    threads = [threading.Thread(target=feed, name='feed', daemon=True)]
+    for index, stage in enumerate(stages):
+        threads += [threading.Thread(target=work, args=(index,), name=f'{stage.name}-{n}', daemon=True) for n in range(stage.workers)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    if errors:
+        raise errors[0]
+    return [results[i] for i in sorted(results)]
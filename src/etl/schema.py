@@ -0,0 +1,59 @@
+from typing import Any
+import pandas as pd
+
+
+def apply_schema(df: pd.DataFrame, schema: dict[str, Any]) -> pd.DataFrame:
+    """
+    Casts the columns of a DataFrame to the dtypes of a schema.
+
+    Only the columns whose dtype differs from the schema are converted, columns missing from the
+    schema are left as they are.
+
+    Args:
+        df (pd.DataFrame): The DataFrame to cast.
+        schema (dict): Maps column names to dtypes, as accepted by `DataFrame.astype`.
+
+    Returns:
+        pd.DataFrame: The DataFrame with the schema dtypes.
+    """
+    changes = {col: dtype for col, dtype in schema.items() if col in df.columns and not is_dtype(df[col], dtype)}
+    return df.astype(changes, copy=False) if changes else df
+
+
+def is_dtype(column: pd.Series, dtype: Any) -> bool:
+    """Whether a column already has a dtype, any categorical matches 'category'."""
+    if dtype == 'category':
+        return isinstance(column.dtype, pd.CategoricalDtype)
+    return bool(column.dtype == pd.api.types.pandas_dtype(dtype))
+
+
+def read_dtypes(schema: dict[str, Any]) -> dict[str, Any]:
+    """The schema without its datetime columns, for the `dtype` argument of `read_file` (dates go to `parse_dates`)."""
+    return {col: dtype for col, dtype in schema.items() if not pd.api.types.is_datetime64_any_dtype(pd.api.types.pandas_dtype(dtype))}
+
+
+def memory_usage(df: pd.DataFrame) -> int:
+    """Resident size of a DataFrame in bytes, including the Python strings of object columns."""
+    return int(df.memory_usage(deep=True).sum())
+
+
+def memory_report(before: pd.DataFrame, after: pd.DataFrame) -> str:
+    """
+    Formats the memory used by each column of a DataFrame before and after a change of dtypes.
+
+    Args:
+        before (pd.DataFrame): The DataFrame with the original dtypes.
+        after (pd.DataFrame): The same data with the new dtypes.
+
+    Returns:
+        str: One line per column and a total line with the reduction factor.
+    """
+    usage_before, usage_after = before.memory_usage(deep=True, index=False), after.memory_usage(deep=True, index=False)
+    lines = [f"{'column':<32} {'before':>14} {'after':>14} {'MB before':>10} {'MB after':>10}"]
+    for col in before.columns:
+        lines.append(f"{col:<32} {str(before[col].dtype):>14} {str(after[col].dtype) if col in after else '-':>14} "
+                     f"{usage_before[col] / 2**20:>10,.1f} {usage_after.get(col, 0) / 2**20:>10,.1f}")
+    total_before, total_after = usage_before.sum(), usage_after.sum()
+    lines.append(f"{'total':<32} {'':>14} {'':>14} {total_before / 2**20:>10,.1f} {total_after / 2**20:>10,.1f} "
+                 f"({total_before / max(total_after, 1):.1f}x smaller)")
+    return '\n'.join(lines)
@@ -0,0 +1,216 @@
+from concurrent.futures import ProcessPoolExecutor
+from typing import Any, Optional
+import numpy as np
+import numpy.typing as npt
+import pandas as pd
+import geopandas as gpd
+import numexpr
+import shapely
+
+# Index of the polygons in a worker process, set once by `_init_worker`
+_worker_index: Optional['PolygonIndex'] = None
+# Mean radius of the Earth (IUGG)
+EARTH_RADIUS_KM = 6371.0088
+
+
+def first_match(point_idx: npt.NDArray[np.intp], polygon_idx: npt.NDArray[np.intp], num_points: int) -> npt.NDArray[np.int32]:
+    """
+    Turns (point, polygon) match pairs into one polygon id per point, the lowest one when a point matches several.
+
+    Returns:
+        np.ndarray: The polygon id of each point, -1 for points without a match.
+    """
+    order = np.lexsort((polygon_idx, point_idx))
+    point_idx, polygon_idx = point_idx[order], polygon_idx[order]
+    first = np.unique(point_idx, return_index=True)[1]
+    ids = np.full(num_points, -1, dtype=np.int32)
+    ids[point_idx[first]] = polygon_idx[first]
+    return ids
+
+
+def haversine_km(lat1: Any, lng1: Any, lat2: Any, lng2: Any) -> npt.NDArray[np.float64]:
+    """
+    Computes the great-circle distance between two arrays of points.
+
+    The formula is evaluated by numexpr in a single pass over the inputs, without a temporary array per
+    operation, in float64 whatever the dtype of the coordinates.
+
+    Args:
+        lat1 (array-like): The latitude of the first points, in degrees.
+        lng1 (array-like): The longitude of the first points, in degrees.
+        lat2 (array-like): The latitude of the second points, in degrees.
+        lng2 (array-like): The longitude of the second points, in degrees.
+
+    Returns:
+        np.ndarray: The distance of each pair of points in kilometers, NaN when a coordinate is null.
+    """
+    coords: dict[str, Any] = {name: np.asarray(values, dtype=np.float64) for name, values in zip(['lat1', 'lng1', 'lat2', 'lng2'], [lat1, lng1, lat2, lng2])}
+    distance: npt.NDArray[np.float64] = numexpr.evaluate(
+        "2 * r * arcsin(sqrt(sin((lat2 - lat1) * d / 2) ** 2 + cos(lat1 * d) * cos(lat2 * d) * sin((lng2 - lng1) * d / 2) ** 2))",
+        local_dict={**coords, 'd': np.pi / 180, 'r': EARTH_RADIUS_KM})
+    return distance
+
+
+def _init_worker(index: 'PolygonIndex') -> None:
+    global _worker_index
+    _worker_index = index
+
+
+def _query_chunk(lng: npt.NDArray[np.float64], lat: npt.NDArray[np.float64]) -> npt.NDArray[np.int32]:
+    assert _worker_index is not None
+    return _worker_index.query_local(lng, lat)
+
+
+class PolygonIndex:
+    """
+    A point-in-polygon service over a fixed set of polygons (e.g. neighborhoods), built once and reused.
+
+    The bounds of the polygons are cut into a grid, and an STRtree of the polygons finds the polygons of
+    each cell when the index is built. A point in a cell covered by a single polygon gets it with a bit of
+    arithmetic, only the points in the cells along the borders are tested against their candidate polygons.
+    No point geometry is ever created.
+
+    Points are resolved to integer polygon ids, their attributes are then gathered with array takes (see
+    `take`) instead of joining GeoDataFrames. Large inputs are split across a pool of worker processes, each
+    holding its own copy of the index. The pool is started on the first large query and kept until `close`.
+
+    Usage:
+        with PolygonIndex(neighborhoods, workers=4) as index:
+            names = index.take(index.query(df['lng'], df['lat']), 'pri_neigh')
+    """
+
+    def __init__(self, geo_df: gpd.GeoDataFrame, workers: int = 1, grid_size: int = 256, min_chunk_size: int = 250_000):
+        """
+        Args:
+            geo_df (gpd.GeoDataFrame): The polygons, reprojected to longitude / latitude (EPSG:4326) if needed.
+            workers (int, optional): Number of worker processes for large queries. Defaults to 1 (no pool).
+            grid_size (int, optional): Number of grid cells along each axis. Defaults to 256.
+            min_chunk_size (int, optional): Fewest points sent to a worker, smaller queries run in-process.
+                Defaults to 250,000.
+        """
+        if geo_df.crs is not None and geo_df.crs.to_epsg() != 4326:
+            geo_df = geo_df.to_crs(epsg=4326)
+        self.geometries = np.array(geo_df.geometry.to_list(), dtype=object)
+        self.attributes = pd.DataFrame(geo_df.drop(columns=geo_df.geometry.name)).reset_index(drop=True)
+        self.workers = workers
+        self.grid_size = grid_size
+        self.min_chunk_size = min_chunk_size
+        self._pool: Optional[ProcessPoolExecutor] = None
+        self._codes: dict[str, tuple[npt.NDArray[np.intp], pd.Index]] = {}
+        shapely.prepare(self.geometries)
+        self.tree = shapely.STRtree(self.geometries)
+        self._build_grid()
+
+    def _build_grid(self) -> None:
+        n = self.grid_size
+        self.bounds = shapely.total_bounds(self.geometries)
+        min_x, min_y, max_x, max_y = self.bounds
+        self.cell_width, self.cell_height = max(max_x - min_x, 1e-12) / n, max(max_y - min_y, 1e-12) / n
+        i, j = np.divmod(np.arange(n * n), n)
+        cells = shapely.box(min_x + i * self.cell_width, min_y + j * self.cell_height,
+                            min_x + (i + 1) * self.cell_width, min_y + (j + 1) * self.cell_height)
+
+        # Candidate polygons of each cell, sorted by cell then by polygon
+        cell_idx, polygon_idx = self.tree.query(cells, predicate='intersects')
+        order = np.lexsort((polygon_idx, cell_idx))
+        cell_idx, polygon_idx = cell_idx[order], polygon_idx[order]
+
+        # A cell with a single candidate that holds it whole belongs to that polygon
+        counts = np.bincount(cell_idx, minlength=n * n)
+        single = counts[cell_idx] == 1
+        owned = single.copy()
+        owned[single] = shapely.contains_properly(self.geometries[polygon_idx[single]], cells[cell_idx[single]])
+        self.cell_owner = np.full(n * n, -1, dtype=np.int32)
+        self.cell_owner[cell_idx[owned]] = polygon_idx[owned]
+
+        # The other cells keep their candidates, in CSR form
+        self.candidates = polygon_idx[~owned]
+        self.candidate_ptr = np.searchsorted(cell_idx[~owned], np.arange(n * n + 1))
+
+    def __getstate__(self) -> dict[str, Any]:
+        # Shapely geometries and trees are sent to the workers as WKB
+        state = self.__dict__.copy()
+        state.update({'_pool': None, 'tree': None, 'geometries': shapely.to_wkb(self.geometries)})
+        return state
+
+    def __setstate__(self, state: dict[str, Any]) -> None:
+        self.__dict__.update(state)
+        self.geometries = shapely.from_wkb(self.geometries)
+        shapely.prepare(self.geometries)
+        self.tree = shapely.STRtree(self.geometries)
+
+    def __len__(self) -> int:
+        return len(self.attributes)
+
+    def __enter__(self) -> 'PolygonIndex':
+        return self
+
+    def __exit__(self, *exc_info: Any) -> None:
+        self.close()
+
+    def close(self) -> None:
+        """Stops the worker processes, the index can still be queried in-process."""
+        if self._pool is not None:
+            self._pool.shutdown()
+            self._pool = None
+
+    def query(self, lng: Any, lat: Any) -> npt.NDArray[np.int32]:
+        """
+        Finds the polygon that contains each point, across the worker processes for large inputs.
+
+        Args:
+            lng (array-like): The longitude (x) of the points.
+            lat (array-like): The latitude (y) of the points.
+
+        Returns:
+            np.ndarray: The id (row position in the polygons) of the polygon of each point, -1 for points in no
+            polygon or with null coordinates. A point on a shared border gets the first of its polygons.
+        """
+        lng, lat = np.asarray(lng, dtype=float), np.asarray(lat, dtype=float)
+        num_chunks = min(self.workers, len(lng) // self.min_chunk_size)
+        if num_chunks <= 1:
+            return self.query_local(lng, lat)
+        if self._pool is None:
+            self._pool = ProcessPoolExecutor(max_workers=self.workers, initializer=_init_worker, initargs=(self,))
+        chunks = np.array_split(np.arange(len(lng)), num_chunks)
+        results = self._pool.map(_query_chunk, [lng[chunk] for chunk in chunks], [lat[chunk] for chunk in chunks])
+        return np.concatenate(list(results))
+
+    def query_local(self, lng: npt.NDArray[np.float64], lat: npt.NDArray[np.float64]) -> npt.NDArray[np.int32]:
+        """Same as `query`, in the calling process."""
+        n = self.grid_size
+        col = np.floor((lng - self.bounds[0]) / self.cell_width)
+        row = np.floor((lat - self.bounds[1]) / self.cell_height)
+        positions = np.flatnonzero((col >= 0) & (col < n) & (row >= 0) & (row < n))
+        cells = (col[positions] * n + row[positions]).astype(np.intp)
+
+        ids = np.full(len(lng), -1, dtype=np.int32)
+        ids[positions] = self.cell_owner[cells]
+        border = ids[positions] < 0
+        positions, cells = positions[border], cells[border]
+
+        # One (point, candidate polygon) pair per candidate of the cell of each border point
+        counts = self.candidate_ptr[cells + 1] - self.candidate_ptr[cells]
+        point_idx = np.repeat(positions, counts)
+        offsets = np.arange(len(point_idx)) - np.repeat(np.cumsum(counts) - counts, counts)
+        polygon_idx = self.candidates[np.repeat(self.candidate_ptr[cells], counts) + offsets]
+        inside = shapely.contains_xy(self.geometries[polygon_idx], lng[point_idx], lat[point_idx])
+
+        matches = first_match(point_idx[inside], polygon_idx[inside], len(lng))
+        return np.where(ids >= 0, ids, matches)
+
+    def take(self, ids: npt.NDArray[np.int32], field: str) -> pd.Categorical:
+        """
+        Gathers an attribute of the polygons by id, without copying a string per point.
+
+        Args:
+            ids (np.ndarray): Polygon ids, as returned by `query`.
+            field (str): The attribute column of the polygons.
+
+        Returns:
+            pd.Categorical: The attribute of each polygon, null for the ids -1.
+        """
+        if field not in self._codes:
+            self._codes[field] = pd.factorize(self.attributes[field])
+        codes, categories = self._codes[field]
+        return pd.Categorical.from_codes(np.where(ids >= 0, codes.take(ids, mode='clip'), -1), categories=categories)
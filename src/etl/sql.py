@@ -0,0 +1,241 @@
+import os
+import shutil
+import uuid
+from typing import Any, List, Optional
+import pandas as pd
+import pyarrow.dataset as ds
+from etl.validate import Rule, reasons_dtype
+
+
+def connect(memory_limit: Optional[str] = None, threads: Optional[int] = None, temp_directory: Optional[str] = None) -> Any:
+    """
+    Opens an in-process DuckDB database, an out-of-core columnar engine that spills to disk past its memory limit.
+
+    duckdb is an optional dependency, it is only imported when a connection is opened.
+
+    Args:
+        memory_limit (str, optional): Memory the engine may use before spilling, e.g. '6GB'. Defaults to 80% of the RAM.
+        threads (int, optional): Number of worker threads. Defaults to one per core.
+        temp_directory (str, optional): Directory of the spilled data. Defaults to a directory next to the database.
+
+    Returns:
+        duckdb.DuckDBPyConnection: The connection.
+
+    Raises:
+        ImportError: If duckdb is not installed.
+    """
+    try:
+        import duckdb
+    except ImportError as e:
+        raise ImportError("The duckdb backend requires duckdb, install it with 'pip install duckdb'") from e
+    con = duckdb.connect()
+    # Rows of a scan do not need to keep their order, which lets large results stream to disk
+    con.execute("SET preserve_insertion_order = false")
+    if memory_limit is not None:
+        con.execute(f"SET memory_limit = {quote(memory_limit)}")
+    if threads is not None:
+        con.execute(f"SET threads = {int(threads)}")
+    if temp_directory is not None:
+        con.execute(f"SET temp_directory = {quote(temp_directory)}")
+    return con
+
+
+def quote(value: str) -> str:
+    """Quotes a string literal."""
+    return "'" + value.replace("'", "''") + "'"
+
+
+def quote_name(name: str) -> str:
+    """Quotes a column or table name."""
+    return '"' + name.replace('"', '""') + '"'
+
+
+def sql_type(dtype: Any) -> str:
+    """
+    Maps a pandas dtype to the DuckDB type holding the same values.
+
+    Raises:
+        ValueError: If the dtype has no DuckDB equivalent.
+    """
+    if dtype in (str, object) or (isinstance(dtype, str) and dtype in ('category', 'string[pyarrow]')):
+        return 'VARCHAR'
+    match str(pd.api.types.pandas_dtype(dtype)).lower():
+        case 'float32':
+            return 'FLOAT'
+        case 'float64':
+            return 'DOUBLE'
+        case 'int32':
+            return 'INTEGER'
+        case 'int64':
+            return 'BIGINT'
+        case 'bool' | 'boolean':
+            return 'BOOLEAN'
+        case 'datetime64[ns]':
+            return 'TIMESTAMP'
+        case 'string' | 'object':
+            return 'VARCHAR'
+        case other:
+            raise ValueError(f"Invalid dtype '{other}'. Valid dtypes are strings, categories, floats, integers, booleans and datetimes")
+
+
+def read_csv_sql(files: List[str], schema: dict[str, Any], timestamp_format: Optional[str] = None, filename: bool = False) -> str:
+    """
+    Builds the SQL table expression scanning csv files with the types of a schema. Files are scanned in
+    parallel and streamed, they are never loaded whole in memory.
+
+    Args:
+        files (list of str): Paths of the csv files, which all have the same header.
+        schema (dict): Maps column names to pandas dtypes, columns are matched by name.
+        timestamp_format (str, optional): strftime format of the datetime columns. Defaults to None.
+        filename (bool, optional): Add a `filename` column with the path of the file of each row. Defaults to False.
+
+    Returns:
+        str: The `read_csv(...)` table expression.
+    """
+    types = ', '.join(f"{quote(col)}: {quote(sql_type(dtype))}" for col, dtype in schema.items())
+    options = f", timestampformat={quote(timestamp_format)}" if timestamp_format is not None else ''
+    options += ", filename=true" if filename else ''
+    return f"read_csv([{', '.join(quote(file) for file in files)}], header=true, auto_detect=true, types={{{types}}}{options})"
+
+
+def not_null_sql(columns: List[str]) -> str:
+    """SQL condition that is true when none of the columns is null, like `remove_null_values`."""
+    return ' AND '.join(f"{quote_name(col)} IS NOT NULL" for col in columns) or 'true'
+
+
+def literal(value: Any) -> str:
+    """SQL literal of a string or a number."""
+    return quote(value) if isinstance(value, str) else repr(value)
+
+
+def rule_sql(rule: Rule) -> str:
+    """
+    SQL version of `etl.validate.violations`, a condition that is true when a row breaks a rule. 'unique' rules
+    depend on the other rows, they are checked by `reasons_sql`.
+
+    Returns:
+        str: The condition, never null.
+
+    Raises:
+        ValueError: If the check of the rule is not one of the valid checks.
+    """
+    columns = [quote_name(col) for col in rule.columns]
+    match rule.check:
+        case "notnull":
+            broken = [f"{col} IS NULL" for col in columns]
+        case "between":
+            bounds = rule.value if isinstance(rule.value, list) else [rule.value] * len(columns)
+            broken = [f"{col} < {literal(low)} OR {col} > {literal(high)}" for col, (low, high) in zip(columns, bounds)]
+        case "in":
+            values = ', '.join(literal(value) for value in rule.value)
+            broken = [f"{col} NOT IN ({values})" for col in columns]
+        case "span":
+            start, end = columns
+            low, high = (int(value / pd.Timedelta(1, 'ms')) for value in rule.value)
+            span = f"epoch_ms({end}) - epoch_ms({start})"
+            broken = [f"{span} < {low} OR {span} >= {high}"]
+        case _:
+            raise ValueError(f"Invalid check '{rule.check}'. Valid checks are 'notnull', 'between', 'in', 'span'")
+    return f"coalesce({' OR '.join(f'({condition})' for condition in broken)}, false)"
+
+
+def repeats_sql(table: str, columns: List[str], name: str, partition_by: List[str] = [], order_by: List[str] = []) -> str:
+    """
+    Builds the SQL table expression adding a column that is true for the rows repeating the columns of an earlier row,
+    like `etl.validate.repeated`.
+
+    Rows have no order in the engine, the rows repeating an earlier row are the rows after the first one in `order_by`
+    order among the rows with the same columns. Only the rows of the keys seen more than once, found by a narrow
+    aggregate, are ranked, so the whole rows are never held by a window.
+
+    Args:
+        table (str): SQL table expression of the rows, scanned three times.
+        columns (list of str): The key columns, rows with a null key are never repeats.
+        name (str): Name of the added column.
+        partition_by (list of str, optional): Extra key columns, e.g. the file of the row. Defaults to [].
+        order_by (list of str, optional): Order of the rows. Defaults to [] (any order).
+
+    Returns:
+        str: The table expression.
+    """
+    keys = [quote_name(col) for col in partition_by + columns]
+    repeated_keys = f"SELECT {', '.join(keys)} FROM {table} WHERE {not_null_sql(columns)} GROUP BY ALL HAVING count(*) > 1"
+    match = f"EXISTS (SELECT 1 FROM ({repeated_keys}) r WHERE {' AND '.join(f'r.{key} = t.{key}' for key in keys)})"
+    window = f"PARTITION BY {', '.join(keys)}" + (f" ORDER BY {', '.join(quote_name(col) for col in order_by)}" if order_by else '')
+    return (f"(SELECT *, false AS {quote_name(name)} FROM {table} t WHERE NOT {match} "
+            f"UNION ALL SELECT *, row_number() OVER ({window}) > 1 AS {quote_name(name)} FROM {table} t WHERE {match})")
+
+
+def reasons_sql(table: str, rules: List[Rule], column: str = 'reasons', partition_by: List[str] = [], order_by: List[str] = []) -> str:
+    """
+    SQL version of `etl.validate.validate`, the rows of a table with the bitmask of the rules they break
+    (bit i for `rules[i]`, 0 for valid rows).
+
+    Args:
+        table (str): SQL table expression of the rows.
+        rules (list of Rule): The rules, at most 64.
+        column (str, optional): Name of the reasons column. Defaults to 'reasons'.
+        partition_by (list of str, optional): Extra key columns of 'unique' rules, see `repeats_sql`. Defaults to [].
+        order_by (list of str, optional): Order of the rows of 'unique' rules, see `repeats_sql`. Defaults to [].
+
+    Returns:
+        str: The query, the reasons have the dtype of `etl.validate.validate`.
+
+    Raises:
+        ValueError: If there are more than 64 rules.
+    """
+    dtype = {1: 'UTINYINT', 2: 'USMALLINT', 4: 'UINTEGER', 8: 'UBIGINT'}[reasons_dtype(rules).itemsize]
+    conditions, repeats = [], []
+    for bit, rule in enumerate(rules):
+        if rule.check == 'unique':
+            repeats.append(quote_name(f"_repeat_{bit}"))
+            table = repeats_sql(table, rule.columns, f"_repeat_{bit}", partition_by, order_by)
+            conditions.append(repeats[-1])
+        else:
+            conditions.append(rule_sql(rule))
+    bits = [f"CASE WHEN {condition} THEN {1 << bit} ELSE 0 END" for bit, condition in enumerate(conditions)]
+    exclude = f" EXCLUDE ({', '.join(repeats)})" if repeats else ''
+    return f"SELECT *{exclude}, CAST({' + '.join(bits) or '0'} AS {dtype}) AS {quote_name(column)} FROM {table}"
+
+
+def copy_to_csv(con: Any, query: str, filename: str, destination: str, timestamp_format: Optional[str] = None) -> None:
+    """
+    Writes the result of a query to a csv file with a header, streaming it from the engine.
+
+    Args:
+        con (duckdb.DuckDBPyConnection): The connection.
+        query (str): The query.
+        filename (str): Name of the csv file.
+        destination (str): Directory where the file should be saved.
+        timestamp_format (str, optional): strftime format of the datetime columns. Defaults to ISO 8601.
+    """
+    options = f", TIMESTAMPFORMAT {quote(timestamp_format)}" if timestamp_format is not None else ''
+    con.execute(f"COPY ({query}) TO {quote(os.path.join(destination, filename))} (HEADER, DELIMITER ','{options})")
+
+
+def copy_to_parquet(con: Any, query: str, dirname: str, destination: str, date_column: Optional[str] = None,
+                    batch_size: int = 1_000_000, row_group_size: int = 100_000) -> None:
+    """
+    Writes the result of a query to a Parquet dataset, partitioned by year and month of a date column and
+    sorted by it like `send_to_parquet`. The result is streamed in Arrow batches, an existing dataset is replaced.
+
+    Args:
+        con (duckdb.DuckDBPyConnection): The connection.
+        query (str): The query.
+        dirname (str): Name of the dataset directory.
+        destination (str): Directory where the dataset should be saved.
+        date_column (str, optional): Datetime column of the year=/month= partitions. Defaults to None.
+        batch_size (int, optional): Number of rows per batch. Defaults to 1,000,000.
+        row_group_size (int, optional): Most rows per row group. Defaults to 100,000.
+    """
+    path = os.path.join(destination, dirname)
+    if os.path.exists(path):
+        shutil.rmtree(path)
+    partitioning = None
+    if date_column is not None:
+        column = quote_name(date_column)
+        query = f"SELECT *, year({column}) AS year, month({column}) AS month FROM ({query}) ORDER BY {column}"
+        partitioning = ['year', 'month']
+    reader = con.execute(query).fetch_record_batch(batch_size)
+    ds.write_dataset(reader, path, format='parquet', partitioning=partitioning, partitioning_flavor='hive',
+                     basename_template=f"{uuid.uuid4().hex}-{{i}}.parquet", max_rows_per_group=row_group_size)
@@ -1,32 +1,82 @@
-from typing import Callable, List, Union
+import re
+from typing import Any, Callable, List, Optional, Tuple, Union, overload
+import numpy as np
+import numpy.typing as npt
 import pandas as pd
 import geopandas as gpd
+from etl import instrument
+from etl.instrument import instrumented
+from etl.spatial import PolygonIndex
 
 
-def add_geo_field_from_lat_long(df: pd.DataFrame, geo_df: gpd.GeoDataFrame, x: str, y: str) -> pd.DataFrame:
+@instrumented
+def add_geo_field_from_lat_long(df: pd.DataFrame, geo_df: gpd.GeoDataFrame, x: str, y: str, index: Optional[PolygonIndex] = None) -> pd.DataFrame:
     """
     Adds a geographic field to a pandas DataFrame based on latitude and longitude coordinates.
 
+    Each point is resolved to the id of its polygon through a spatial index, the attributes of the polygons
+    are then gathered by id, so no GeoDataFrame of the points is ever built.
+
     Args:
         df (pd.DataFrame): The input DataFrame that contains the latitude and longitude columns.
         geo_df (gpd.GeoDataFrame): A GeoDataFrame that represents the geographical boundaries to which the coordinates will be matched.
         x (str): The name of the column in df that contains the longitude coordinates.
         y (str): The name of the column in df that contains the latitude coordinates.
+        index (PolygonIndex, optional): A prebuilt index of geo_df, reused across calls. Defaults to None.
 
     Returns:
-        pd.DataFrame: A new DataFrame that includes the matched geographical features from geo_df based on the input latitude and longitude columns.
+        pd.DataFrame: A new DataFrame with the rows of df that fall in a polygon of geo_df and the (non geometry)
+        columns of that polygon. A point on a shared border gets the first of its polygons.
+    """
+    index = PolygonIndex(geo_df) if index is None else index
+    ids = index.query(df[x], df[y])
+    rows = np.flatnonzero(ids >= 0)
+    attributes = index.attributes.take(ids[rows]).reset_index(drop=True)
+    return pd.concat([df.take(rows).reset_index(drop=True), attributes], axis=1)
+
+
+@instrumented
+def add_region_from_lat_long(df: pd.DataFrame, geo_df: gpd.GeoDataFrame, x: str, y: str, field: str, column_name: str,
+                             bbox: Optional[Tuple[float, float, float, float]] = None, default: str = "None") -> pd.DataFrame:
     """
-    # create a GeoSeries of Point objects and convert to geopandas
-    geometry = gpd.points_from_xy(df[x], df[y])
-    df_gdf = gpd.GeoDataFrame(df, geometry=geometry, crs='EPSG:4326')
-    # Set up correct projection
-    df_gdf = df_gdf.set_crs(epsg=4326)
-    geo_df = geo_df.set_crs(epsg=4326)
-    # Join tables
-    combined_gdf = df_gdf.sjoin(geo_df, how="inner", predicate='within').reset_index(drop=True)
-    return pd.DataFrame(combined_gdf)
+    Adds a column holding the name of the region that contains each row's coordinates.
 
+    All points are resolved at once with a single spatial-index query instead of one polygon scan per row.
+    When a bounding box is given, points outside of it are never joined and receive the default value.
+
+    Args:
+        df (pd.DataFrame): The input DataFrame that contains the latitude and longitude columns.
+        geo_df (gpd.GeoDataFrame): A GeoDataFrame with the region polygons.
+        x (str): The name of the column in df that contains the longitude coordinates.
+        y (str): The name of the column in df that contains the latitude coordinates.
+        field (str): The column of geo_df holding the value to assign (e.g. the region name).
+        column_name (str): The name of the new column to add.
+        bbox (tuple of float, optional): (min_x, min_y, max_x, max_y) of the area of interest. Defaults to None.
+        default (str, optional): Value assigned to points that fall in no region. Defaults to "None".
 
+    Returns:
+        pd.DataFrame: A new DataFrame with the additional column added.
+    """
+    lng = df[x].to_numpy(dtype=float)
+    lat = df[y].to_numpy(dtype=float)
+    candidates = np.ones(len(df), dtype=bool)
+    if bbox is not None:
+        min_x, min_y, max_x, max_y = bbox
+        candidates = (lng >= min_x) & (lng <= max_x) & (lat >= min_y) & (lat <= max_y)
+
+    positions = np.flatnonzero(candidates)
+    points = gpd.points_from_xy(lng[positions], lat[positions])
+    # Query the (cached) spatial index of the regions, pairs are sorted by point then by region
+    point_idx, region_idx = geo_df.sindex.query_bulk(points, predicate='within', sort=True)
+    # A point on a shared border matches several regions, keep the first one like a row-wise scan would
+    first = np.unique(point_idx, return_index=True)[1]
+
+    values = np.full(len(df), default, dtype=object)
+    values[positions[point_idx[first]]] = geo_df[field].to_numpy()[region_idx[first]]
+    return pd.concat([df, pd.Series(values, index=df.index, name=column_name)], axis=1)
+
+
+@instrumented
 def combine_data(df1: pd.DataFrame, df2: pd.DataFrame, on: Union[str, List[str]], how: str = 'left') -> pd.DataFrame:
     """
     Combine two dataframes based on common columns.
@@ -44,6 +94,67 @@ def combine_data(df1: pd.DataFrame, df2: pd.DataFrame, on: Union[str, List[str]]
     return pd.merge(df1, df2, on=on, how=how)
 
 
+def lookup_positions(keys: pd.Series, lookup_index: pd.Index) -> npt.NDArray[np.intp]:
+    """
+    Finds the position of each key in a lookup index, hashing every distinct key only once.
+
+    Args:
+        keys (pd.Series): The keys to look up, categorical keys reuse their integer codes.
+        lookup_index (pd.Index): The unique keys of the lookup table.
+
+    Returns:
+        npt.NDArray[np.intp]: The position of each key in lookup_index, -1 for missing keys.
+    """
+    if isinstance(keys.dtype, pd.CategoricalDtype):
+        codes, uniques = keys.cat.codes.to_numpy(), keys.cat.categories
+    else:
+        codes, uniques = pd.factorize(keys)
+    # Null keys (code -1) take the -1 appended after the positions of the uniques, which may be empty
+    positions: npt.NDArray[np.intp] = np.append(lookup_index.get_indexer(uniques), -1).take(codes)
+    return positions
+
+
+@instrumented
+def add_lookup_columns(df: pd.DataFrame, lookup_df: pd.DataFrame, key: str, on: dict[str, str]) -> pd.DataFrame:
+    """
+    Adds the columns of a lookup table to a DataFrame, once for each key column, in a single pass.
+
+    Gives the same result as a left merge per key column on a prefixed copy of the lookup table, but the
+    keys are factorized into integer positions and the values are gathered with array takes, so the rows
+    of df are never copied or re-hashed.
+
+    Args:
+        df (pd.DataFrame): The DataFrame to add the columns to.
+        lookup_df (pd.DataFrame): The lookup table, with unique values in its key column.
+        key (str): The key column of lookup_df.
+        on (dict[str, str]): Maps each key column of df to the prefix of the lookup columns it adds.
+
+    Returns:
+        pd.DataFrame: A new DataFrame with the lookup columns added, missing keys get null values.
+    """
+    return pd.concat([df, pd.DataFrame(lookup_columns(df, lookup_df, key, on), index=df.index)], axis=1)
+
+
+def lookup_columns(df: pd.DataFrame, lookup_df: pd.DataFrame, key: str, on: dict[str, str]) -> dict[str, Any]:
+    """
+    Computes the columns `add_lookup_columns` adds, without adding them.
+
+    Returns:
+        dict: The new columns as arrays aligned with df, by name.
+    """
+    lookup_index = pd.Index(lookup_df[key])
+    value_cols = [col for col in lookup_df.columns if col != key]
+    new_cols = {}
+    for col, prefix in on.items():
+        positions = lookup_positions(df[col], lookup_index)
+        for value_col in value_cols:
+            values = lookup_df[value_col]
+            array = values.array if isinstance(values.dtype, pd.api.extensions.ExtensionDtype) else values.to_numpy()
+            new_cols[prefix + value_col] = pd.api.extensions.take(array, positions, allow_fill=True)
+    return new_cols
+
+
+@instrumented
 def remove_column(df: pd.DataFrame, cols: Union[str, List[str]]) -> pd.DataFrame:
     """
     Remove one or more columns from a pandas DataFrame.
@@ -58,6 +169,7 @@ def remove_column(df: pd.DataFrame, cols: Union[str, List[str]]) -> pd.DataFrame
     return df.drop(cols, axis=1)
 
 
+@instrumented
 def select_column(df: pd.DataFrame, cols: Union[str, List[str]]) -> pd.DataFrame:
     """
     Select one or more columns from a pandas DataFrame.
@@ -73,15 +185,18 @@ def select_column(df: pd.DataFrame, cols: Union[str, List[str]]) -> pd.DataFrame
     return df[cols]
 
 
-def filter_column(df: pd.DataFrame, column: str, condition: str, value: Union[int, float, str]):
+@instrumented
+def filter_column(df: pd.DataFrame, column: str, condition: str, value: Any = None):
     """
     Filters a dataframe based on a given column and condition.
 
     Args:
         df (pandas DataFrame): The dataframe to filter.
         column (str): The name of the column to filter.
-        condition (str): The condition to filter on. Valid conditions are "=", "equal", ">", "greater", "<", "less".
-        value (int, float, str): The value to filter on.
+        condition (str): The condition to filter on. Valid conditions are "=", "equal", ">", "greater", "<", "less",
+            ">=", "greater_equal", "<=", "less_equal", "between", "in", "notnull".
+        value (any, optional): The value to filter on, a (low, high) tuple for "between" (both ends included),
+            a list of values for "in" and nothing for "notnull".
 
     Returns:
         pandas DataFrame: The filtered dataframe.
@@ -89,25 +204,89 @@ def filter_column(df: pd.DataFrame, column: str, condition: str, value: Union[in
     Raises:
         ValueError: If the condition is not one of the valid conditions.
     """
-    filtered_df = None
+    return df.loc[filter_mask(df, column, condition, value), :]
+
+
+def filter_mask(df: pd.DataFrame, column: str, condition: str, value: Any = None) -> pd.Series:
+    """
+    Computes the boolean mask of the rows `filter_column` keeps.
+
+    Raises:
+        ValueError: If the condition is not one of the valid conditions.
+    """
     match condition:
         case "=" | "equal":
-            filtered_df = df.loc[df[column] == value, :]
+            return df[column] == value
         case ">" | "greater":
-            filtered_df = df.loc[df[column] > value, :]
+            return df[column] > value
         case "<" | "less":
-            filtered_df = df.loc[df[column] < value, :]
+            return df[column] < value
+        case ">=" | "greater_equal":
+            return df[column] >= value
+        case "<=" | "less_equal":
+            return df[column] <= value
+        case "between":
+            low, high = value
+            return df[column].between(low, high)
+        case "in":
+            return df[column].isin(value)
+        case "notnull":
+            return df[column].notna()
         case _:
-            raise ValueError(f"Invalid condition '{condition}'. Valid conditions are '=', 'equal', '>', 'greater', '<', 'less'")
-    return filtered_df
+            raise ValueError(f"Invalid condition '{condition}'. Valid conditions are '=', 'equal', '>', 'greater', '<', 'less', "
+                             "'>=', 'greater_equal', '<=', 'less_equal', 'between', 'in', 'notnull'")
+
+
+@instrumented
+def filter_rows(df: pd.DataFrame, expr: str, **values) -> pd.DataFrame:
+    """
+    Filters a dataframe with a boolean expression over its columns.
+
+    The expression uses the `DataFrame.eval` syntax, e.g. "0 < duration_min < 1440" or
+    "member_casual in @members and started_at >= @start and end_lat.notna()", and is evaluated in a single
+    pass (with numexpr when it is installed) instead of one boolean Series per condition.
+
+    Args:
+        df (pd.DataFrame): The dataframe to filter.
+        expr (str): The boolean expression, columns are referenced by name and values by `@name`.
+        **values: The values referenced in the expression.
 
+    Returns:
+        pd.DataFrame: The rows for which the expression is true.
+    """
+    return df.loc[expression_mask(df, expr, **values), :]
+
+
+def expression_mask(df: pd.DataFrame, expr: str, **values) -> npt.NDArray[np.bool_]:
+    """
+    Computes the boolean mask of the rows `filter_rows` keeps, null results count as false.
+    """
+    mask = df.eval(expr, local_dict=values)
+    if not isinstance(mask, pd.Series):
+        # An expression without any column gives a scalar
+        return np.full(len(df), bool(mask))
+    mask_values: npt.NDArray[np.bool_] = mask.to_numpy(dtype=bool, na_value=False)
+    return mask_values
 
-def sort_data(df: pd.DataFrame, by: str, order: str = "asc"):
+
+def expression_columns(expr: str, columns: List[str]) -> List[str]:
+    """
+    Finds the columns an expression of `filter_rows` may read.
+
+    Returns:
+        list[str]: The columns of `columns` named in the expression, in the order of `columns`.
+    """
+    names = {quoted or name for quoted, name in re.findall(r"`([^`]*)`|(?<![@\w.])([A-Za-z_]\w*)", expr)}
+    return [col for col in columns if col in names]
+
+
+@instrumented
+def sort_data(df: pd.DataFrame, by: Union[str, List[str]], order: str = "asc"):
     """Sort a DataFrame by a column and order.
 
     Args:
         df (pd.DataFrame): Input DataFrame.
-        by (str): Column name to sort by.
+        by (str or list of str): Column name (or names) to sort by.
         order (str, optional): Sort order, either "asc" or "desc". Default is "asc".
 
     Returns:
@@ -128,6 +307,7 @@ def sort_data(df: pd.DataFrame, by: str, order: str = "asc"):
     return sorted_df
 
 
+@instrumented
 def remove_duplicates(df: pd.DataFrame, subset: list[str], method: str = 'first') -> pd.DataFrame:
     """
     Remove duplicates from a pandas DataFrame.
@@ -143,20 +323,56 @@ def remove_duplicates(df: pd.DataFrame, subset: list[str], method: str = 'first'
     return df.drop_duplicates(subset=subset, keep=method)
 
 
-def remove_null_values(df: pd.DataFrame) -> pd.DataFrame:
+@instrumented
+def first_by(df: pd.DataFrame, key: str, by: str) -> pd.DataFrame:
+    """
+    Keeps, for each distinct value of a key column, the row with the smallest value of another column.
+
+    Gives the same rows as sorting by `by` and removing the duplicates of `key`, but without sorting df:
+    the minimum of each key is found with a single hash-grouped aggregation and the first row reaching it
+    is kept, so ties go to the earliest row.
+
+    Args:
+        df (pd.DataFrame): The DataFrame to reduce.
+        key (str): The column identifying the groups, rows with a null key are ignored.
+        by (str): The column to minimize within each group (e.g. a timestamp), null values are ignored.
+
+    Returns:
+        pd.DataFrame: One row per key, in the order of df.
+    """
+    keys = df[key]
+    codes = keys.cat.codes.to_numpy() if isinstance(keys.dtype, pd.CategoricalDtype) else pd.factorize(keys)[0]
+    values = df[by].to_numpy()
+    valid = np.flatnonzero((codes != -1) & df[by].notna().to_numpy())
+    codes, values = codes[valid], values[valid]
+    if len(valid) == 0:
+        return df.iloc[:0]
+
+    group_min = pd.Series(values).groupby(codes).min()
+    min_values = np.empty(codes.max() + 1, dtype=values.dtype)
+    min_values[group_min.index] = group_min.to_numpy()
+    candidates = np.flatnonzero(values == min_values[codes])
+    first = np.unique(codes[candidates], return_index=True)[1]
+    return df.iloc[np.sort(valid[candidates[first]])]
+
+
+@instrumented
+def remove_null_values(df: pd.DataFrame, subset: Optional[List[str]] = None) -> pd.DataFrame:
     """
     Remove rows with null (NaN) values from the given DataFrame.
 
     Args:
         df: A pandas DataFrame object containing the data to be filtered.
+        subset (list of str, optional): Only the nulls of these columns remove a row. Defaults to all columns.
 
     Returns:
         pd.DataFrame: A new DataFrame object with the same columns as the input DataFrame, but
         with any rows containing null (NaN) values removed.
     """
-    return df.dropna(axis=0, how='any', inplace=False)
+    return df.dropna(axis=0, how='any', subset=subset, inplace=False)
 
 
+@instrumented
 def update_column_name(df: pd.DataFrame, col_name_mapping: dict[str, str]) -> pd.DataFrame:
     """
     Rename columns in a DataFrame based on the provided column name mappings.
@@ -171,10 +387,52 @@ def update_column_name(df: pd.DataFrame, col_name_mapping: dict[str, str]) -> pd
     return df.rename(columns=col_name_mapping)
 
 
-def add_column(df: pd.DataFrame, column_name: str, func: Callable[..., Union[int, str]], *args, **kwargs) -> pd.DataFrame:
+# Functions that compute a whole column at once, and the columns they read besides their arguments, see `columnar`
+COLUMNAR_FUNCTIONS: set[Callable[..., pd.Series]] = set()
+COLUMNAR_INPUTS: dict[Callable[..., pd.Series], List[str]] = {}
+
+
+@overload
+def columnar(func: Callable[..., pd.Series], *, inputs: List[str] = ...) -> Callable[..., pd.Series]: ...
+
+
+@overload
+def columnar(*, inputs: List[str]) -> Callable[[Callable[..., pd.Series]], Callable[..., pd.Series]]: ...
+
+
+def columnar(func: Optional[Callable[..., pd.Series]] = None, *, inputs: List[str] = []) -> Any:
+    """
+    Registers a function as array-native so `add_column` calls it once on the whole DataFrame.
+
+    A columnar function has the same signature as a row-wise one, but its `row` argument receives the
+    full DataFrame and it must return a Series (or array) aligned with it.
+
+    In a `TransformPlan`, `row` only holds the columns named by the string arguments of the step, so a
+    function reading other columns declares them with `@columnar(inputs=[...])`, otherwise it gets a KeyError.
+
+    Args:
+        func (callable): The function to register.
+        inputs (list of str, optional): Columns read from `row` that are not passed as arguments. Defaults to [].
+
+    Returns:
+        callable: The same function, unchanged, or a decorator registering it when only inputs are given.
+    """
+    if func is None:
+        return lambda func: columnar(func, inputs=inputs)
+    COLUMNAR_FUNCTIONS.add(func)
+    COLUMNAR_INPUTS[func] = list(inputs)
+    return func
+
+
+@instrumented
+def add_column(df: pd.DataFrame, column_name: str, func: Callable[..., Union[int, str, pd.Series]], *args, **kwargs) -> pd.DataFrame:
     """
     Adds a new column to the given DataFrame by applying the given function to each row.
 
+    Functions registered with `columnar` are evaluated once over whole columns instead, the row-wise
+    apply is only used as a fallback for everything else. In a `TransformPlan`, a columnar function only
+    sees the columns named by its string arguments and the inputs it declares, see `columnar`.
+
     Args:
         df (pd.DataFrame): The DataFrame to add the new column to.
         column_name (str): The name of the new column to add.
@@ -185,9 +443,201 @@ def add_column(df: pd.DataFrame, column_name: str, func: Callable[..., Union[int
     Returns:
         pd.DataFrame: A new DataFrame with the additional column added.
     """
-    new_col = df.apply(lambda row: func(*args, **kwargs, row=row), axis=1)   # type: ignore
-    return pd.concat([df, new_col.rename(column_name)], axis=1)
+    return pd.concat([df, compute_column(df, func, *args, **kwargs).rename(column_name)], axis=1)
+
 
+def compute_column(df: pd.DataFrame, func: Callable[..., Union[int, str, pd.Series]], *args, **kwargs) -> pd.Series:
+    """
+    Computes the column `add_column` adds, without adding it.
 
+    Returns:
+        pd.Series: The new column, aligned with df.
+    """
+    if func in COLUMNAR_FUNCTIONS:
+        return pd.Series(func(*args, **kwargs, row=df), index=df.index)
+    return df.apply(lambda row: func(*args, **kwargs, row=row), axis=1)   # type: ignore
+
+
+@instrumented
 def reset_index(df, drop=False):
     return df.reset_index(drop=drop)
+
+
+# Steps of a `TransformPlan` that only narrow the rows, only change the columns or only add columns
+MASK_FUNCTIONS: set[Callable[..., pd.DataFrame]] = {remove_null_values, filter_column, filter_rows}
+PROJECTION_FUNCTIONS: set[Callable[..., pd.DataFrame]] = {remove_column, select_column, update_column_name}
+DERIVE_FUNCTIONS: set[Callable[..., pd.DataFrame]] = {add_column, add_lookup_columns}
+
+
+class _Derive:
+    """A deferred `add_column` or `add_lookup_columns` step of a `TransformPlan`."""
+
+    def __init__(self, func: Callable[..., pd.DataFrame], args: Tuple[Any, ...], kwargs: dict[str, Any], inputs: dict[str, Tuple[Any, str]]):
+        self.func = func
+        self.args = args
+        self.kwargs = kwargs
+        # Input columns bound to their source when the step was recorded
+        self.inputs = inputs
+        self.positions: Optional[npt.NDArray[np.intp]] = None
+        self.values: dict[str, pd.Series] = {}
+
+    @property
+    def outputs(self) -> List[str]:
+        if self.func is add_column:
+            return [self.args[0]]
+        lookup_df, key, on = self.args[:3]
+        return [prefix + col for prefix in on.values() for col in lookup_df.columns if col != key]
+
+
+class TransformPlan:
+    """
+    A lazy chain of transform steps evaluated with a single row mask and a single materialization.
+
+    Steps are recorded with `pipe`, like `pd.DataFrame.pipe`, and only run on `collect`:
+      - `remove_null_values`, `filter_column` and `filter_rows` are AND-ed into one boolean mask over the input rows,
+        each predicate is evaluated on the rows that survived the previous ones only.
+      - `remove_column`, `select_column` and `update_column_name` only change the list of output columns.
+      - `add_column` and `add_lookup_columns` are deferred. They run when a predicate reads one of their
+        columns, on the rows surviving at that point, and otherwise once on the final rows. Predicates that
+        do not read the output of a join are thus applied before it, and dropped columns are never computed.
+      - Any other function materializes the plan and is applied to the resulting DataFrame.
+
+    Deferring is only legal because each row of an added column is computed from the same row of its
+    inputs, functions passed to `add_column` must not aggregate over rows.
+
+    Args:
+        df (pd.DataFrame): The input DataFrame, it is never modified.
+    """
+
+    def __init__(self, df: pd.DataFrame):
+        self._df = df
+        self._steps: List[Tuple[Callable[..., pd.DataFrame], Tuple[Any, ...], dict[str, Any]]] = []
+
+    def pipe(self, func: Callable[..., pd.DataFrame], *args, **kwargs) -> 'TransformPlan':
+        """
+        Records a step, `func(df, *args, **kwargs)`.
+
+        Returns:
+            TransformPlan: The plan itself, so calls can be chained.
+        """
+        self._steps.append((func, args, kwargs))
+        return self
+
+    def collect(self) -> pd.DataFrame:
+        """
+        Runs the recorded steps.
+
+        Returns:
+            pd.DataFrame: The same DataFrame as applying the steps one after another.
+        """
+        self._reset(self._df)
+        for func, args, kwargs in self._steps:
+            with instrument.step(f"plan.{func.__name__}", self._rows()) as record:
+                if func in MASK_FUNCTIONS:
+                    self._apply_mask(func, args, kwargs)
+                elif func in PROJECTION_FUNCTIONS:
+                    self._apply_projection(func, args, kwargs)
+                elif func in DERIVE_FUNCTIONS and not self._shadows(func, args):
+                    self._add_derive(func, args, kwargs)
+                else:
+                    self._reset(func(self._materialize(), *args, **kwargs))
+                record['rows_out'] = self._rows()
+        with instrument.step("plan.collect", self._rows()) as record:
+            df = self._materialize()
+            record['rows_out'] = len(df)
+        return df
+
+    def _reset(self, df: pd.DataFrame) -> None:
+        self._base = df
+        self._keep = np.ones(len(df), dtype=bool)
+        # Live output columns, mapped to ('base', name) or to (derive, name)
+        self._columns: dict[str, Tuple[Any, str]] = {col: ('base', col) for col in df.columns}
+
+    def _rows(self) -> Optional[int]:
+        """Number of rows kept so far, only counted while instrumentation records."""
+        return int(np.count_nonzero(self._keep)) if instrument.is_enabled() else None
+
+    def _positions(self) -> npt.NDArray[np.intp]:
+        return np.flatnonzero(self._keep)
+
+    def _gather(self, source: Tuple[Any, str], positions: npt.NDArray[np.intp]) -> Any:
+        """Values of a column at the given input rows, without copying when every row is kept."""
+        owner, name = source
+        if owner == 'base':
+            column = self._base[name]
+            return column.array if len(positions) == len(column) else column.take(positions).array
+        if owner.positions is None:
+            self._compute(owner, self._positions())
+        values = owner.values[name]
+        if len(positions) == len(values):
+            return values.array
+        return values.take(np.searchsorted(np.asarray(owner.positions), positions)).array
+
+    def _frame(self, sources: dict[str, Tuple[Any, str]], positions: npt.NDArray[np.intp]) -> pd.DataFrame:
+        columns = {name: self._gather(source, positions) for name, source in sources.items()}
+        return pd.DataFrame(columns, index=self._base.index[positions], copy=False)
+
+    def _compute(self, derive: _Derive, positions: npt.NDArray[np.intp]) -> None:
+        df = self._frame(derive.inputs, positions)
+        if derive.func is add_column:
+            column_name, func, *args = derive.args
+            values = {column_name: compute_column(df, func, *args, **derive.kwargs)}
+        else:
+            values = {name: pd.Series(array) for name, array in lookup_columns(df, *derive.args, **derive.kwargs).items()}
+        derive.values = {name: column.reset_index(drop=True) for name, column in values.items()}
+        derive.positions = positions
+
+    def _apply_mask(self, func: Callable[..., pd.DataFrame], args: Tuple[Any, ...], kwargs: dict[str, Any]) -> None:
+        positions = self._positions()
+        if func is remove_null_values:
+            subset = kwargs.get('subset', args[0] if args else None)
+            mask = np.ones(len(positions), dtype=bool)
+            for col in self._columns if subset is None else subset:
+                mask &= ~pd.isna(self._gather(self._columns[col], positions))
+        elif func is filter_rows:
+            values = dict(kwargs)
+            expr = values.pop('expr', args[0] if args else None)
+            columns = expression_columns(expr, list(self._columns))
+            df = self._frame({col: self._columns[col] for col in columns}, positions)
+            mask = expression_mask(df, expr, **values)
+        else:
+            column = kwargs.get('column', args[0] if args else None)
+            df = self._frame({column: self._columns[column]}, positions)
+            mask = filter_mask(df, *args, **kwargs).to_numpy(dtype=bool, na_value=False)
+        self._keep[positions[~mask]] = False
+
+    def _apply_projection(self, func: Callable[..., pd.DataFrame], args: Tuple[Any, ...], kwargs: dict[str, Any]) -> None:
+        # Run the step on an empty frame with the live columns, it raises the same errors and gives the new columns
+        empty = pd.DataFrame(columns=list(self._columns))
+        result = func(empty, *args, **kwargs)
+        if func is update_column_name:
+            self._columns = dict(zip(result.columns, self._columns.values()))
+        else:
+            self._columns = {col: self._columns[col] for col in result.columns}
+
+    def _shadows(self, func: Callable[..., pd.DataFrame], args: Tuple[Any, ...]) -> bool:
+        """Whether a derive step can not be deferred: keyword-only arguments or a column that already exists."""
+        if len(args) < (2 if func is add_column else 3):
+            return True
+        return any(col in self._columns for col in _Derive(func, args, {}, {}).outputs)
+
+    def _add_derive(self, func: Callable[..., pd.DataFrame], args: Tuple[Any, ...], kwargs: dict[str, Any]) -> None:
+        if func is add_lookup_columns:
+            inputs = list(args[2])
+        elif args[1] in COLUMNAR_FUNCTIONS:
+            values = [*args[2:], *kwargs.values(), *COLUMNAR_INPUTS[args[1]]]
+            inputs = [value for value in values if isinstance(value, str) and value in self._columns]
+        else:
+            # A row-wise function receives the whole row
+            inputs = list(self._columns)
+        derive = _Derive(func, args, kwargs, {col: self._columns[col] for col in inputs})
+        for col in derive.outputs:
+            self._columns[col] = (derive, col)
+
+    def _materialize(self) -> pd.DataFrame:
+        positions = self._positions()
+        for owner, _ in self._columns.values():
+            if owner != 'base' and owner.positions is None:
+                # Deferred steps that no predicate needed run once on the final rows
+                self._compute(owner, positions)
+        return self._frame(self._columns, positions)
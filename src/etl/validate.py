@@ -0,0 +1,143 @@
+from typing import Any, List, NamedTuple, Tuple
+import numpy as np
+import numpy.typing as npt
+import pandas as pd
+
+
+class Rule(NamedTuple):
+    """
+    A data-quality rule, the rows that break it are rejected by `split_valid`.
+
+    Checks:
+        - 'notnull': a value of the columns is null.
+        - 'between': a value of the columns is outside [low, high], `value` is a (low, high) pair for every column
+          or a list of pairs, one per column.
+        - 'in': a value of the columns is not one of `value`.
+        - 'span': the time from the first column to the second one is outside [low, high), `value` is a
+          (low, high) pair of timedeltas.
+        - 'unique': the columns repeat an earlier row.
+    Null values only break 'notnull' rules.
+    """
+    name: str
+    check: str
+    columns: List[str]
+    value: Any = None
+
+
+def violations(df: pd.DataFrame, rule: Rule) -> npt.NDArray[np.bool_]:
+    """
+    Finds the rows of a DataFrame that break a rule.
+
+    Returns:
+        np.ndarray: True for the rows that break the rule.
+
+    Raises:
+        ValueError: If the check of the rule is not one of the valid checks.
+    """
+    broken = np.zeros(len(df), dtype=bool)
+    match rule.check:
+        case "notnull":
+            for col in rule.columns:
+                broken |= df[col].isna().to_numpy()
+        case "between":
+            bounds = rule.value if isinstance(rule.value, list) else [rule.value] * len(rule.columns)
+            for col, (low, high) in zip(rule.columns, bounds):
+                values = df[col].to_numpy(dtype=float, na_value=np.nan)
+                with np.errstate(invalid='ignore'):
+                    broken |= (values < low) | (values > high)
+        case "in":
+            for col in rule.columns:
+                broken |= (~df[col].isin(rule.value) & df[col].notna()).to_numpy()
+        case "span":
+            start, end = rule.columns
+            low, high = rule.value
+            span = df[end] - df[start]
+            broken |= ((span < low) | (span >= high)).to_numpy(dtype=bool, na_value=False)
+        case "unique":
+            broken |= repeated(df, rule.columns)
+        case _:
+            raise ValueError(f"Invalid check '{rule.check}'. Valid checks are 'notnull', 'between', 'in', 'span', 'unique'")
+    return broken
+
+
+def repeated(df: pd.DataFrame, columns: List[str]) -> npt.NDArray[np.bool_]:
+    """True for the rows whose columns repeat an earlier row, rows with a null value are never repeats."""
+    repeats: npt.NDArray[np.bool_]
+    if len(columns) > 1:
+        repeats = (df.duplicated(columns, keep='first') & df[columns].notna().all(axis=1)).to_numpy()
+        return repeats
+    # A single key is hashed once. factorize numbers the keys in order of appearance, so the first row of
+    # a key is the row whose code is above every earlier code, null keys (-1) are never repeats
+    codes = pd.factorize(df[columns[0]])[0]
+    earlier_max = np.maximum.accumulate(np.concatenate([[-1], codes[:-1]]))
+    repeats = (codes <= earlier_max) & (codes != -1)
+    return repeats
+
+
+def validate(df: pd.DataFrame, rules: List[Rule]) -> npt.NDArray[np.unsignedinteger[Any]]:
+    """
+    Checks every rule on a DataFrame and records the rules each row breaks as a bitmask.
+
+    Each rule reads its own columns once, over all the rows, and sets its bit (bit i for `rules[i]`) in a
+    single array of reasons. Nothing is filtered until every rule has run, so a row breaking several rules
+    gets all of their bits.
+
+    Args:
+        df (pd.DataFrame): The rows to check.
+        rules (list of Rule): The rules, at most 64.
+
+    Returns:
+        np.ndarray: The reasons of each row, 0 for valid rows, in the smallest unsigned dtype holding a bit per rule.
+
+    Raises:
+        ValueError: If there are more than 64 rules.
+    """
+    dtype = reasons_dtype(rules)
+    reasons = np.zeros(len(df), dtype=dtype)
+    for bit, rule in enumerate(rules):
+        reasons[violations(df, rule)] |= dtype.type(1 << bit)
+    return reasons
+
+
+def reasons_dtype(rules: List[Rule]) -> np.dtype[Any]:
+    """
+    The smallest unsigned dtype holding a bit per rule.
+
+    Raises:
+        ValueError: If there are more than 64 rules.
+    """
+    if len(rules) > 64:
+        raise ValueError(f"Invalid number of rules {len(rules)}. At most 64 rules fit in a bitmask")
+    return np.min_scalar_type((1 << max(len(rules) - 1, 0)))
+
+
+def rule_counts(reasons: npt.NDArray[np.unsignedinteger[Any]], rules: List[Rule]) -> pd.Series:
+    """
+    Counts the rows that break each rule, a row breaking several rules counts once for each.
+
+    Returns:
+        pd.Series: The number of rows breaking each rule, by rule name.
+    """
+    counts = [np.count_nonzero(reasons & reasons.dtype.type(1 << bit)) for bit in range(len(rules))]
+    return pd.Series(counts, index=[rule.name for rule in rules], name='count', dtype='int64')
+
+
+def split_valid(df: pd.DataFrame, rules: List[Rule], column: str = 'reasons') -> Tuple[pd.DataFrame, pd.DataFrame]:
+    """
+    Splits a DataFrame into the rows that pass every rule and the rows that break one or more.
+
+    Args:
+        df (pd.DataFrame): The rows to check.
+        rules (list of Rule): The rules, see `validate`.
+        column (str, optional): Name of the column holding the reasons of the rejected rows. Defaults to 'reasons'.
+
+    Returns:
+        tuple of pd.DataFrame: The valid rows, and the rejected rows with their reasons bitmask (decoded with
+        `rule_counts`), both in the order of df.
+    """
+    reasons = validate(df, rules)
+    valid = reasons == 0
+    if valid.all():
+        return df, df.iloc[:0].assign(**{column: reasons[:0]})
+    rejected = np.flatnonzero(~valid)
+    return df.iloc[np.flatnonzero(valid)], df.iloc[rejected].assign(**{column: reasons[rejected]})
@@ -0,0 +1,272 @@
+from contextlib import contextmanager
+import json
+import os
+import platform
+import subprocess
+import tempfile
+import time
+import zipfile
+from types import ModuleType
+from typing import Any, Callable, Iterator, List, Optional, Tuple
+import geopandas as gpd
+import numpy as np
+import pandas as pd
+from shapely.geometry import box
+from etl.extract import extract_all_files_in_directory
+from etl.instrument import peak_rss, reset_peak_rss
+from etl.load import send_to_csv
+from etl.schema import memory_report, memory_usage
+from helpers import util_load, util_transform
+from helpers.util_schema import date_format, parse_dates, plain_trip_dtype, raw_trip_dtype
+from helpers.util_tests import create_path
+
+# Downtown Chicago, stations are spread around it
+center_lat, center_lng = 41.88, -87.63
+
+
+def generate_trips(num_rows: int, seed: int = 0, num_stations: int = 1000, start_date: str = '2022-01-01',
+                   num_months: int = 12) -> pd.DataFrame:
+    """Generates Divvy-like trips with the raw file schema, the same seed always gives the same trips.
+
+    Stations are scattered around downtown Chicago, a few of them across the Indiana border. Like the real
+    data, some trips have no station name (dockless electric bikes) or no end coordinates, some end before
+    they start and some last for days. A few stations only ever appear as the end of a trip.
+
+    Args:
+      num_rows (int): Number of trips.
+      seed (int, optional): Seed of the random generator. Defaults to 0.
+      num_stations (int, optional): Number of stations. Defaults to 1000.
+      start_date (str, optional): Day of the first trip. Defaults to '2022-01-01'.
+      num_months (int, optional): Number of months the trips are spread over. Defaults to 12.
+
+    Returns:
+      pd.DataFrame: The trips, sorted by start time.
+    """
+    rng = np.random.default_rng(seed)
+    names = np.array([f"{street} St & {avenue} Ave" for street, avenue in zip(rng.integers(1, 130, num_stations), range(num_stations))])
+    station_lat = rng.normal(center_lat, 0.08, num_stations)
+    station_lng = rng.normal(center_lng, 0.06, num_stations)
+    station_lng[:5] = rng.uniform(-87.52, -87.40, 5)  # Indiana
+
+    # The last stations are only used as destinations
+    start_station = rng.integers(0, num_stations - 10, num_rows)
+    end_station = rng.integers(0, num_stations, num_rows)
+    start = pd.Timestamp(start_date)
+    seconds = (start + pd.DateOffset(months=num_months) - start).total_seconds()
+    started_at = start + pd.to_timedelta(np.sort(rng.integers(0, int(seconds), num_rows)), unit='s')
+    duration = rng.lognormal(6.5, 0.9, num_rows).astype(np.int64)
+    duration[rng.random(num_rows) < 0.002] *= -1
+    duration[rng.random(num_rows) < 0.002] += 2 * 86400
+    ended_at = started_at + pd.to_timedelta(duration, unit='s')
+
+    df = pd.DataFrame({
+        'ride_id': pd.Series(rng.integers(0, 1 << 62, num_rows)).map('{:016X}'.format),
+        'rideable_type': rng.choice(['classic_bike', 'electric_bike', 'docked_bike'], num_rows, p=[0.5, 0.45, 0.05]),
+        'started_at': started_at.floor('s'),
+        'ended_at': ended_at.floor('s'),
+        'start_station_name': names[start_station],
+        'start_station_id': start_station.astype(str),
+        'end_station_name': names[end_station],
+        'end_station_id': end_station.astype(str),
+        'start_lat': station_lat[start_station] + rng.normal(0, 1e-4, num_rows),
+        'start_lng': station_lng[start_station] + rng.normal(0, 1e-4, num_rows),
+        'end_lat': station_lat[end_station],
+        'end_lng': station_lng[end_station],
+        'member_casual': rng.choice(['member', 'casual'], num_rows, p=[0.6, 0.4]),
+    })
+    dockless = (df['rideable_type'] == 'electric_bike').to_numpy() & (rng.random(num_rows) < 0.2)
+    df.loc[dockless, ['start_station_name', 'start_station_id']] = np.nan
+    df.loc[rng.random(num_rows) < 0.01, ['end_lat', 'end_lng']] = np.nan
+    return df
+
+
+def write_trip_files(df: pd.DataFrame, directory: str) -> List[str]:
+    """Writes trips like the raw Divvy files, one `<year>/<yyyymm>-divvy-tripdata.csv` file per month.
+
+    Returns:
+      list of str: The year sub-directories.
+    """
+    months = df['started_at'].dt.strftime('%Y%m')
+    for month, month_df in df.groupby(months):
+        create_path(os.path.join(directory, month[:4]))
+        month_df.to_csv(os.path.join(directory, month[:4], f"{month}-divvy-tripdata.csv"), index=False, date_format=date_format)
+    return sorted(months.str[:4].unique())
+
+
+def write_trip_archives(df: pd.DataFrame, directory: str) -> List[str]:
+    """Writes trips like the Divvy download server, one `<yyyymm>-divvy-tripdata.zip` archive per month
+    holding its `<yyyymm>-divvy-tripdata.csv` file.
+
+    Returns:
+      list of str: The months ("YYYYMM").
+    """
+    create_path(directory)
+    months = df['started_at'].dt.strftime('%Y%m')
+    for month, month_df in df.groupby(months):
+        with zipfile.ZipFile(os.path.join(directory, f"{month}-divvy-tripdata.zip"), 'w') as archive:
+            archive.writestr(f"{month}-divvy-tripdata.csv", month_df.to_csv(index=False, date_format=date_format))
+    return sorted(months.unique())
+
+
+def generate_boundaries(directory: str) -> Tuple[str, str]:
+    """Writes small synthetic state and neighborhood boundary files shaped like the real ones.
+
+    Two states split at the Illinois - Indiana border and a grid of neighborhoods over Chicago.
+
+    Returns:
+      tuple of str: The paths of the state shapefile and of the neighborhood GeoJSON file.
+    """
+    create_path(directory)
+    state_path = os.path.join(directory, 'cb_2018_us_state_500k.shp')
+    neighborhood_path = os.path.join(directory, 'chicago_neighborhoods.geojson')
+    states = gpd.GeoDataFrame({'NAME': ['Illinois', 'Indiana']},
+                              geometry=[box(-91.5, 37.0, -87.53, 42.5), box(-87.53, 37.8, -84.8, 41.76)], crs='EPSG:4269')
+    states.to_file(state_path)
+
+    cells = [(i, j) for i in range(10) for j in range(12)]
+    neighborhoods = gpd.GeoDataFrame({'pri_neigh': [f"Neighborhood {i}-{j}" for i, j in cells],
+                                      'sec_neigh': [f"Area {i // 2}-{j // 3}" for i, j in cells]},
+                                     geometry=[box(-87.95 + i * 0.045, 41.64 + j * 0.035, -87.905 + i * 0.045, 41.675 + j * 0.035)
+                                               for i, j in cells],
+                                     crs='EPSG:4326')
+    neighborhoods.to_file(neighborhood_path, driver='GeoJSON')
+    return state_path, neighborhood_path
+
+
+@contextmanager
+def synthetic_boundaries(directory: str) -> Iterator[Tuple[str, str]]:
+    """Points `util_transform` at synthetic boundary files (see `generate_boundaries`) for the duration of the
+    context, the cached boundaries are cleared on the way in and out.
+
+    Yields:
+      tuple of str: The paths of the state shapefile and of the neighborhood GeoJSON file.
+    """
+    state_path, neighborhood_path = generate_boundaries(directory)
+    caches = [util_transform.get_states, util_transform.get_neighborhoods, util_transform.get_neighborhood_index]
+    for cache in caches:
+        cache.cache_clear()
+    try:
+        with patched(util_transform, filepath_state=state_path, filepath_neighborhood=neighborhood_path):
+            yield state_path, neighborhood_path
+    finally:
+        for cache in caches:
+            cache.cache_clear()
+
+
+def time_stage(func: Callable[..., Any], *args, **kwargs) -> Tuple[Any, dict[str, float]]:
+    """Runs a pipeline stage once and measures it.
+
+    Returns:
+      tuple: The result of the stage and a dict with the 'seconds', 'rows' (of the input DataFrame, or of the
+      result for stages without one), 'rows_per_sec' and 'peak_rss_mb' of the stage, plus the 'frame_mb'
+      of the result when it is a DataFrame.
+    """
+    reset_peak_rss()
+    start = time.perf_counter()
+    result = func(*args, **kwargs)
+    seconds = time.perf_counter() - start
+    rows_df = next((arg for arg in args if isinstance(arg, pd.DataFrame)), result)
+    rows = len(rows_df) if isinstance(rows_df, pd.DataFrame) else 0
+    measures = {'seconds': round(seconds, 4),
+                'rows': rows,
+                'rows_per_sec': round(rows / seconds, 1) if seconds > 0 else 0.0,
+                'peak_rss_mb': round(peak_rss() / 2**20, 1)}
+    if isinstance(result, pd.DataFrame):
+        measures['frame_mb'] = round(memory_usage(result) / 2**20, 1)
+    return result, measures
+
+
+@contextmanager
+def patched(module: ModuleType, **attributes: Any) -> Iterator[None]:
+    """Temporarily replaces module level settings, such as the file paths of the helpers."""
+    previous = {name: getattr(module, name) for name in attributes}
+    for name, value in attributes.items():
+        setattr(module, name, value)
+    try:
+        yield
+    finally:
+        for name, value in previous.items():
+            setattr(module, name, value)
+
+
+def run_benchmark(num_rows: int, workdir: str, seed: int = 0) -> dict[str, dict[str, float]]:
+    """Times each stage of the in-memory pipeline on generated trips.
+
+    The stages are `extract_all_files_in_directory`, `build_station_df`, `transform_data`, `send_to_csv`
+    and `load_data`, run one after another on the output of the previous stage, against synthetic
+    boundary files.
+
+    Args:
+      num_rows (int): Number of generated trips.
+      workdir (str): Directory for the generated and output files.
+      seed (int, optional): Seed of the trip generator. Defaults to 0.
+
+    Returns:
+      dict: The measures of each stage (see `time_stage`) keyed by stage name.
+    """
+    raw_dir = os.path.join(workdir, 'raw')
+    final_dir = os.path.join(workdir, 'final')
+    print(f"Generating {num_rows:,} trips ...")
+    years = write_trip_files(generate_trips(num_rows, seed), raw_dir)
+    create_path(final_dir)
+
+    stages = {}
+    with synthetic_boundaries(os.path.join(workdir, 'processed')), \
+            patched(util_load, filepath=os.path.join(final_dir, 'divvy_final.csv')):
+        raw_df, stages['extract_all_files_in_directory'] = time_stage(
+            extract_all_files_in_directory, raw_dir, sub_dir=years, dtype=raw_trip_dtype, parse_dates=parse_dates, date_format=date_format)
+        station_df, stages['build_station_df'] = time_stage(util_transform.build_station_df, raw_df)
+        final_df, stages['transform_data'] = time_stage(util_transform.transform_data, raw_df, station_df)
+        del raw_df
+        _, stages['send_to_csv'] = time_stage(send_to_csv, final_df, 'divvy_final.csv', final_dir)
+        _, stages['load_data'] = time_stage(util_load.load_data, len(final_df))
+    return stages
+
+
+def schema_memory_report(num_rows: int, seed: int = 0) -> str:
+    """Compares the memory of generated trips read with plain Python strings and float64 and read with `raw_trip_schema`."""
+    with tempfile.TemporaryDirectory() as workdir:
+        years = write_trip_files(generate_trips(num_rows, seed), workdir)
+        plain_df = extract_all_files_in_directory(workdir, sub_dir=years, dtype=plain_trip_dtype, parse_dates=parse_dates, date_format=date_format)
+        schema_df = extract_all_files_in_directory(workdir, sub_dir=years, dtype=raw_trip_dtype, parse_dates=parse_dates, date_format=date_format)
+    return memory_report(plain_df, schema_df)
+
+
+def environment() -> dict[str, Any]:
+    """The commit and machine a benchmark report was measured on."""
+    try:
+        commit = subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        commit = None
+    return {'commit': commit, 'python': platform.python_version(), 'pandas': pd.__version__,
+            'machine': platform.machine(), 'cpu_count': os.cpu_count()}
+
+
+def save_report(report: dict[str, Any], filepath: str) -> None:
+    with open(filepath, 'w') as f:
+        json.dump(report, f, indent=2)
+
+
+def load_report(filepath: str) -> dict[str, Any]:
+    with open(filepath, 'r') as f:
+        report: dict[str, Any] = json.load(f)
+    return report
+
+
+def compare_reports(baseline: dict[str, Any], current: dict[str, Any]) -> str:
+    """Formats the throughput and peak memory of two reports side by side.
+
+    Returns:
+      str: One line per size and stage measured in both reports, speedups above 1 mean `current` is faster.
+    """
+    lines = [f"{'rows':>10} {'stage':<32} {'rows/sec':>12} {'speedup':>8} {'peak MB':>9} {'memory':>7}"]
+    for size, stages in current['results'].items():
+        for stage, measures in stages.items():
+            previous: Optional[dict[str, float]] = baseline['results'].get(size, {}).get(stage)
+            if previous is None:
+                continue
+            speedup = measures['rows_per_sec'] / previous['rows_per_sec'] if previous['rows_per_sec'] else float('nan')
+            memory = measures['peak_rss_mb'] / previous['peak_rss_mb'] if previous['peak_rss_mb'] else float('nan')
+            lines.append(f"{int(size):>10,} {stage:<32} {measures['rows_per_sec']:>12,.0f} {speedup:>7.2f}x "
+                         f"{measures['peak_rss_mb']:>9,.0f} {memory:>6.2f}x")
+    return '\n'.join(lines)
@@ -1,14 +1,14 @@
 from datetime import datetime
 import os
 from dateutil.relativedelta import relativedelta
-from etl.extract import download_file_from_web
+from etl.extract import download_file_from_web, download_files_from_web
 from helpers.util_tests import create_path
 
 URL_PREFIX = "https://divvy-tripdata.s3.amazonaws.com"
 FILENAME = "divvy-tripdata.zip"
 
 
-def extract_divvy_biketrip_dataset(start_date, end_date, destination, date_format: str = "%Y-%m-%d") -> None:
+def extract_divvy_biketrip_dataset(start_date, end_date, destination, date_format: str = "%Y-%m-%d", workers: int = 4) -> None:
     """Extract the Divvy biketrip dataset for a given date range and save the files
     in a directory.
 
@@ -17,6 +17,7 @@ def extract_divvy_biketrip_dataset(start_date, end_date, destination, date_forma
       end_date (str): End date for the range in the format "YYYY-MM-DD".
       destination (str): Directory where the extracted files should be saved.
       date_format (str, optional): Format of the date strings. Defaults to "%Y-%m-%d".
+      workers (int, optional): The number of months downloaded at once. Defaults to 4.
 
     Returns:
       None
@@ -27,16 +28,35 @@ def extract_divvy_biketrip_dataset(start_date, end_date, destination, date_forma
     if validate_date(start_date, end_date):
         urls = get_data_urls(start_date, end_date)
         # Download data
+        files = []
         for url in urls:
             filename = url[-25:]
-            year = filename[:4]
-            path = os.path.join(destination, year)
+            path = os.path.join(destination, filename[:4])
             create_path(path)
-            download_file_from_web(url, filename, path)
+            files.append((url, filename, path))
+        download_files_from_web(files, workers=workers)
     else:
         print("Invalid Date")
 
 
+def download_divvy_month(url: str, destination: str) -> str:
+    """Download and unzip the Divvy biketrip dataset of one month in its year directory.
+
+    Args:
+      url (str): URL of the monthly zip file.
+      destination (str): Directory holding one sub-directory per year.
+
+    Returns:
+      str: Path of the extracted csv file.
+    """
+    filename = url[-25:]
+    year = filename[:4]
+    path = os.path.join(destination, year)
+    create_path(path)
+    download_file_from_web(url, filename, path)
+    return os.path.join(path, filename.replace(".zip", ".csv"))
+
+
 def format_data_url(date_str: str) -> str:
     """Create the URL to download Divvy biketrip dataset for a given date.
     """
@@ -1,14 +1,14 @@
 from datetime import datetime
 import os
 from pathlib import Path
+from typing import Any, Optional
 import pandas as pd
+from etl.extract import read_file
+from etl.query import all_filter, any_filter, date_range_filter, match_filter, query_dataset
+from helpers.util_schema import date_format, final_trip_dtype, parse_dates
 
-
-def date_parser(date): return datetime.strptime(date, '%Y-%m-%d %H:%M:%S')
-
-
-parse_dates: list[str] = ['started_at', 'ended_at']
 filepath = os.path.join(str(Path(__file__).parents[2]), "data", 'final', 'divvy_final.csv')
+dataset_path = os.path.join(str(Path(__file__).parents[2]), "data", 'final', 'divvy_final.parquet')
 default_cols = [
     'ride_id',
     'rideable_type',
@@ -27,9 +27,64 @@ default_cols = [
     'end_lng',
     'end_primary_neighborhood',
     'end_secondary_neighborhood',
-    'duration_min'
+    'duration_min',
+    'distance_km',
+    'speed_kmh'
 ]
 
 
 def load_data(row_num: int, default_cols: list[str] = default_cols) -> pd.DataFrame:
-    return pd.read_csv(filepath, nrows=row_num, usecols=default_cols, date_parser=date_parser, parse_dates=parse_dates)
+    dtype = {col: final_trip_dtype[col] for col in default_cols if col in final_trip_dtype}
+    return read_file(filepath, nrows=row_num, usecols=default_cols, dtype=dtype, date_format=date_format,
+                     parse_dates=[col for col in parse_dates if col in default_cols])
+
+
+def load_parquet_data(default_cols: list[str] = default_cols, start_date: Optional[datetime] = None,
+                      end_date: Optional[datetime] = None) -> pd.DataFrame:
+    """Loads the final Parquet dataset, reading only the requested columns and months.
+
+    Args:
+      default_cols (list[str], optional): Columns to read. Defaults to all columns of the final dataset.
+      start_date (datetime, optional): Only read the trips started at or after this date. Defaults to None.
+      end_date (datetime, optional): Only read the trips started before this date. Defaults to None.
+
+    Returns:
+      pd.DataFrame: The matching trips.
+    """
+    return query_trips(start_date, end_date, columns=default_cols)
+
+
+def query_trips(start_date: Optional[datetime] = None, end_date: Optional[datetime] = None, member_casual: Any = None,
+                rideable_type: Any = None, station: Any = None, neighborhood: Any = None, columns: Optional[list[str]] = None,
+                path: Optional[str] = None) -> pd.DataFrame:
+    """Reads the trips of the final Parquet dataset that match every given condition.
+
+    Only the months of the date range are opened, and within them only the row groups whose min/max
+    statistics can match (the files are sorted by start time, see `send_to_parquet`), so dashboard
+    queries over a few weeks or a few stations do not scan the whole dataset. Each condition takes a
+    single value or a list of values.
+
+    Args:
+      start_date (datetime, optional): Only the trips started at or after this date. Defaults to None.
+      end_date (datetime, optional): Only the trips started before this date. Defaults to None.
+      member_casual (str or list, optional): 'member' and / or 'casual'. Defaults to None.
+      rideable_type (str or list, optional): e.g. 'classic_bike', 'electric_bike'. Defaults to None.
+      station (str or list, optional): Station name(s), at the start or at the end of the trip. Defaults to None.
+      neighborhood (str or list, optional): Primary neighborhood(s), at the start or at the end of the trip. Defaults to None.
+      columns (list[str], optional): Columns to read. Defaults to all columns of the final dataset.
+      path (str, optional): Path of the dataset. Defaults to the final dataset of the pipeline.
+
+    Returns:
+      pd.DataFrame: The matching trips.
+    """
+    filters = date_range_filter('started_at', start_date, end_date, partitioned=True)
+    if member_casual is not None:
+        filters.append(match_filter('member_casual', member_casual))
+    if rideable_type is not None:
+        filters.append(match_filter('rideable_type', rideable_type))
+    if station is not None:
+        filters.append(any_filter(match_filter('start_station_name', station), match_filter('end_station_name', station)))
+    if neighborhood is not None:
+        filters.append(any_filter(match_filter('start_primary_neighborhood', neighborhood),
+                                  match_filter('end_primary_neighborhood', neighborhood)))
+    return query_dataset(path or dataset_path, columns=columns or default_cols, filter=all_filter(filters))
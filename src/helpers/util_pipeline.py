@@ -0,0 +1,366 @@
+from datetime import datetime
+import os
+from typing import List, Optional
+import pandas as pd
+from etl import sql, transform, validate
+from etl.extract import iter_files, iter_files_in_directory, list_files_in_directory, read_file
+from etl.schema import apply_schema, memory_report
+from etl.load import merge_csv_files, send_to_csv, send_to_parquet
+from etl.scheduler import Stage, run_stages
+from etl.manifest import (
+    config_hash, file_checksum, get_remote_metadata, is_remote_unchanged, is_up_to_date, load_manifest, save_manifest
+)
+from helpers import util_transform, util_validate
+from helpers.util_schema import plain_trip_dtype, raw_trip_schema
+from helpers.util_sql import build_station_df_sql, send_quarantine_sql, send_trips_sql, valid_trips_sql, validate_trips_sql
+from helpers.util_extract import download_divvy_month, get_data_urls, validate_date
+from helpers.util_rollup import build_rollups, combine_rollups, export_rollups, send_rollups
+from helpers.util_tests import create_path
+from helpers.util_transform import first_seen_stations, keep_first_seen, geocode_stations, transform_data, update_station_cache
+from helpers.util_validate import export_quarantine_counts, send_quarantine, validate_trips
+
+
+def build_station_df_from_files(files: List[str], chunksize: Optional[int] = None, cache_path: Optional[str] = None,
+                                **kwargs) -> pd.DataFrame:
+    """Builds the station table of all trips in a list of files while holding one file (or chunk) at a time.
+
+    Only the station columns are read, each chunk is reduced to its first seen stations and the
+    reduced chunks are combined once at the end.
+
+    Args:
+      files (list of str): Paths of the trip files.
+      chunksize (int, optional): The maximum number of rows per chunk, whole files when None. Defaults to None.
+      cache_path (str, optional): Path of the station cache, see `update_station_cache`. Defaults to None.
+      **kwargs: Keyword arguments to pass to `read_file`.
+
+    Returns:
+      pd.DataFrame: The station table, identical to `build_station_df` on all trips at once.
+    """
+    kwargs['usecols'] = ['start_station_name', 'started_at', 'start_lat', 'start_lng', 'end_station_name', 'ended_at', 'end_lat', 'end_lng']
+    kwargs['parse_dates'] = ['started_at', 'ended_at']
+    station_df = pd.concat([first_seen_stations(df) for df in iter_files(files, chunksize, **kwargs)]).pipe(keep_first_seen)
+    return geocode_stations(station_df) if cache_path is None else update_station_cache(station_df, cache_path)
+
+
+def build_station_df_in_chunks(input_dir: str, file_ext: str = '.csv', sub_dir: List[str] = [], chunksize: Optional[int] = None,
+                               cache_path: Optional[str] = None, **kwargs) -> pd.DataFrame:
+    """Builds the station table of all trips in a directory, see `build_station_df_from_files`.
+
+    Args:
+      input_dir (str): The directory holding the trip files.
+      file_ext (str, optional): The file extension to search for. Defaults to '.csv'.
+      sub_dir (list, optional): Specified sub-directories to search for files in. Defaults to None.
+      chunksize (int, optional): The maximum number of rows per chunk, whole files when None. Defaults to None.
+      cache_path (str, optional): Path of the station cache, see `update_station_cache`. Defaults to None.
+      **kwargs: Keyword arguments to pass to `read_file`.
+
+    Returns:
+      pd.DataFrame: The station table.
+    """
+    return build_station_df_from_files(list_files_in_directory(input_dir, file_ext, sub_dir), chunksize, cache_path, **kwargs)
+
+
+def raw_memory_report(input_dir: str, file_ext: str = '.csv', sub_dir: List[str] = [], **kwargs) -> str:
+    """Compares the memory of the first raw trip file before and after `apply_schema` with `raw_trip_schema`.
+
+    The file is read with the dtypes pandas infers without a schema (Python strings and float64), only one file
+    is read so the report stays cheap on the full date range.
+
+    Args:
+      input_dir (str): Directory of the raw trip files.
+      file_ext (str, optional): The file extension of the trip files. Defaults to '.csv'.
+      sub_dir (list, optional): Sub-directories to search for files in. Defaults to [].
+      **kwargs: Keyword arguments to pass to `read_file`.
+
+    Returns:
+      str: The report of `memory_report`.
+
+    Raises:
+      FileNotFoundError: If there is no trip file in the directory.
+    """
+    files = list_files_in_directory(input_dir, file_ext, sub_dir)
+    if not files:
+        raise FileNotFoundError(f"No '{file_ext}' trip files in {input_dir}")
+    plain_df = read_file(files[0], dtype=plain_trip_dtype, **kwargs)
+    return memory_report(plain_df, apply_schema(plain_df, raw_trip_schema))
+
+
+def send_trips(df: pd.DataFrame, filename: str, destination: str, file_format: str = 'csv', append: bool = False,
+               file_prefix: Optional[str] = None, workers: int = 1, compression: Optional[str] = None) -> None:
+    """Writes transformed trips as a csv file or as a Parquet dataset partitioned by the month of `started_at`.
+
+    Args:
+      df (pd.DataFrame): The transformed trips.
+      filename (str): Name of the output file (csv) or directory (parquet).
+      destination (str): Directory where the output should be saved.
+      file_format (str, optional): Either 'csv' or 'parquet'. Defaults to 'csv'.
+      append (bool, optional): Add the trips to the existing output instead of overwriting it. Defaults to False.
+      file_prefix (str, optional): Prefix of the Parquet files, see `send_to_parquet`. Defaults to None.
+      workers (int, optional): Number of processes formatting the csv, see `send_to_csv`. Defaults to 1.
+      compression (str, optional): Compression of the csv, either 'gzip' or 'zstd'. Defaults to None.
+
+    Raises:
+      ValueError: If the file format is not one of the valid file formats.
+    """
+    match file_format:
+        case "csv":
+            send_to_csv(df, filename, destination, append=append, workers=workers, compression=compression, verbose=True)
+        case "parquet":
+            send_to_parquet(df, filename, destination, date_column='started_at', append=append, file_prefix=file_prefix)
+        case _:
+            raise ValueError(f"Invalid file format '{file_format}'. Valid file formats are 'csv', 'parquet'")
+
+
+def stream_divvy_pipeline(input_dir: str, filename: str, destination: str, file_ext: str = '.csv', sub_dir: List[str] = [],
+                          chunksize: Optional[int] = None, file_format: str = 'csv', station_cache_path: Optional[str] = None,
+                          rollups: bool = True, **kwargs) -> None:
+    """Transforms the trips of a directory file by file (or chunk by chunk) and appends them to the output.
+
+    The station table is built once up front, then every chunk is validated, joined, filtered and written on
+    its own, so peak memory depends on the chunk size rather than on the number of files. Rejected trips are
+    written to `<destination>/quarantine`, see `validate_trips`.
+
+    Args:
+      input_dir (str): The directory holding the trip files.
+      filename (str): Name of the output file (csv) or directory (parquet).
+      destination (str): Directory where the output should be saved.
+      file_ext (str, optional): The file extension to search for. Defaults to '.csv'.
+      sub_dir (list, optional): Specified sub-directories to search for files in. Defaults to None.
+      chunksize (int, optional): The maximum number of rows per chunk, whole files when None. Defaults to None.
+      file_format (str, optional): Either 'csv' or 'parquet'. Defaults to 'csv'.
+      station_cache_path (str, optional): Path of the station cache, see `update_station_cache`. Defaults to None.
+      rollups (bool, optional): Also write the dashboard rollups of the trips, see `send_rollups`. Defaults to True.
+      **kwargs: Keyword arguments to pass to `read_file`.
+    """
+    print("Building station table ... ")
+    station_df = build_station_df_in_chunks(input_dir, file_ext, sub_dir, chunksize, station_cache_path, **kwargs)
+
+    print("Starting to transform files ... ")
+    parts = []
+    for i, df in enumerate(iter_files_in_directory(input_dir, file_ext, sub_dir, chunksize, **kwargs)):
+        df, rejected_df = validate_trips(df)
+        send_quarantine(rejected_df, destination, append=i > 0)
+        df = transform_data(df, station_df)
+        send_trips(df, filename, destination, file_format, append=i > 0)
+        if rollups:
+            parts.append(build_rollups(df))
+    if parts:
+        send_rollups(combine_rollups(parts), destination)
+        export_rollups(destination)
+    export_quarantine_counts(destination)
+    print("Finished transforming files")
+
+
+def duckdb_divvy_pipeline(input_dir: str, filename: str, destination: str, file_ext: str = '.csv', sub_dir: List[str] = [],
+                          file_format: str = 'csv', station_cache_path: Optional[str] = None, date_format: Optional[str] = None,
+                          memory_limit: Optional[str] = None, threads: Optional[int] = None) -> None:
+    """Runs the pipeline on DuckDB, an embedded out-of-core engine, straight over the raw files.
+
+    The trips are scanned, validated, joined, filtered and written by the engine on every core, spilling to disk past
+    the memory limit, so the date range is not bounded by the RAM. Only the station table and the few rejected trips
+    are handled in pandas, with the same geocoding as `build_station_df` and the same quarantine as
+    `stream_divvy_pipeline` (see `validate_trips_sql`). The output matches `stream_divvy_pipeline` on whole files,
+    which remains the reference, up to the order of the rows. Rollups are not written.
+
+    Args:
+      input_dir (str): The directory holding the trip files.
+      filename (str): Name of the output file (csv) or directory (parquet).
+      destination (str): Directory where the output should be saved.
+      file_ext (str, optional): The file extension to search for. Defaults to '.csv'.
+      sub_dir (list, optional): Specified sub-directories to search for files in. Defaults to None.
+      file_format (str, optional): Either 'csv' or 'parquet'. Defaults to 'csv'.
+      station_cache_path (str, optional): Path of the station cache, see `update_station_cache`. Defaults to None.
+      date_format (str, optional): strftime format of the timestamps of the raw and csv files. Defaults to None.
+      memory_limit (str, optional): Memory the engine may use before spilling, e.g. '6GB'. Defaults to 80% of the RAM.
+      threads (int, optional): Number of worker threads. Defaults to one per core.
+    """
+    files = sorted(list_files_in_directory(input_dir, file_ext, sub_dir))
+    con = sql.connect(memory_limit, threads, temp_directory=os.path.join(destination, '.duckdb_tmp'))
+    trips = sql.read_csv_sql(files, raw_trip_schema, date_format, filename=True)
+
+    print("Building station table ... ")
+    station_df = build_station_df_sql(con, trips, station_cache_path)
+
+    print("Starting to transform files ... ")
+    checked = f"({validate_trips_sql(trips)})"
+    print(f"Rejected {send_quarantine_sql(con, checked, destination):,} trips")
+    send_trips_sql(con, valid_trips_sql(checked), station_df, filename, destination, file_format, date_format)
+    con.close()
+    export_quarantine_counts(destination)
+    print("Finished transforming files")
+
+
+def transform_config_hash(**kwargs) -> str:
+    """Hashes the read options together with the transform and validation code, so a change of either invalidates the outputs.
+
+    Args:
+      **kwargs: Keyword arguments passed to `read_file`.
+
+    Returns:
+      str: The hex digest of the configuration.
+    """
+    sources = [file_checksum(module.__file__) for module in (transform, util_transform, validate, util_validate)]   # type: ignore
+    return config_hash({'read': kwargs, 'sources': sources})
+
+
+def run_incremental_pipeline(start_date: str, end_date: str, input_dir: str, filename: str, destination: str, manifest_path: str,
+                             range_format: str = "%Y-%m-%d", file_format: str = 'csv', station_cache_path: Optional[str] = None,
+                             rollups: bool = True, **kwargs) -> List[str]:
+    """Downloads, transforms and loads only the months that are new or changed since the last run.
+
+    Every processed month is recorded in a manifest with the remote ETag/size, the checksum of the raw file
+    and the hash of the transform configuration. A month is skipped when the remote file is unchanged, and
+    not transformed again when its raw file and configuration are unchanged. For csv output, each month is
+    written to its own file under `<destination>/months` and the final output is rebuilt by concatenating
+    these files. For parquet output, the partitions of the month are replaced in place.
+
+    Args:
+      start_date (str): Start date for the range.
+      end_date (str): End date for the range.
+      input_dir (str): Directory holding one sub-directory of raw files per year.
+      filename (str): Name of the output file.
+      destination (str): Directory where the output file should be saved.
+      manifest_path (str): Path of the manifest file.
+      range_format (str, optional): Format of the start and end date strings. Defaults to "%Y-%m-%d".
+      file_format (str, optional): Either 'csv' or 'parquet'. Defaults to 'csv'.
+      station_cache_path (str, optional): Path of the station cache. When given, only the stations of the new or
+        changed months are read, the others come from the cache. Otherwise the stations of every month of the
+        range are read. Defaults to None.
+      rollups (bool, optional): Also write the dashboard rollups of the transformed months, see `send_rollups`. Defaults to True.
+      **kwargs: Keyword arguments to pass to `read_file`.
+
+    Returns:
+      List[str]: The months ("YYYYMM") that were transformed during this run.
+    """
+    start, end = datetime.strptime(start_date, range_format), datetime.strptime(end_date, range_format)
+    if not validate_date(start, end):
+        print("Invalid Date")
+        return []
+
+    manifest = load_manifest(manifest_path)
+    transform_hash = transform_config_hash(file_format=file_format, **kwargs)
+    month_dir = os.path.join(destination, 'months')
+    create_path(month_dir)
+
+    pending: dict[str, str] = {}
+    raw_files = []
+    for url in get_data_urls(start, end):
+        month = url[-25:-19]
+        raw_file = os.path.join(input_dir, month[:4], f"{month}-divvy-tripdata.csv")
+        raw_files.append(raw_file)
+        entry = manifest.get(month)
+        remote = get_remote_metadata(url)
+        remote_unchanged = is_remote_unchanged(entry, remote)
+        if remote_unchanged and entry['config_hash'] == transform_hash and os.path.exists(entry['output']):   # type: ignore
+            continue
+
+        if not (remote_unchanged and os.path.exists(raw_file)):
+            print(f"Downloading {month} ... ")
+            raw_file = download_divvy_month(url, input_dir)
+        checksum = file_checksum(raw_file)
+        if not is_up_to_date(entry, checksum, transform_hash):
+            pending[month] = raw_file
+        output = os.path.join(month_dir, f"{month}.csv") if file_format == 'csv' else os.path.join(destination, filename)
+        manifest[month] = {**remote, 'url': url, 'checksum': checksum, 'config_hash': transform_hash, 'output': output}
+
+    if pending:
+        if station_cache_path is None:
+            # Every month of the range, not only the pending ones, so unchanged months keep their stations
+            station_df = build_station_df_from_files([file for file in raw_files if os.path.exists(file)], **kwargs)
+        else:
+            station_df = build_station_df_from_files(sorted(pending.values()), cache_path=station_cache_path, **kwargs)
+        for month, raw_file in sorted(pending.items()):
+            print(f"Transforming {month} ... ")
+            month_df, rejected_df = validate_trips(read_file(raw_file, **kwargs))
+            send_quarantine(rejected_df, destination, file_prefix=month)
+            month_df = transform_data(month_df, station_df)
+            if rollups:
+                send_rollups(build_rollups(month_df), destination, file_prefix=month)
+            if file_format == 'csv':
+                send_trips(month_df, f"{month}.csv", month_dir)
+            else:
+                # Files are named after the source month, so a re-run only replaces the rows of that month
+                send_trips(month_df, filename, destination, file_format, append=True, file_prefix=month)
+        if rollups:
+            export_rollups(destination)
+        export_quarantine_counts(destination)
+
+    final_filepath = os.path.join(destination, filename)
+    if file_format == 'csv' and (pending or not os.path.exists(final_filepath)):
+        merge_csv_files([manifest[month]['output'] for month in sorted(manifest)], filename, destination)
+    save_manifest(manifest, manifest_path)
+    return sorted(pending)
+
+
+def run_pipelined_pipeline(start_date: str, end_date: str, input_dir: str, filename: str, destination: str, station_cache_path: str,
+                           range_format: str = "%Y-%m-%d", file_format: str = 'csv', download_workers: int = 4, parse_workers: int = 2,
+                           queue_size: int = 2, rollups: bool = True, **kwargs) -> List[str]:
+    """Downloads, parses, enriches and writes the months of a date range, all four stages at once.
+
+    Each month flows through the stages on its own (see `etl.scheduler.run_stages`): while a month is
+    written the next one is enriched, the one after is parsed and the following ones are downloaded, so
+    the network, the CPU and the disk are busy at the same time. At most `queue_size` months wait between
+    two stages, which bounds memory. The station table grows month by month through the station cache,
+    so the enrich stage runs one month at a time and in date order, whatever order the downloads and the
+    parses finish in, which gives the same station ids and first-seen stations as a run over the months in
+    order. Months are written under their own name like in `run_incremental_pipeline`.
+
+    Args:
+      start_date (str): Start date for the range.
+      end_date (str): End date for the range.
+      input_dir (str): Directory holding one sub-directory of raw files per year.
+      filename (str): Name of the output file (csv) or directory (parquet).
+      destination (str): Directory where the output should be saved.
+      station_cache_path (str): Path of the station cache, see `update_station_cache`.
+      range_format (str, optional): Format of the start and end date strings. Defaults to "%Y-%m-%d".
+      file_format (str, optional): Either 'csv' or 'parquet'. Defaults to 'csv'.
+      download_workers (int, optional): Number of months downloaded at once. Defaults to 4.
+      parse_workers (int, optional): Number of months parsed at once. Defaults to 2.
+      queue_size (int, optional): Most months waiting between two stages. Defaults to 2.
+      rollups (bool, optional): Also write the dashboard rollups of the months, see `send_rollups`. Defaults to True.
+      **kwargs: Keyword arguments to pass to `read_file`.
+
+    Returns:
+      List[str]: The months ("YYYYMM") that were processed.
+    """
+    start, end = datetime.strptime(start_date, range_format), datetime.strptime(end_date, range_format)
+    if not validate_date(start, end):
+        print("Invalid Date")
+        return []
+    month_dir = os.path.join(destination, 'months')
+    create_path(month_dir)
+
+    def download(url: str) -> tuple[str, str]:
+        return url[-25:-19], download_divvy_month(url, input_dir)
+
+    def parse(task: tuple[str, str]) -> tuple[str, pd.DataFrame]:
+        month, raw_file = task
+        return month, read_file(raw_file, **kwargs)
+
+    def enrich(task: tuple[str, pd.DataFrame]) -> tuple[str, pd.DataFrame, pd.DataFrame]:
+        month, df = task
+        station_df = update_station_cache(first_seen_stations(df), station_cache_path)
+        clean_df, rejected_df = validate_trips(df)
+        return month, transform_data(clean_df, station_df), rejected_df
+
+    def write(task: tuple[str, pd.DataFrame, pd.DataFrame]) -> str:
+        month, df, rejected_df = task
+        send_quarantine(rejected_df, destination, file_prefix=month)
+        if file_format == 'csv':
+            send_trips(df, f"{month}.csv", month_dir)
+        else:
+            send_trips(df, filename, destination, file_format, append=True, file_prefix=month)
+        if rollups:
+            send_rollups(build_rollups(df), destination, file_prefix=month)
+        print(f"Finished {month}")
+        return month
+
+    stages = [Stage('download', download, download_workers), Stage('parse', parse, parse_workers), Stage('enrich', enrich, ordered=True),
+              Stage('write', write)]
+    months = run_stages(get_data_urls(start, end), stages, queue_size)
+    if file_format == 'csv':
+        merge_csv_files([os.path.join(month_dir, f"{month}.csv") for month in months], filename, destination)
+    if rollups:
+        export_rollups(destination)
+    export_quarantine_counts(destination)
+    return months
@@ -0,0 +1,64 @@
+import glob
+import os
+from typing import List, Optional
+import pandas as pd
+from etl.load import send_to_csv, send_to_parquet
+from etl.rollup import aggregate, merge_rollups, od_matrix
+
+# Dimensions of the dashboard, summarized per day and per hour
+dimensions = ['member_casual', 'rideable_type', 'start_primary_neighborhood']
+rollup_keys = {
+    'daily': ['date', *dimensions],
+    'hourly': ['date', 'hour', *dimensions],
+}
+# Origin-destination matrices of the route dashboards, the trips and their total duration and distance per pair
+od_keys = {
+    'od_station': ['start_station_id', 'end_station_id'],
+    'od_neighborhood': ['start_primary_neighborhood', 'end_primary_neighborhood'],
+}
+od_values = ['duration_min', 'distance_km']
+# Histogram bins of the trip duration (minutes), finer where most trips are
+duration_edges = [1, 2, 3, 4, 5, 6, 7, 8, 9, 10, 12, 14, 16, 18, 20, 25, 30, 35, 40, 45, 50, 60, 75, 90, 120, 180, 240, 360, 720]
+
+
+def build_rollups(df: pd.DataFrame) -> dict[str, pd.DataFrame]:
+    """Rolls transformed trips up into the dashboard cubes of `rollup_keys`, with the count, sum, min, max
+    and histogram of `duration_min` (see `etl.rollup.aggregate`), and into the origin-destination matrices
+    of `od_keys` (see `etl.rollup.od_matrix`)."""
+    cube_df = pd.DataFrame({'date': df['started_at'].dt.floor('D'), 'hour': df['started_at'].dt.hour.astype('int8'),
+                            **{col: df[col] for col in dimensions}, 'duration_min': df['duration_min']})
+    rollups = {name: aggregate(cube_df, keys, 'duration_min', duration_edges) for name, keys in rollup_keys.items()}
+    return {**rollups, **{name: od_matrix(df, origin, destination, od_values) for name, (origin, destination) in od_keys.items()}}
+
+
+def combine_rollups(parts: List[dict[str, pd.DataFrame]]) -> dict[str, pd.DataFrame]:
+    """Merges the rollups of several chunks of trips, see `etl.rollup.merge_rollups`."""
+    return {name: merge_rollups([part[name] for part in parts], keys) for name, keys in {**rollup_keys, **od_keys}.items()}
+
+
+def send_rollups(rollups: dict[str, pd.DataFrame], destination: str, file_prefix: Optional[str] = None) -> None:
+    """Writes the rollups as Parquet datasets under `<destination>/rollups`, one per cube.
+
+    Like `send_trips`, the rollups of a source month written with its name as prefix replace the
+    previous rollups of that month only, the others are kept and merged on read (see `load_rollup`).
+
+    Args:
+      rollups (dict): The cubes, from `build_rollups` or `combine_rollups`.
+      destination (str): Directory of the final outputs.
+      file_prefix (str, optional): Name of the source (e.g. "YYYYMM"). Defaults to None, which replaces every rollup.
+    """
+    rollup_dir = os.path.join(destination, 'rollups')
+    for name, rollup in rollups.items():
+        send_to_parquet(rollup, name, rollup_dir, append=file_prefix is not None, file_prefix=file_prefix)
+
+
+def load_rollup(name: str, destination: str) -> pd.DataFrame:
+    """Reads a cube written by `send_rollups`, merging the rollups of all the sources."""
+    files = glob.glob(os.path.join(destination, 'rollups', name, '*.parquet'))
+    return merge_rollups([pd.read_parquet(file) for file in files], {**rollup_keys, **od_keys}[name])
+
+
+def export_rollups(destination: str) -> None:
+    """Exports every cube to `<destination>/rollups/<cube>.csv` for the dashboard."""
+    for name in {**rollup_keys, **od_keys}:
+        send_to_csv(load_rollup(name, destination), f"{name}.csv", os.path.join(destination, 'rollups'))
@@ -0,0 +1,63 @@
+from etl.schema import read_dtypes
+
+# Canonical dtypes of the Divvy trips, from the raw files to the final dataset.
+# Repeated strings are categorical, ride ids are Arrow strings instead of Python objects and coordinates
+# are float32 (~1 m precision). Timestamps stay datetime64[ns], pandas 1.5 has no other resolution.
+raw_trip_schema = {
+    "ride_id": "string[pyarrow]",
+    "rideable_type": "category",
+    "started_at": "datetime64[ns]",
+    "ended_at": "datetime64[ns]",
+    "start_station_name": "category",
+    "start_station_id": "category",
+    "end_station_name": "category",
+    "end_station_id": "category",
+    "start_lat": "float32",
+    "start_lng": "float32",
+    "end_lat": "float32",
+    "end_lng": "float32",
+    "member_casual": "category",
+}
+
+# Station ids are nullable so trips of unknown stations keep integer ids
+station_schema = {
+    "station_id": "Int32",
+    "station_name": "category",
+    "lat": "float32",
+    "lng": "float32",
+    "state": "category",
+    "primary_neighborhood": "category",
+    "secondary_neighborhood": "category",
+}
+
+final_trip_schema = {
+    "ride_id": "string[pyarrow]",
+    "rideable_type": "category",
+    "started_at": "datetime64[ns]",
+    "ended_at": "datetime64[ns]",
+    "start_station_name": "category",
+    "end_station_name": "category",
+    "member_casual": "category",
+    "start_station_id": "Int32",
+    "start_lat": "float32",
+    "start_lng": "float32",
+    "start_state": "category",
+    "start_primary_neighborhood": "category",
+    "start_secondary_neighborhood": "category",
+    "end_station_id": "Int32",
+    "end_lat": "float32",
+    "end_lng": "float32",
+    "end_state": "category",
+    "end_primary_neighborhood": "category",
+    "end_secondary_neighborhood": "category",
+    "duration_min": "int32",
+    "distance_km": "float32",
+    "speed_kmh": "float32",
+}
+
+date_format = '%Y-%m-%d %H:%M:%S'
+parse_dates: list[str] = ['started_at', 'ended_at']
+raw_trip_dtype = read_dtypes(raw_trip_schema)
+# The dtypes pandas infers without a schema: Python strings and float64
+plain_trip_dtype = {col: object if dtype in ['category', 'string[pyarrow]'] else 'float64' for col, dtype in raw_trip_dtype.items()}
+final_trip_dtype = read_dtypes(final_trip_schema)
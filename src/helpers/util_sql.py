@@ -0,0 +1,137 @@
+from typing import Any, Optional
+import pandas as pd
+from etl.schema import apply_schema
+from etl.spatial import EARTH_RADIUS_KM
+from etl.sql import copy_to_csv, copy_to_parquet, not_null_sql, quote_name, reasons_sql
+from helpers.util_schema import raw_trip_schema, station_schema
+from helpers.util_transform import (
+    DROPPED_COLUMNS, MAX_DURATION, MIN_DURATION, STATION_COLUMNS, STATION_KEYS, geocode_stations, keep_first_seen, update_station_cache
+)
+from helpers.util_validate import send_quarantine, trip_rules
+
+
+def first_seen_stations_sql(trips: str) -> str:
+    """SQL version of `first_seen_stations`, the name, time and coordinates of the first trip started or ended at each station.
+
+    Args:
+      trips (str): SQL table expression of the raw trips, e.g. from `read_csv_sql`.
+
+    Returns:
+      str: The query.
+    """
+    visits = []
+    for prefix, time_column in [('start_', 'started_at'), ('end_', 'ended_at')]:
+        columns = [f'{prefix}station_name', time_column, f'{prefix}lat', f'{prefix}lng']
+        visits.append(f"SELECT {prefix}station_name AS station_name, {time_column} AS started_at, {prefix}lat AS lat, {prefix}lng AS lng "
+                      f"FROM {trips} WHERE {not_null_sql(columns)}")
+    return (f"SELECT station_name, first_seen.started_at, first_seen.lat, first_seen.lng FROM ("
+            f"SELECT station_name, arg_min(struct_pack(started_at := started_at, lat := lat, lng := lng), started_at) AS first_seen "
+            f"FROM ({' UNION ALL '.join(visits)}) GROUP BY station_name)")
+
+
+def transform_trips_sql(trips: str, stations: str = 'stations') -> str:
+    """SQL version of `transform_data`: null drop, station lookups, duration, duration filter, distance and speed.
+
+    The output has the columns of `transform_data` in the same order, rows come in no particular order.
+
+    Args:
+      trips (str): SQL table expression of the raw trips, e.g. from `read_csv_sql`.
+      stations (str, optional): Name of the station table (see `build_station_df`). Defaults to 'stations'.
+
+    Returns:
+      str: The query.
+    """
+    raw_columns = list(raw_trip_schema)
+    columns = [f"t.{quote_name(col)}" for col in raw_columns if col not in DROPPED_COLUMNS]
+    joins = []
+    for i, (key, prefix) in enumerate(STATION_KEYS.items()):
+        alias = f"s{i}"
+        columns += [f"{alias}.{quote_name(col)} AS {quote_name(prefix + col)}" for col in STATION_COLUMNS if col != 'station_name']
+        joins.append(f"LEFT JOIN {stations} {alias} ON t.{quote_name(key)} = {alias}.station_name")
+    duration = "CAST(floor((epoch_ms(t.ended_at) - epoch_ms(t.started_at)) / 60000) AS INTEGER)"
+    # Same haversine formula as `etl.spatial.haversine_km`, between the station coordinates
+    distance = (f"CAST(2 * {EARTH_RADIUS_KM} * asin(sqrt(pow(sin(radians(s1.lat - s0.lat) / 2), 2) "
+                f"+ cos(radians(s0.lat)) * cos(radians(s1.lat)) * pow(sin(radians(s1.lng - s0.lng) / 2), 2))) AS FLOAT)")
+    return (f"SELECT *, CAST(distance_km / (duration_min / 60) AS FLOAT) AS speed_kmh FROM ("
+            f"SELECT {', '.join(columns)}, {duration} AS duration_min, {distance} AS distance_km "
+            f"FROM (SELECT * FROM {trips} WHERE {not_null_sql(raw_columns)}) t {' '.join(joins)}) "
+            f"WHERE duration_min > {MIN_DURATION} AND duration_min < {MAX_DURATION}")
+
+
+def validate_trips_sql(trips: str) -> str:
+    """SQL version of `validate_trips`, the raw trips with the reasons bitmask of `trip_rules` (0 for valid trips).
+
+    The trips need the `filename` column of `read_csv_sql(..., filename=True)`, duplicate ride ids are only found
+    within a file like in the pandas pipelines. Of the trips of a file sharing a ride id, pandas keeps the first one
+    of the file and the engine the first started one (then the first by the other raw columns), which only differs
+    when the repeated trips differ.
+
+    Args:
+      trips (str): SQL table expression of the raw trips, with their file name.
+
+    Returns:
+      str: The query.
+    """
+    order_by = ['started_at', 'ended_at'] + [col for col in raw_trip_schema if col not in ['started_at', 'ended_at']]
+    return reasons_sql(trips, trip_rules, partition_by=['filename'], order_by=order_by)
+
+
+def valid_trips_sql(checked: str) -> str:
+    """The trips of `validate_trips_sql` passing every rule, with the raw columns only."""
+    return f"(SELECT * EXCLUDE (filename, reasons) FROM {checked} WHERE reasons = 0)"
+
+
+def send_quarantine_sql(con: Any, checked: str, destination: str) -> int:
+    """Writes the trips of `validate_trips_sql` breaking a rule to the quarantine, see `send_quarantine`.
+
+    Rejected trips are few, they are fetched in pandas with the raw schema and their reasons.
+
+    Returns:
+      int: The number of rejected trips.
+    """
+    rejected_df = con.execute(f"SELECT * EXCLUDE (filename) FROM {checked} WHERE reasons <> 0").df()
+    send_quarantine(apply_schema(rejected_df, raw_trip_schema), destination)
+    return len(rejected_df)
+
+
+def build_station_df_sql(con: Any, trips: str, cache_path: Optional[str] = None) -> pd.DataFrame:
+    """Same as `build_station_df`, the first seen stations are found by the engine and only the station table is geocoded in pandas.
+
+    Args:
+      con (duckdb.DuckDBPyConnection): The connection.
+      trips (str): SQL table expression of the raw trips.
+      cache_path (str, optional): Path of the station cache, see `update_station_cache`. Defaults to None.
+
+    Returns:
+      pd.DataFrame: The station table.
+    """
+    station_df = con.execute(first_seen_stations_sql(trips)).df().pipe(keep_first_seen)
+    return geocode_stations(station_df) if cache_path is None else update_station_cache(station_df, cache_path)
+
+
+def send_trips_sql(con: Any, trips: str, station_df: pd.DataFrame, filename: str, destination: str, file_format: str = 'csv',
+                   timestamp_format: Optional[str] = None) -> None:
+    """Transforms the raw trips with the engine and streams the result to a csv file or a partitioned Parquet dataset.
+
+    Args:
+      con (duckdb.DuckDBPyConnection): The connection.
+      trips (str): SQL table expression of the raw trips.
+      station_df (pd.DataFrame): The station table.
+      filename (str): Name of the output file (csv) or directory (parquet).
+      destination (str): Directory where the output should be saved.
+      file_format (str, optional): Either 'csv' or 'parquet'. Defaults to 'csv'.
+      timestamp_format (str, optional): strftime format of the csv timestamps. Defaults to ISO 8601.
+
+    Raises:
+      ValueError: If the file format is not one of the valid file formats.
+    """
+    con.register('stations', apply_schema(station_df, station_schema))
+    query = transform_trips_sql(trips, 'stations')
+    match file_format:
+        case "csv":
+            copy_to_csv(con, query, filename, destination, timestamp_format)
+        case "parquet":
+            copy_to_parquet(con, query, filename, destination, date_column='started_at')
+        case _:
+            raise ValueError(f"Invalid file format '{file_format}'. Valid file formats are 'csv', 'parquet'")
+    con.unregister('stations')
@@ -1,6 +1,11 @@
 # Testing
+import hashlib
 import os
 import shutil
+import threading
+from contextlib import contextmanager
+from http.server import SimpleHTTPRequestHandler, ThreadingHTTPServer
+from typing import Iterator
 import pandas as pd
 
 
@@ -47,3 +52,75 @@ def clear_directory(dir_path: str) -> None:
 
 def add_5(col: str, row: pd.Series) -> int:
     return row[col] + 5   # type: ignore
+
+
+class RangeRequestHandler(SimpleHTTPRequestHandler):
+    """Serves files of a directory with support for `Range: bytes=N-` requests.
+
+    Like S3, responses carry the MD5 of the file as ETag. The first response for each path stops after
+    `drop_after` bytes when it is set, to simulate an interrupted download.
+    """
+    protocol_version = 'HTTP/1.1'
+    drop_after: int = 0
+    dropped: set[str] = set()
+
+    def log_message(self, format, *args) -> None:
+        pass
+
+    def do_HEAD(self) -> None:
+        path = self.translate_path(self.path)
+        if not os.path.isfile(path):
+            self.send_error(404)
+            return
+        with open(path, 'rb') as f:
+            content = f.read()
+        self.send_response(200)
+        self.send_header('Content-Length', str(len(content)))
+        self.send_header('ETag', f'"{hashlib.md5(content).hexdigest()}"')
+        self.end_headers()
+
+    def do_GET(self) -> None:
+        path = self.translate_path(self.path)
+        if not os.path.isfile(path):
+            self.send_error(404)
+            return
+        with open(path, 'rb') as f:
+            content = f.read()
+        start = int(self.headers.get('Range', 'bytes=0-')[6:].split('-')[0])
+        if start >= len(content) > 0:
+            self.send_response(416)
+            self.send_header('Content-Length', '0')
+            self.end_headers()
+            return
+        self.send_response(206 if start else 200)
+        self.send_header('Content-Length', str(len(content) - start))
+        self.send_header('ETag', f'"{hashlib.md5(content).hexdigest()}"')
+        self.end_headers()
+        if self.drop_after and self.path not in self.dropped:
+            self.dropped.add(self.path)
+            self.wfile.write(content[start:start + self.drop_after])
+            self.close_connection = True
+            return
+        self.wfile.write(content[start:])
+
+
+@contextmanager
+def serve_directory(directory: str, drop_after: int = 0) -> Iterator[str]:
+    """Serves a directory over HTTP on a free local port for the duration of the context.
+
+    Args:
+      directory (str): Directory to serve.
+      drop_after (int, optional): Number of bytes after which the first response of each file is cut. Defaults to 0.
+
+    Yields:
+      str: The base URL of the server.
+    """
+    handler = type('Handler', (RangeRequestHandler,), {'drop_after': drop_after, 'dropped': set()})
+    server = ThreadingHTTPServer(('127.0.0.1', 0), lambda *args: handler(*args, directory=directory))
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    try:
+        yield f"http://127.0.0.1:{server.server_address[1]}"
+    finally:
+        server.shutdown()
+        server.server_close()
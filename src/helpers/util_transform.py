@@ -1,83 +1,273 @@
+from contextlib import nullcontext
+from functools import lru_cache
 from pathlib import Path
+from typing import Any, ContextManager, Optional
+from etl.extract import read_geo_file
+from etl.manifest import config_hash, file_checksum
+from etl.schema import apply_schema
+from etl.spatial import PolygonIndex, haversine_km
 from etl.transform import (
-    add_column, add_geo_field_from_lat_long, combine_data, remove_column,
-    select_column, filter_column, sort_data, remove_duplicates, remove_null_values,
-    update_column_name, reset_index
+    add_column, columnar, first_by, add_geo_field_from_lat_long, add_lookup_columns, add_region_from_lat_long, combine_data, remove_column,
+    select_column, filter_column, filter_rows, sort_data, remove_null_values,
+    update_column_name, reset_index, TransformPlan
 )
 import geopandas as gpd
+import numpy as np
 import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+from shapely.geometry import box
+from helpers.util_schema import final_trip_schema, station_schema
 import os
 
 filepath_state = os.path.join(str(Path(__file__).parents[2]), 'data', 'processed', 'cb_2018_us_state_500k.shp')
 filepath_neighborhood = os.path.join(str(Path(__file__).parents[2]), 'data', 'processed', 'chicago_neighborhoods.geojson')
-states = gpd.read_file(filepath_state)
-neighborhood = gpd.read_file(filepath_neighborhood)
+filepath_station_cache = os.path.join(str(Path(__file__).parents[2]), 'data', 'processed', 'station_cache.parquet')
 
 
-def get_state(lat, lng, states, row):
-    # print(row[lng], row[lat])
-    point = gpd.points_from_xy([row[lng]], [row[lat]])[0]
-    result = states[states.contains(point)]
+@lru_cache(maxsize=None)
+def get_neighborhoods() -> gpd.GeoDataFrame:
+    """Chicago neighborhoods, loaded on first use and kept (with their spatial index) for the life of the process."""
+    neighborhoods = read_geo_file(filepath_neighborhood)
+    neighborhoods.sindex
+    return neighborhoods
 
-    # If the query returned any results, return the name of the state
-    if not result.empty:
-        return result.iloc[0]['NAME']
-    else:
-        return "None"
 
+@lru_cache(maxsize=None)
+def get_neighborhood_index() -> PolygonIndex:
+    """Point-in-polygon index of the Chicago neighborhoods, kept for the life of the process.
 
-def transform_data(df) -> pd.DataFrame:
+    Queries of more than a few hundred thousand points are split across one worker process per core. The
+    workers are only needed during a query, callers stop them when done with `with get_neighborhood_index() as index:`.
+    """
+    return PolygonIndex(get_neighborhoods(), workers=os.cpu_count() or 1)
 
-    station_df = build_station_df(df)
 
-    columns = ['start_station_id', 'end_station_id', 'start_lat', 'start_lng', 'end_lat', 'end_lng']
+@lru_cache(maxsize=None)
+def get_states(clip_to_chicago: bool = False) -> gpd.GeoDataFrame:
+    """US states, loaded on first use and kept (with their spatial index) for the life of the process.
 
-    # correct station name to include start and end prefix
-    start_station_cols = {col: "start_" + col for col in station_df.columns}
-    end_station_cols = {col: "end_" + col for col in station_df.columns}
-    start_station_df = station_df.pipe(update_column_name, start_station_cols)
-    end_station_df = station_df.pipe(update_column_name, end_station_cols)
+    Stations outside of the Chicago neighborhoods are dropped anyway, so the states can be clipped to
+    the bounding box of the neighborhoods, which leaves a couple of small polygons instead of ~56 large ones.
+    """
+    states = read_geo_file(filepath_state)
+    if clip_to_chicago:
+        states = gpd.clip(states, box(*get_neighborhoods().total_bounds))
+    states.sindex
+    return states
 
-    main_df = (df
-               .pipe(remove_null_values)
-               .pipe(remove_column, columns)
-               .pipe(combine_data, start_station_df, 'start_station_name')
-               .pipe(combine_data, end_station_df, 'end_station_name')
-               .pipe(add_column, 'duration_min', duration_in_minutes, 'started_at', 'ended_at')
-               .pipe(filter_column, 'duration_min', 'greater', 0)
-               .pipe(filter_column, 'duration_min', 'less', 1440)
-               )
+
+# Raw columns replaced by the attributes of the station table
+DROPPED_COLUMNS = ['start_station_id', 'end_station_id', 'start_lat', 'start_lng', 'end_lat', 'end_lng']
+# station attributes with start and end prefix
+STATION_KEYS = {'start_station_name': 'start_', 'end_station_name': 'end_'}
+# Raw columns that are null for trips without a station
+STATION_NAME_COLUMNS = ['start_station_name', 'start_station_id', 'end_station_name', 'end_station_id']
+# Trips shorter than a minute or longer than a day are dropped
+MIN_DURATION, MAX_DURATION = 0, 1440
+# Distance beyond which a cached station has moved, above the ~700 m error of coordinates rounded to 2 decimals
+MOVED_STATION_KM = 1.0
+
+
+def transform_data(df, station_df: Optional[pd.DataFrame] = None, trip_neighborhoods: bool = False) -> pd.DataFrame:
+    """Cleans the trips and adds the station attributes, duration, distance and speed.
+
+    With `trip_neighborhoods`, trips without a station (dockless electric bikes) are kept and the raw start
+    and end coordinates of every trip are geocoded to `start_coord_neighborhood` and `end_coord_neighborhood`.
+    """
+    station_df = build_station_df(df) if station_df is None else station_df
+    station_df = apply_schema(station_df, station_schema)
+    required = [col for col in df.columns if col not in STATION_NAME_COLUMNS] if trip_neighborhoods else None
+
+    # The steps are fused into a single row mask, the duration filter runs before the station lookup
+    plan = TransformPlan(df).pipe(remove_null_values, required)
+    if trip_neighborhoods:
+        for prefix in STATION_KEYS.values():
+            plan = plan.pipe(add_column, f'{prefix}coord_neighborhood', coord_neighborhood, f'{prefix}lat', f'{prefix}lng')
+    plan = (plan
+            .pipe(remove_column, DROPPED_COLUMNS)
+            .pipe(add_lookup_columns, station_df, 'station_name', STATION_KEYS)
+            .pipe(add_column, 'duration_min', duration_in_minutes, 'started_at', 'ended_at')
+            .pipe(filter_rows, '@low < duration_min < @high', low=MIN_DURATION, high=MAX_DURATION)
+            .pipe(add_column, 'distance_km', distance_in_km, 'start_lat', 'start_lng', 'end_lat', 'end_lng')
+            .pipe(add_column, 'speed_kmh', speed_in_kmh, 'distance_km', 'duration_min')
+            )
+    # The coordinates are only geocoded for the trips kept, the index workers stop once they are
+    geocoding: ContextManager[Any] = nullcontext()
+    if trip_neighborhoods:
+        geocoding = get_neighborhood_index()
+    with geocoding:
+        main_df = plan.collect().pipe(apply_schema, final_trip_schema)
     return main_df
 
 
-def build_station_df(df) -> pd.DataFrame:
-    columns = ['start_station_name', 'started_at', 'start_lat', 'start_lng']
-    columns_mapping = {'start_station_name': 'station_name',
-                       'start_lat': 'lat',
-                       'start_lng': 'lng', }
+STATION_COLUMNS = ['station_id', 'station_name', 'lat', 'lng', 'state', 'primary_neighborhood', 'secondary_neighborhood']
+
+
+def build_station_df(df, cache_path: Optional[str] = None) -> pd.DataFrame:
+    if cache_path is None:
+        return df.pipe(first_seen_stations).pipe(geocode_stations)
+    return update_station_cache(first_seen_stations(df), cache_path)
+
+
+def first_seen_stations(df) -> pd.DataFrame:
+    """Reduces trips to the name, time and coordinates of the first trip started or ended at each station.
+
+    A trip ending at a station counts as seen at `ended_at`, so stations that never start a trip are kept.
+    Results computed on separate chunks of trips can be concatenated and passed to `keep_first_seen`
+    to get the result of the whole set of trips.
+    """
+    visits = []
+    for prefix, time_column in [('start_', 'started_at'), ('end_', 'ended_at')]:
+        columns_mapping = {f'{prefix}station_name': 'station_name',
+                           time_column: 'started_at',
+                           f'{prefix}lat': 'lat',
+                           f'{prefix}lng': 'lng', }
+        visits.append(df
+                      .pipe(select_column, list(columns_mapping))
+                      .pipe(update_column_name, columns_mapping)
+                      .pipe(remove_null_values)
+                      .pipe(first_by, 'station_name', 'started_at')
+                      )
+    return pd.concat(visits).pipe(keep_first_seen)
+
+
+def keep_first_seen(station_df) -> pd.DataFrame:
+    """Keeps the first seen row of each station, in first seen order and with the rank as index."""
+    return (station_df
+            .pipe(first_by, 'station_name', 'started_at')
+            .pipe(sort_data, ['started_at', 'station_name'], 'asc')
+            .pipe(reset_index, drop=True)
+            )
+
+
+def geocode_stations(station_df) -> pd.DataFrame:
+    """Adds the station id, state and neighborhoods to the output of `first_seen_stations` and
+    drops the stations outside of Illinois.
+    """
     cols = ['station_id', 'station_name', 'lat', 'lng', 'state', 'pri_neigh', 'sec_neigh']
     c_mapping_2 = {'pri_neigh': 'primary_neighborhood', 'sec_neigh': 'secondary_neighborhood'}
+    # Stations outside of the neighborhoods are dropped below, so they are never looked up
+    chicago_bbox = tuple(get_neighborhoods().total_bounds)
 
-    station_df = (df
-                  .pipe(select_column, columns)
-                  .pipe(update_column_name, columns_mapping)
-                  .pipe(remove_null_values)
-                  .pipe(sort_data, 'started_at', 'asc')
-                  .pipe(remove_duplicates, "station_name")
-                  .pipe(remove_column, "started_at")
-                  .pipe(add_column, 'state', get_state, 'lat', 'lng', states)
-                  .pipe(filter_column, 'state', 'equal', 'Illinois')
-                  .pipe(reset_index)
-                  .pipe(update_column_name, {'index': 'station_id'})
-                  .pipe(add_geo_field_from_lat_long, neighborhood, 'lng', 'lat')
-                  .pipe(select_column, cols)
-                  .pipe(update_column_name, c_mapping_2)
-                  )
+    with get_neighborhood_index() as index:
+        station_df = (station_df
+                      .pipe(remove_column, "started_at")
+                      .pipe(add_region_from_lat_long, get_states(clip_to_chicago=True), 'lng', 'lat', 'NAME', 'state', chicago_bbox)
+                      .pipe(filter_column, 'state', 'equal', 'Illinois')
+                      .pipe(reset_index)
+                      .pipe(update_column_name, {'index': 'station_id'})
+                      .pipe(add_geo_field_from_lat_long, get_neighborhoods(), 'lng', 'lat', index)
+                      .pipe(select_column, cols)
+                      .pipe(update_column_name, c_mapping_2)
+                      )
     return station_df
 
 
-def duration_in_minutes(start_time: str, end_time: str, row) -> int:
+def boundaries_fingerprint() -> str:
+    """Hash of the boundary files used to geocode stations."""
+    files = [filepath_state, filepath_state.replace('.shp', '.dbf'), filepath_neighborhood]
+    return config_hash({'boundaries': [file_checksum(file) for file in files]})
+
+
+def read_station_cache(cache_path: str) -> pd.DataFrame:
+    """Reads the station cache, every station seen so far with its first seen time and coordinates.
+
+    Stations that were rejected (outside of Illinois or of every neighborhood) are kept with a null
+    state so they are not geocoded again. The geocoding columns are dropped when the boundary files
+    changed since the cache was written, the station ids are always kept.
+    """
+    if not os.path.exists(cache_path):
+        return pd.DataFrame({'station_name': pd.Series(dtype=object), 'started_at': pd.Series(dtype='datetime64[ns]'),
+                             'lat': pd.Series(dtype=float), 'lng': pd.Series(dtype=float), 'station_id': pd.Series(dtype=float)})
+    table = pq.read_table(cache_path)
+    cache = table.to_pandas()
+    if (table.schema.metadata or {}).get(b'boundaries', b'').decode() != boundaries_fingerprint():
+        cache = cache.pipe(select_column, ['station_name', 'started_at', 'lat', 'lng', 'station_id'])
+    return cache
+
+
+def write_station_cache(cache: pd.DataFrame, cache_path: str) -> None:
+    """Writes the station cache with the fingerprint of the boundary files, see `read_station_cache`.
+
+    The cache is written next to its path and moved in place, so an interrupted run leaves the previous cache.
+    """
+    table = pa.Table.from_pandas(cache, preserve_index=False)
+    table = table.replace_schema_metadata({**(table.schema.metadata or {}), b'boundaries': boundaries_fingerprint().encode()})
+    temp_path = f"{cache_path}.tmp"
+    pq.write_table(table, temp_path)
+    os.replace(temp_path, cache_path)
+
+
+def update_station_cache(station_df, cache_path: str, tolerance_km: float = MOVED_STATION_KM) -> pd.DataFrame:
+    """Geocodes the stations of `first_seen_stations` missing from the cache, adds them to it and returns
+    the station table of every valid cached station.
+
+    Cached stations keep their id across runs, new stations get the next ids in first seen order. A station
+    seen after its cached time more than `tolerance_km` away from its cached coordinates has moved, it is
+    geocoded again at its new coordinates and keeps its id.
+    """
+    cache = read_station_cache(cache_path)
+    known_ids = cache.set_index('station_name')['station_id']
+    next_id = int(known_ids.max()) + 1 if len(known_ids) > 0 else 0
+
+    seen_again = station_df.loc[station_df['station_name'].isin(cache['station_name'])]
+    cached = cache.set_index('station_name').loc[seen_again['station_name']]
+    moved = ((seen_again['started_at'].to_numpy(dtype='datetime64[ns]') > cached['started_at'].to_numpy(dtype='datetime64[ns]'))
+             & (haversine_km(seen_again['lat'].to_numpy(), seen_again['lng'].to_numpy(),
+                             cached['lat'].to_numpy(), cached['lng'].to_numpy()) > tolerance_km))
+    cache = cache.loc[~cache['station_name'].isin(seen_again['station_name'][moved])]
+
+    if 'state' not in cache.columns:
+        # New cache or boundary files changed, geocode every station again
+        station_df = pd.concat([cache.pipe(remove_column, 'station_id'), station_df])
+        cache = cache.iloc[:0]
+
+    station_df = (station_df
+                  .loc[lambda x: ~x['station_name'].isin(cache['station_name'])]
+                  .pipe(keep_first_seen)
+                  )
+    ids = station_df['station_name'].map(known_ids).to_numpy()
+    new = np.isnan(ids)
+    ids[new] = next_id + np.arange(new.sum())
+    station_df.index = pd.Index(ids.astype(int))
+
+    geocoded = geocode_stations(station_df).pipe(remove_column, ['station_name', 'lat', 'lng'])
+    new_rows = combine_data(station_df.assign(station_id=station_df.index), geocoded, 'station_id')
+    cache = pd.concat([cache, new_rows], ignore_index=True).astype({'station_id': int})
+    write_station_cache(cache, cache_path)
+
+    return (cache
+            .loc[cache['state'].notna()]
+            .pipe(sort_data, 'station_id')
+            .pipe(select_column, STATION_COLUMNS)
+            .pipe(reset_index, drop=True)
+            )
+
+
+@columnar
+def duration_in_minutes(start_time: str, end_time: str, row) -> pd.Series:
     """Calculates the duration in minutes '"""
     duration = row[end_time] - row[start_time]
-    duration_minutes = duration.total_seconds() // 60
-    return int(duration_minutes)
+    duration_minutes = duration.dt.total_seconds() // 60
+    return duration_minutes.astype('int32')
+
+
+@columnar
+def distance_in_km(start_lat: str, start_lng: str, end_lat: str, end_lng: str, row) -> pd.Series:
+    """Great-circle distance between the start and end coordinates (of the stations after the lookup), in kilometers."""
+    distance = haversine_km(row[start_lat], row[start_lng], row[end_lat], row[end_lng])
+    return pd.Series(distance, index=row.index, dtype='float32')
+
+
+@columnar
+def coord_neighborhood(lat: str, lng: str, row) -> pd.Series:
+    """Primary neighborhood of the raw coordinates, null for coordinates that are null or outside of Chicago."""
+    index = get_neighborhood_index()
+    return pd.Series(index.take(index.query(row[lng], row[lat]), 'pri_neigh'), index=row.index)
+
+
+@columnar
+def speed_in_kmh(distance: str, duration: str, row) -> pd.Series:
+    """Average speed over the distance in kilometers and the duration in minutes, null for null distances."""
+    return (row[distance] / (row[duration] / 60)).astype('float32')
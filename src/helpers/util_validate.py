@@ -0,0 +1,67 @@
+import glob
+import os
+from typing import Optional, Tuple
+import pandas as pd
+from etl.load import send_to_csv, send_to_parquet
+from etl.validate import Rule, rule_counts, split_valid
+
+# Service area of Divvy, Chicago and the suburbs it serves: (min_lng, min_lat, max_lng, max_lat)
+CHICAGO_BBOX = (-88.0, 41.6, -87.5, 42.1)
+
+# Data-quality rules of the raw trips, a rejected trip keeps bit i of its reasons for trip_rules[i]
+trip_rules = [
+    Rule('missing_value', 'notnull', ['ride_id', 'rideable_type', 'started_at', 'ended_at', 'start_station_name', 'start_station_id',
+                                      'end_station_name', 'end_station_id', 'start_lat', 'start_lng', 'end_lat', 'end_lng', 'member_casual']),
+    # Same bounds as the 0 < duration_min < 1440 filter of `transform_data`, in whole minutes
+    Rule('duration_out_of_range', 'span', ['started_at', 'ended_at'], (pd.Timedelta(1, 'min'), pd.Timedelta(1440, 'min'))),
+    Rule('outside_chicago', 'between', ['start_lng', 'start_lat', 'end_lng', 'end_lat'],
+         [(CHICAGO_BBOX[0], CHICAGO_BBOX[2]), (CHICAGO_BBOX[1], CHICAGO_BBOX[3])] * 2),
+    Rule('unknown_rideable_type', 'in', ['rideable_type'], ['classic_bike', 'electric_bike', 'docked_bike']),
+    Rule('unknown_member_casual', 'in', ['member_casual'], ['member', 'casual']),
+    Rule('duplicate_ride_id', 'unique', ['ride_id']),
+]
+
+
+def validate_trips(df: pd.DataFrame) -> Tuple[pd.DataFrame, pd.DataFrame]:
+    """Splits raw trips into the trips passing every rule of `trip_rules` and the rejected ones, with their
+    reasons bitmask (see `etl.validate.split_valid`).
+
+    Duplicate ride ids are only found within df, i.e. within a file or a chunk.
+    """
+    clean_df, rejected_df = split_valid(df, trip_rules)
+    print(f"Rejected {len(rejected_df):,} of {len(df):,} trips")
+    return clean_df, rejected_df
+
+
+def send_quarantine(rejected_df: pd.DataFrame, destination: str, append: bool = False, file_prefix: Optional[str] = None) -> None:
+    """Writes rejected trips to the Parquet dataset `<destination>/quarantine/trips`.
+
+    Like `send_rollups`, the trips of a source month written with its name as prefix replace the previous
+    rejected trips of that month only.
+
+    Args:
+      rejected_df (pd.DataFrame): The rejected trips, from `validate_trips`.
+      destination (str): Directory of the final outputs.
+      append (bool, optional): Add the trips to the existing ones instead of replacing them. Defaults to False.
+      file_prefix (str, optional): Name of the source (e.g. "YYYYMM"), implies append. Defaults to None.
+    """
+    send_to_parquet(rejected_df, 'trips', os.path.join(destination, 'quarantine'), append=append or file_prefix is not None,
+                    file_prefix=file_prefix)
+
+
+def export_quarantine_counts(destination: str) -> pd.DataFrame:
+    """Counts the quarantined trips breaking each rule and writes the counts to `<destination>/quarantine/counts.csv`.
+
+    Only the reasons column of the quarantined trips is read.
+
+    Returns:
+      pd.DataFrame: The rule, its bit and the number of quarantined trips breaking it, for every rule.
+    """
+    quarantine_dir = os.path.join(destination, 'quarantine')
+    files = glob.glob(os.path.join(quarantine_dir, 'trips', '*.parquet'))
+    reasons = pd.concat([pd.read_parquet(file, columns=['reasons'])['reasons'] for file in files]) if files else pd.Series(dtype='uint8')
+    counts = rule_counts(reasons.to_numpy(), trip_rules).rename_axis('rule').reset_index()
+    counts.insert(1, 'bit', range(len(trip_rules)))
+    send_to_csv(counts, 'counts.csv', quarantine_dir)
+    print(counts.to_string(index=False))
+    return counts
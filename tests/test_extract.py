@@ -1,13 +1,20 @@
 """This script contains test modules for all the functions in extract.py file"""
 
 import os
+import subprocess
+import sys
 from typing import Union
 import pytest
-from etl.extract import download_file_from_web, extract_all_files_in_directory
-from helpers.util_tests import create_files_in_directory
+from etl.extract import (
+    DownloadError, download_file_from_web, download_files_from_web, extract_all_files_in_directory, concat_dataframes,
+    iter_files_in_directory, read_file, read_geo_file
+)
+import geopandas as gpd
+from shapely.geometry import box
+from helpers.util_tests import create_files_in_directory, serve_directory
 import pandas as pd
-import subprocess
 import tempfile
+import zipfile
 
 
 def test_download_file_from_web_valid_url():
@@ -41,11 +48,105 @@ def test_download_file_from_web_valid_url():
 
 
 def test_download_file_from_web_error():
-    with pytest.raises(subprocess.CalledProcessError):
+    with pytest.raises(DownloadError):
         with tempfile.TemporaryDirectory() as temp_dir:
             download_file_from_web("www.fake-url-should-fail.com", "bad_file.csv", temp_dir)
 
 
+def test_download_file_from_web_local_server():
+    """
+    Test compressed and plain downloads against a local server that cuts the first response of each file.
+    """
+    content = 'col1,col2\n' + ''.join(f'{i},{i * 2}\n' for i in range(1000))
+
+    with tempfile.TemporaryDirectory() as server_dir, tempfile.TemporaryDirectory() as temp_dir:
+        with zipfile.ZipFile(os.path.join(server_dir, '202201-divvy-tripdata.zip'), 'w') as archive:
+            archive.writestr('202201-divvy-tripdata.csv', content)
+            archive.writestr('__MACOSX/._202201-divvy-tripdata.csv', 'junk')
+        with open(os.path.join(server_dir, 'plain.csv'), 'w') as f:
+            f.write(content)
+
+        with serve_directory(server_dir, drop_after=100) as base_url:
+            download_file_from_web(f'{base_url}/202201-divvy-tripdata.zip', '202201-divvy-tripdata.zip', temp_dir, backoff=0)
+            download_file_from_web(f'{base_url}/plain.csv', 'plain.csv', temp_dir, compressed=False, backoff=0)
+
+            assert sorted(os.listdir(temp_dir)) == ['202201-divvy-tripdata.csv', 'plain.csv']
+            for filename in os.listdir(temp_dir):
+                with open(os.path.join(temp_dir, filename)) as f:
+                    assert f.read() == content
+
+            with pytest.raises(DownloadError):
+                download_file_from_web(f'{base_url}/missing.zip', 'missing.zip', temp_dir, backoff=0)
+
+
+def test_download_file_from_web_resume_partial_file():
+    content = 'col1,col2\n1,a\n2,b\n'
+
+    with tempfile.TemporaryDirectory() as server_dir, tempfile.TemporaryDirectory() as temp_dir:
+        with open(os.path.join(server_dir, 'plain.csv'), 'w') as f:
+            f.write(content)
+        with open(os.path.join(temp_dir, 'plain.csv.part'), 'w') as f:
+            f.write(content[:12])
+
+        with serve_directory(server_dir) as base_url:
+            download_file_from_web(f'{base_url}/plain.csv', 'plain.csv', temp_dir, compressed=False)
+
+        assert os.listdir(temp_dir) == ['plain.csv']
+        with open(os.path.join(temp_dir, 'plain.csv')) as f:
+            assert f.read() == content
+
+
+def test_download_file_from_web_resume_archive():
+    """
+    Test that an archive cut mid-transfer resumes from the partial file in the next call.
+    """
+    content = 'col1,col2\n' + ''.join(f'{i},{i * 2}\n' for i in range(1000))
+
+    with tempfile.TemporaryDirectory() as server_dir, tempfile.TemporaryDirectory() as temp_dir:
+        with zipfile.ZipFile(os.path.join(server_dir, '202201-divvy-tripdata.zip'), 'w') as archive:
+            archive.writestr('202201-divvy-tripdata.csv', content)
+        url_path, partial_path = '/202201-divvy-tripdata.zip', os.path.join(temp_dir, '202201-divvy-tripdata.zip.part')
+
+        # Each server cuts its first response, without retries every call stops 1000 bytes further
+        for size in [1000, 2000]:
+            with serve_directory(server_dir, drop_after=1000) as base_url, pytest.raises(DownloadError):
+                download_file_from_web(base_url + url_path, '202201-divvy-tripdata.zip', temp_dir, retries=0)
+            assert os.listdir(temp_dir) == ['202201-divvy-tripdata.zip.part']
+            assert os.path.getsize(partial_path) == size
+
+        with serve_directory(server_dir) as base_url:
+            download_file_from_web(base_url + url_path, '202201-divvy-tripdata.zip', temp_dir, retries=0)
+        assert os.listdir(temp_dir) == ['202201-divvy-tripdata.csv']
+        with open(os.path.join(temp_dir, '202201-divvy-tripdata.csv')) as f:
+            assert f.read() == content
+
+        # A corrupt archive is not resumed
+        with open(os.path.join(server_dir, 'bad.zip'), 'w') as f:
+            f.write(content)
+        with serve_directory(server_dir) as base_url, pytest.raises(DownloadError):
+            download_file_from_web(f'{base_url}/bad.zip', 'bad.zip', temp_dir)
+        assert os.listdir(temp_dir) == ['202201-divvy-tripdata.csv']
+
+
+def test_download_files_from_web():
+    with tempfile.TemporaryDirectory() as server_dir, tempfile.TemporaryDirectory() as temp_dir:
+        create_files_in_directory(server_dir, file_ext='.csv', file_content=['a\n1\n', 'a\n2\n', 'a\n3\n'], num_files=3)
+
+        with serve_directory(server_dir) as base_url:
+            files = [(f'{base_url}/file{i}.csv', f'file{i}.csv', temp_dir) for i in range(3)]
+            download_files_from_web(files, workers=2, compressed=False)
+
+        assert sorted(os.listdir(temp_dir)) == ['file0.csv', 'file1.csv', 'file2.csv']
+
+
+def test_extract_helpers_import() -> None:
+    # Downloading trips does not load the transforms or geopandas
+    code = "import sys, helpers.util_extract; print(sorted({'etl.transform', 'geopandas'} & set(sys.modules)))"
+    result = subprocess.run([sys.executable, '-c', code], capture_output=True, text=True, check=True,
+                            env={**os.environ, 'PYTHONPATH': os.pathsep.join(sys.path)})
+    assert result.stdout.strip() == '[]'
+
+
 def test_extract_all_files_in_directory() -> None:
     """
     Test that the function returns a concatenated DataFrame containing data from all matching files.
@@ -65,3 +166,104 @@ def test_extract_all_files_in_directory() -> None:
                                 for file in os.listdir(temp_dir) if file.endswith('.csv')], axis=0, ignore_index=True)
 
         pd.testing.assert_frame_equal(combined_df, expected_df)
+
+
+def test_extract_all_files_in_directory_parallel() -> None:
+    """
+    Test that parallel reads parse dates with a fixed format and keep categorical columns categorical.
+    """
+
+    file_content: list[str] = [
+        'col1,col2,col3\n1,a,2022-01-01 10:00:00\n2,b,2022-01-01 11:30:00\n',
+        'col1,col2,col3\n3,c,2022-02-01 10:00:00\n4,a,2022-02-01 11:30:00\n',
+    ]
+
+    with tempfile.TemporaryDirectory() as temp_dir:
+        create_files_in_directory(temp_dir, file_ext='.csv', file_content=file_content, num_files=len(file_content))
+
+        for executor in ['thread', 'process']:
+            combined_df = extract_all_files_in_directory(temp_dir, file_ext='.csv', workers=2, executor=executor,
+                                                         dtype={'col2': 'category'}, parse_dates=['col3'], date_format='%Y-%m-%d %H:%M:%S')
+            assert len(combined_df) == 4
+            assert isinstance(combined_df['col2'].dtype, pd.CategoricalDtype)
+            assert sorted(combined_df['col2'].astype(str)) == ['a', 'a', 'b', 'c']
+            assert pd.api.types.is_datetime64_any_dtype(combined_df['col3'])
+
+
+def test_extract_all_files_in_directory_invalid_executor() -> None:
+    with pytest.raises(ValueError):
+        with tempfile.TemporaryDirectory() as temp_dir:
+            extract_all_files_in_directory(temp_dir, workers=2, executor='gpu')
+
+
+def test_concat_dataframes() -> None:
+    df1 = pd.DataFrame({'col1': pd.Categorical(['a', 'b'])})
+    df2 = pd.DataFrame({'col1': pd.Categorical(['c'])})
+    result = concat_dataframes([df1, df2])
+    assert isinstance(result['col1'].dtype, pd.CategoricalDtype)
+    assert list(result['col1']) == ['a', 'b', 'c']
+    assert list(result.index) == [0, 1, 2]
+
+
+def test_iter_files_in_directory() -> None:
+    """
+    Test that chunks cover every row once and continue the index of the previous chunk.
+    """
+
+    file_content: list[str] = [
+        'col1,col2\n1,a\n2,b\n3,c\n',
+        'col1,col2\n4,d\n5,e\n',
+    ]
+
+    with tempfile.TemporaryDirectory() as temp_dir:
+        create_files_in_directory(temp_dir, file_ext='.csv', file_content=file_content, num_files=len(file_content))
+
+        chunks = list(iter_files_in_directory(temp_dir, file_ext='.csv', chunksize=2))
+        assert sorted(len(chunk) for chunk in chunks) == [1, 2, 2]
+        combined_df = pd.concat(chunks)
+        assert list(combined_df.index) == [0, 1, 2, 3, 4]
+        assert sorted(combined_df['col1']) == [1, 2, 3, 4, 5]
+
+
+def test_read_file_cache() -> None:
+    """
+    Test that the binary copy gives the same content as the csv, and is replaced when the file or the options change.
+    """
+    with tempfile.TemporaryDirectory() as temp_dir:
+        filepath = os.path.join(temp_dir, 'trips.csv')
+        with open(filepath, 'w') as f:
+            f.write('id,kind,lat,started_at\nx1,a,41.5,2022-01-01 10:00:00\nx2,b,,2022-01-02 11:00:00\nx3,a,41.7,2022-01-03 12:00:00\n')
+        options = {'dtype': {'id': 'string[pyarrow]', 'kind': 'category', 'lat': 'float32'}, 'parse_dates': ['started_at'],
+                   'date_format': '%Y-%m-%d %H:%M:%S'}
+
+        expected = read_file(filepath, **options)
+        pd.testing.assert_frame_equal(read_file(filepath, cache=True, **options), expected)
+        assert os.path.exists(os.path.join(temp_dir, 'trips.arrow'))
+        pd.testing.assert_frame_equal(read_file(filepath, cache=True, **options), expected)
+        pd.testing.assert_frame_equal(read_file(filepath, cache=True, usecols=['lat', 'id'], nrows=2, **options), expected[['id', 'lat']][:2])
+        chunks = list(iter_files_in_directory(temp_dir, chunksize=2, cache=True, **options))
+        pd.testing.assert_frame_equal(pd.concat(chunks), expected)
+
+        # Other options, then a modified file, parse the csv again
+        assert read_file(filepath, cache=True, dtype={'kind': str})['kind'].dtype == object
+        with open(filepath, 'a') as f:
+            f.write('x4,c,41.9,2022-01-04 13:00:00\n')
+        os.utime(filepath, (os.path.getmtime(filepath) + 10,) * 2)
+        assert len(read_file(filepath, cache=True, **options)) == 4
+
+
+def test_read_geo_file() -> None:
+    """
+    Test that the first read saves a Feather copy and that later reads return the same content.
+    """
+    with tempfile.TemporaryDirectory() as temp_dir:
+        filepath = os.path.join(temp_dir, 'regions.geojson')
+        regions = gpd.GeoDataFrame({'NAME': ['West', 'East']}, geometry=[box(0, 0, 1, 1), box(1, 0, 2, 1)], crs='EPSG:4326')
+        regions.to_file(filepath, driver='GeoJSON')
+
+        first = read_geo_file(filepath)
+        assert os.path.exists(os.path.join(temp_dir, 'regions.feather'))
+        second = read_geo_file(filepath)
+        assert list(second['NAME']) == list(first['NAME']) == ['West', 'East']
+        assert second.geometry.equals(first.geometry)
+        assert second.crs == first.crs
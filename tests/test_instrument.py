@@ -0,0 +1,56 @@
+import json
+import pandas as pd
+from etl import instrument
+from etl.transform import filter_column, remove_column, TransformPlan
+import pytest
+
+
+@pytest.fixture
+def recording():
+    instrument.reset()
+    instrument.enable()
+    yield
+    instrument.disable()
+    instrument.reset()
+
+
+@pytest.fixture
+def df() -> pd.DataFrame:
+    return pd.DataFrame({'A': [1, 2, 3], 'B': [4, 4, 6]})
+
+
+def test_disabled(df):
+    instrument.reset()
+    remove_column(df, 'B')
+    assert instrument.records() == []
+
+
+def test_instrumented(df, recording):
+    filter_column(df, 'B', 'equal', 4)
+    with instrument.step('outer', rows_in=3) as record:
+        remove_column(df, 'B')
+        record['rows_out'] = 3
+    records = instrument.records()
+    assert [x['name'] for x in records] == ['filter_column', 'remove_column', 'outer']
+    assert (records[0]['rows_in'], records[0]['rows_out']) == (3, 2)
+    assert [x['depth'] for x in records] == [0, 1, 0]
+    assert all(x['seconds'] >= 0 and x['peak_rss_mb'] > 0 for x in records)
+    assert 'filter_column' in instrument.report()
+
+
+def test_transform_plan_steps(df, recording):
+    TransformPlan(df).pipe(filter_column, 'B', 'equal', 4).pipe(remove_column, 'A').collect()
+    records = instrument.records()
+    assert [x['name'] for x in records] == ['plan.filter_column', 'remove_column', 'plan.remove_column', 'plan.collect']
+    assert (records[0]['rows_in'], records[0]['rows_out']) == (3, 2)
+
+
+def test_save_chrome_trace(df, recording, tmp_path):
+    remove_column(df, 'B')
+    instrument.save_chrome_trace(str(tmp_path / 'trace.json'))
+    instrument.save_json(str(tmp_path / 'records.json'))
+    with open(tmp_path / 'trace.json') as f:
+        events = json.load(f)['traceEvents']
+    assert events[0]['name'] == 'remove_column' and events[0]['ph'] == 'X'
+    with open(tmp_path / 'records.json') as f:
+        assert json.load(f)[0]['rows_out'] == 3
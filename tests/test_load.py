@@ -1,5 +1,8 @@
-from etl.load import send_to_csv
+from etl.load import merge_csv_files, send_to_csv, send_to_parquet
+import gzip
 import pandas as pd
+import pyarrow as pa
+import pytest
 import os
 import tempfile
 
@@ -20,3 +23,102 @@ def test_send_to_csv():
         expected_content = 'col1,col2\na,1\nb,2\nc,3\n'
         with open(filepath, 'r') as f:
             assert f.read() == expected_content
+
+
+def test_send_to_csv_append():
+    with tempfile.TemporaryDirectory() as temp_dir:
+        filename = 'test.csv'
+        send_to_csv(pd.DataFrame({'col1': ['a'], 'col2': [1]}), filename, temp_dir, append=True)
+        send_to_csv(pd.DataFrame({'col1': ['b'], 'col2': [2]}), filename, temp_dir, append=True)
+
+        with open(os.path.join(temp_dir, filename), 'r') as f:
+            assert f.read() == 'col1,col2\na,1\nb,2\n'
+
+
+@pytest.mark.parametrize('workers', [1, 2])
+def test_send_to_csv_chunks(workers):
+    with tempfile.TemporaryDirectory() as temp_dir:
+        df = pd.DataFrame({'col1': pd.Categorical(['a', 'b', 'c', 'a', 'b']), 'col2': [1.5, 2, 3, None, 5],
+                           'col3': pd.date_range('2022-01-01', periods=5, freq='h')})
+        expected = df.to_csv(index=False)
+
+        send_to_csv(df, 'test.csv', temp_dir, workers=workers, chunksize=2, executor='thread')
+        with open(os.path.join(temp_dir, 'test.csv'), 'r') as f:
+            assert f.read() == expected
+        assert not os.path.exists(os.path.join(temp_dir, 'test.csv.tmp'))
+
+        send_to_csv(df, 'test.csv.gz', temp_dir, workers=workers, chunksize=2, compression='gzip', executor='thread')
+        with gzip.open(os.path.join(temp_dir, 'test.csv.gz'), 'rt') as f:
+            assert f.read() == expected
+
+        send_to_csv(df, 'test.csv.zst', temp_dir, workers=workers, chunksize=2, compression='zstd', executor='thread')
+        assert pa.input_stream(os.path.join(temp_dir, 'test.csv.zst'), compression='zstd').read().decode() == expected
+
+        with pytest.raises(ValueError):
+            send_to_csv(df, 'invalid.csv', temp_dir, compression='bz2')
+        assert not os.path.exists(os.path.join(temp_dir, 'invalid.csv'))
+
+
+class Unprintable:
+    def __str__(self):
+        raise RuntimeError('cannot format')
+
+
+@pytest.mark.parametrize('workers', [1, 2])
+def test_send_to_csv_error(workers):
+    with tempfile.TemporaryDirectory() as temp_dir:
+        filepath = os.path.join(temp_dir, 'test.csv')
+        send_to_csv(pd.DataFrame({'col1': ['a'], 'col2': [1]}), 'test.csv', temp_dir)
+        # The third row fails once the first chunk is written, the previous file is left as it was
+        df = pd.DataFrame({'col1': ['b', 'c', Unprintable()], 'col2': [2, 3, 4]})
+        for append in [False, True]:
+            with pytest.raises(RuntimeError):
+                send_to_csv(df, 'test.csv', temp_dir, append=append, workers=workers, chunksize=2, executor='thread')
+            with open(filepath, 'r') as f:
+                assert f.read() == 'col1,col2\na,1\n'
+            assert os.listdir(temp_dir) == ['test.csv']
+
+
+def test_merge_csv_files():
+    with tempfile.TemporaryDirectory() as temp_dir:
+        files = []
+        for i, content in enumerate(['col1,col2\na,1\n', 'col1,col2\nb,2\nc,3\n']):
+            files.append(os.path.join(temp_dir, f'part{i}.csv'))
+            with open(files[-1], 'w') as f:
+                f.write(content)
+
+        merge_csv_files(files, 'test.csv', temp_dir)
+
+        with open(os.path.join(temp_dir, 'test.csv'), 'r') as f:
+            assert f.read() == 'col1,col2\na,1\nb,2\nc,3\n'
+        assert not os.path.exists(os.path.join(temp_dir, 'test.csv.tmp'))
+
+
+def test_send_to_parquet():
+    with tempfile.TemporaryDirectory() as temp_dir:
+        df = pd.DataFrame({
+            'col1': pd.Categorical(['a', 'b', 'a']),
+            'col2': pd.to_datetime(['2022-01-05', '2022-01-20', '2022-02-01']),
+        })
+        send_to_parquet(df, 'test', temp_dir, date_column='col2')
+
+        dataset_path = os.path.join(temp_dir, 'test')
+        assert sorted(os.listdir(os.path.join(dataset_path, 'year=2022'))) == ['month=1', 'month=2']
+        result = pd.read_parquet(dataset_path, columns=['col1', 'col2'], filters=[('month', '=', 1)])
+        assert isinstance(result['col1'].dtype, pd.CategoricalDtype)
+        assert list(result['col2']) == list(df['col2'][:2])
+
+
+def test_send_to_parquet_append():
+    with tempfile.TemporaryDirectory() as temp_dir:
+        dataset_path = os.path.join(temp_dir, 'test')
+        send_to_parquet(pd.DataFrame({'col1': [1, 2]}), 'test', temp_dir, append=True, file_prefix='first')
+        send_to_parquet(pd.DataFrame({'col1': [3]}), 'test', temp_dir, append=True, file_prefix='second')
+        assert sorted(pd.read_parquet(dataset_path)['col1']) == [1, 2, 3]
+
+        # Writing a prefix again replaces its rows only
+        send_to_parquet(pd.DataFrame({'col1': [4]}), 'test', temp_dir, append=True, file_prefix='first')
+        assert sorted(pd.read_parquet(dataset_path)['col1']) == [3, 4]
+
+        send_to_parquet(pd.DataFrame({'col1': [5]}), 'test', temp_dir)
+        assert list(pd.read_parquet(dataset_path)['col1']) == [5]
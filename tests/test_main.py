@@ -0,0 +1,42 @@
+import main
+from helpers.util_benchmark import patched
+import pytest
+
+
+@pytest.fixture
+def calls():
+    """Replaces the downloads and the pipelines of `main`, yields the names of the functions called."""
+    called = []
+
+    def record(name):
+        return lambda *args, **kwargs: called.append(name)
+
+    names = ['download_file_from_web', 'extract_divvy_biketrip_dataset', 'duckdb_divvy_pipeline', 'run_incremental_pipeline',
+             'run_pipelined_pipeline', 'stream_divvy_pipeline']
+    with patched(main, **{name: record(name) for name in names}):
+        yield called
+
+
+def test_main_backend(calls):
+    main.main(backend='duckdb')
+    assert calls == ['download_file_from_web', 'download_file_from_web', 'extract_divvy_biketrip_dataset', 'duckdb_divvy_pipeline']
+
+    calls.clear()
+    main.main()
+    assert calls[2:] == ['run_incremental_pipeline']
+
+    # Nothing is downloaded for an invalid backend
+    calls.clear()
+    with pytest.raises(ValueError):
+        main.main(backend='spark')
+    assert calls == []
+
+
+def test_main_pipelined(calls):
+    # Asking for the pipelined pipeline wins over the incremental default
+    main.main(pipelined=True)
+    assert calls[2:] == ['run_pipelined_pipeline']
+
+    calls.clear()
+    main.main(incremental=False, streaming=True)
+    assert calls[2:] == ['extract_divvy_biketrip_dataset', 'stream_divvy_pipeline']
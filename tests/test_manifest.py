@@ -0,0 +1,51 @@
+import os
+import tempfile
+from etl.manifest import config_hash, file_checksum, is_remote_unchanged, is_up_to_date, load_manifest, save_manifest
+
+
+def test_file_checksum():
+    with tempfile.TemporaryDirectory() as temp_dir:
+        filepath = os.path.join(temp_dir, 'test.csv')
+        with open(filepath, 'w') as f:
+            f.write('col1,col2\na,1\n')
+        checksum = file_checksum(filepath, block_size=4)
+        assert checksum == file_checksum(filepath)
+        with open(filepath, 'a') as f:
+            f.write('b,2\n')
+        assert checksum != file_checksum(filepath)
+
+
+def test_config_hash():
+    assert config_hash({'a': 1, 'b': [1, 2]}) == config_hash({'b': [1, 2], 'a': 1})
+    assert config_hash({'a': 1}) != config_hash({'a': 2})
+    assert config_hash({'dtype': {'col': str}}) == config_hash({'dtype': {'col': str}})
+
+
+def test_load_and_save_manifest():
+    with tempfile.TemporaryDirectory() as temp_dir:
+        filepath = os.path.join(temp_dir, 'manifest.json')
+        assert load_manifest(filepath) == {}
+        manifest = {'202201': {'etag': '"abc"', 'checksum': '123'}}
+        save_manifest(manifest, filepath)
+        assert load_manifest(filepath) == manifest
+        assert os.listdir(temp_dir) == ['manifest.json']
+
+
+def test_is_remote_unchanged():
+    entry = {'etag': '"abc"', 'content_length': '10', 'last_modified': 'Mon'}
+    assert not is_remote_unchanged(None, {'etag': '"abc"'})
+    assert is_remote_unchanged(entry, {'etag': '"abc"', 'content_length': '11'})
+    assert not is_remote_unchanged(entry, {'etag': '"def"', 'content_length': '10', 'last_modified': 'Mon'})
+    assert is_remote_unchanged(entry, {'etag': None, 'content_length': '10', 'last_modified': 'Mon'})
+    assert not is_remote_unchanged(entry, {'etag': None, 'content_length': '11', 'last_modified': 'Mon'})
+
+
+def test_is_up_to_date():
+    with tempfile.TemporaryDirectory() as temp_dir:
+        entry = {'checksum': '123', 'config_hash': 'abc', 'output': os.path.join(temp_dir, 'out.csv')}
+        assert not is_up_to_date(None, '123', 'abc')
+        assert not is_up_to_date(entry, '123', 'abc')
+        open(entry['output'], 'w').close()
+        assert is_up_to_date(entry, '123', 'abc')
+        assert not is_up_to_date(entry, '456', 'abc')
+        assert not is_up_to_date(entry, '123', 'def')
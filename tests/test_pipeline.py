@@ -0,0 +1,156 @@
+import hashlib
+import io
+import json
+import os
+import time
+import zipfile
+import pandas as pd
+from helpers import util_extract, util_pipeline
+from helpers.util_benchmark import generate_trips, patched, synthetic_boundaries, write_trip_archives, write_trip_files
+from etl.extract import extract_all_files_in_directory
+from helpers.util_pipeline import (
+    build_station_df_in_chunks, duckdb_divvy_pipeline, raw_memory_report, run_incremental_pipeline, run_pipelined_pipeline, send_trips, stream_divvy_pipeline
+)
+from helpers.util_schema import date_format, final_trip_dtype, parse_dates, raw_trip_dtype
+from helpers.util_tests import serve_directory
+from helpers.util_transform import build_station_df, transform_data
+from helpers.util_validate import validate_trips
+import pytest
+
+read_kwargs = {'dtype': raw_trip_dtype, 'parse_dates': parse_dates, 'date_format': date_format}
+
+
+@pytest.fixture
+def boundaries(tmp_path):
+    with synthetic_boundaries(str(tmp_path / 'processed')) as paths:
+        yield paths
+
+
+@pytest.fixture
+def server(tmp_path):
+    """Serves three months of generated trips like the Divvy download server, yields the base URL."""
+    months = write_trip_archives(generate_trips(3000, num_stations=200, num_months=3), str(tmp_path / 'server'))
+    assert months == ['202201', '202202', '202203']
+    with serve_directory(str(tmp_path / 'server')) as base_url, patched(util_extract, URL_PREFIX=base_url):
+        yield base_url
+
+
+def write_archive(path, text, compression=zipfile.ZIP_STORED):
+    with zipfile.ZipFile(path, 'w', compression) as archive:
+        archive.writestr(os.path.basename(path).replace('.zip', '.csv'), text)
+
+
+@pytest.mark.parametrize('station_cache', [False, True])
+def test_run_incremental_pipeline(tmp_path, boundaries, server, station_cache):
+    def run(name):
+        destination = tmp_path / name
+        cache_path = str(destination / 'stations.parquet') if station_cache else None
+        return run_incremental_pipeline('2022-01-01', '2022-03-31', str(destination / 'raw'), 'divvy.csv', str(destination),
+                                        str(destination / 'manifest.json'), station_cache_path=cache_path, **read_kwargs)
+
+    assert run('incremental') == ['202201', '202202', '202203']
+    assert run('incremental') == []
+
+    # A new ETag is downloaded again, the raw file is the same so it is not transformed again
+    archive = tmp_path / 'server' / '202202-divvy-tripdata.zip'
+    with zipfile.ZipFile(archive) as f:
+        text = f.read('202202-divvy-tripdata.csv').decode()
+    write_archive(archive, text, zipfile.ZIP_DEFLATED)
+    assert run('incremental') == []
+    with open(tmp_path / 'incremental' / 'manifest.json') as f:
+        assert json.load(f)['202202']['etag'] == f'"{hashlib.md5(archive.read_bytes()).hexdigest()}"'
+
+    # Only the changed month is transformed again
+    df = pd.read_csv(io.StringIO(text))
+    df.loc[:50, 'member_casual'] = df.loc[:50, 'member_casual'].map({'member': 'casual', 'casual': 'member'})
+    write_archive(archive, df.to_csv(index=False))
+    assert run('incremental') == ['202202']
+
+    assert run('full') == ['202201', '202202', '202203']
+    pd.testing.assert_frame_equal(pd.read_csv(tmp_path / 'incremental' / 'divvy.csv'), pd.read_csv(tmp_path / 'full' / 'divvy.csv'))
+
+
+def test_run_pipelined_pipeline(tmp_path, boundaries, server):
+    def run(name, **kwargs):
+        destination = str(tmp_path / name)
+        months = run_pipelined_pipeline('2022-01-01', '2022-03-31', str(tmp_path / name / 'raw'), 'divvy.csv', destination,
+                                        os.path.join(destination, 'stations.parquet'), **kwargs, **read_kwargs)
+        assert months == ['202201', '202202', '202203']
+        return (pd.read_parquet(os.path.join(destination, 'stations.parquet')),
+                pd.read_csv(os.path.join(destination, 'divvy.csv')))
+
+    in_order = run('in_order', download_workers=1, parse_workers=1)
+
+    # The earlier a month, the later its download finishes, the stations are still numbered in date order
+    download = util_pipeline.download_divvy_month
+
+    def reversed_download(url, input_dir):
+        time.sleep(0.3 * (202203 - int(url[-25:-19])))
+        return download(url, input_dir)
+
+    with patched(util_pipeline, download_divvy_month=reversed_download):
+        out_of_order = run('out_of_order', download_workers=3, parse_workers=3)
+    pd.testing.assert_frame_equal(out_of_order[0], in_order[0])
+    pd.testing.assert_frame_equal(out_of_order[1], in_order[1])
+    assert len(in_order[1]) > 0
+
+
+@pytest.fixture
+def raw_dir(tmp_path):
+    """Two months of generated trips breaking every data-quality rule, as raw files, returns the directory and its years."""
+    df = generate_trips(3000, num_stations=200, num_months=2)
+    df.loc[10:19, 'rideable_type'] = 'scooter'
+    df.loc[20:24, 'member_casual'] = 'unknown'
+    # Repeated trips stay in the file of their month, after the original
+    df = pd.concat([df, df.iloc[100:2900:100]]).sort_values('started_at', kind='stable')
+    years = write_trip_files(df, str(tmp_path / 'raw'))
+    return str(tmp_path / 'raw'), years
+
+
+def read_trips(path):
+    return pd.read_csv(path, dtype=final_trip_dtype, parse_dates=parse_dates).sort_values('ride_id', ignore_index=True)
+
+
+def test_duckdb_pipeline_matches_stream(tmp_path, boundaries, raw_dir):
+    pytest.importorskip('duckdb')
+    input_dir, years = raw_dir
+    stream_divvy_pipeline(input_dir, 'divvy.csv', str(tmp_path / 'stream'), sub_dir=years, rollups=False, **read_kwargs)
+    duckdb_divvy_pipeline(input_dir, 'divvy.csv', str(tmp_path / 'duckdb'), sub_dir=years, date_format=date_format)
+
+    expected = read_trips(tmp_path / 'stream' / 'divvy.csv')
+    pd.testing.assert_frame_equal(read_trips(tmp_path / 'duckdb' / 'divvy.csv'), expected)
+    counts = pd.read_csv(tmp_path / 'stream' / 'quarantine' / 'counts.csv')
+    pd.testing.assert_frame_equal(pd.read_csv(tmp_path / 'duckdb' / 'quarantine' / 'counts.csv'), counts)
+    assert (counts['count'] > 0).all()
+
+
+def test_stream_pipeline_matches_in_memory(tmp_path, boundaries):
+    input_dir = str(tmp_path / 'raw')
+    years = write_trip_files(generate_trips(3000, num_stations=200, num_months=2), input_dir)
+
+    # The in-memory path of `main`
+    raw_df = extract_all_files_in_directory(input_dir, sub_dir=years, **read_kwargs)
+    station_df = build_station_df(raw_df)
+    clean_df, rejected_df = validate_trips(raw_df)
+    send_trips(transform_data(clean_df, station_df), 'divvy.csv', str(tmp_path))
+
+    # Chunks smaller than a file
+    pd.testing.assert_frame_equal(build_station_df_in_chunks(input_dir, sub_dir=years, chunksize=700, **read_kwargs), station_df)
+    stream_divvy_pipeline(input_dir, 'divvy.csv', str(tmp_path / 'stream'), sub_dir=years, chunksize=700, **read_kwargs)
+    pd.testing.assert_frame_equal(pd.read_csv(tmp_path / 'stream' / 'divvy.csv'), pd.read_csv(tmp_path / 'divvy.csv'))
+    assert len(pd.read_parquet(tmp_path / 'stream' / 'quarantine' / 'trips')) == len(rejected_df) > 0
+
+
+def test_raw_memory_report(tmp_path):
+    input_dir = str(tmp_path / 'raw')
+    years = write_trip_files(generate_trips(2000, num_stations=50, num_months=2), input_dir)
+    report = raw_memory_report(input_dir, sub_dir=years, parse_dates=['started_at', 'ended_at'], date_format=date_format)
+    lines = report.splitlines()
+    # A line per column of the raw files, dates included, between the header and the total
+    assert len(lines) == len(raw_trip_dtype) + 4
+    assert lines[1].split()[:3] == ['ride_id', 'object', 'string']
+    assert lines[-2].split()[:3] == ['member_casual', 'object', 'category']
+    assert 'smaller' in lines[-1]
+
+    with pytest.raises(FileNotFoundError):
+        raw_memory_report(str(tmp_path / 'empty'))
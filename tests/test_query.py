@@ -0,0 +1,58 @@
+import os
+import pandas as pd
+import pyarrow.parquet as pq
+from etl.load import send_to_parquet
+from etl.query import all_filter, any_filter, date_range_filter, match_filter, query_dataset
+import pytest
+
+
+@pytest.fixture
+def dataset_path(tmp_path) -> str:
+    df = pd.DataFrame({
+        'id': range(8),
+        'started_at': pd.to_datetime(['2022-02-01', '2022-01-31 23:59', '2022-01-01', '2022-03-15',
+                                      '2022-01-10', '2022-02-20', '2022-12-31', '2023-01-01']),
+        'kind': pd.Categorical(['a', 'b', 'a', 'c', 'b', 'a', 'c', 'a']),
+        'other': ['x', 'y', 'z', 'x', 'x', 'y', 'z', 'x'],
+    })
+    send_to_parquet(df, 'trips', str(tmp_path), date_column='started_at', row_group_size=1)
+    return str(tmp_path / 'trips')
+
+
+def test_send_to_parquet_sorts_row_groups(dataset_path):
+    metadata = pq.ParquetFile(next(os.scandir(os.path.join(dataset_path, 'year=2022', 'month=1'))).path).metadata
+    minimums = [metadata.row_group(i).column(1).statistics.min for i in range(metadata.num_row_groups)]
+    assert metadata.num_row_groups == 3
+    assert minimums == sorted(minimums)
+
+
+def test_match_filter(dataset_path):
+    assert sorted(query_dataset(dataset_path, ['id'], match_filter('kind', 'c'))['id']) == [3, 6]
+    assert sorted(query_dataset(dataset_path, ['id'], match_filter('kind', ['b', 'c']))['id']) == [1, 3, 4, 6]
+
+
+def test_any_and_all_filter(dataset_path):
+    either = any_filter(match_filter('kind', 'c'), match_filter('other', 'y'))
+    assert sorted(query_dataset(dataset_path, ['id'], either)['id']) == [1, 3, 5, 6]
+    both = all_filter([match_filter('kind', 'a'), match_filter('other', 'x')])
+    assert sorted(query_dataset(dataset_path, ['id'], both)['id']) == [0, 7]
+    assert all_filter([]) is None
+
+
+@pytest.mark.parametrize('partitioned', [True, False])
+def test_date_range_filter(dataset_path, partitioned):
+    def query(start, end):
+        filter = all_filter(date_range_filter('started_at', start, end, partitioned=partitioned))
+        return list(query_dataset(dataset_path, ['id'], filter)['id'])
+
+    assert query(pd.Timestamp('2022-01-10'), pd.Timestamp('2022-02-01')) == [4, 1]
+    assert query(pd.Timestamp('2022-02-01'), pd.Timestamp('2022-03-01')) == [0, 5]
+    assert query(pd.Timestamp('2022-12-01'), None) == [6, 7]
+    assert query(None, pd.Timestamp('2022-01-10')) == [2]
+
+
+def test_query_dataset_columns(dataset_path):
+    result = query_dataset(dataset_path, ['kind', 'started_at'])
+    assert list(result.columns) == ['kind', 'started_at']
+    assert isinstance(result['kind'].dtype, pd.CategoricalDtype)
+    assert len(result) == 8
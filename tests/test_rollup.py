@@ -0,0 +1,70 @@
+import numpy as np
+import pandas as pd
+from etl.rollup import aggregate, histogram_columns, histogram_quantile, merge_rollups, od_matrix
+import pytest
+
+edges = [10, 20, 30]
+
+
+@pytest.fixture
+def df() -> pd.DataFrame:
+    return pd.DataFrame({'kind': pd.Categorical(['a', 'b', 'a', 'a', None, 'b']),
+                         'day': [1, 1, 1, 2, 1, 1],
+                         'value': [5, 25, 15, 40, 7, 10]})
+
+
+def test_histogram_columns():
+    assert histogram_columns('value', edges) == ['value_lt_10', 'value_lt_20', 'value_lt_30', 'value_ge_30']
+
+
+def test_aggregate(df):
+    result = aggregate(df, ['kind', 'day'], 'value', edges)
+    assert list(result.columns) == ['kind', 'day', 'count', 'value_sum', 'value_min', 'value_max', *histogram_columns('value', edges)]
+    assert list(result['kind']) == ['a', 'a', 'b']
+    assert list(result['day']) == [1, 2, 1]
+    assert list(result['count']) == [2, 1, 2]
+    assert list(result['value_sum']) == [20, 40, 35]
+    assert list(result['value_min']) == [5, 40, 10]
+    assert list(result['value_max']) == [15, 40, 25]
+    assert result[histogram_columns('value', edges)].values.tolist() == [[1, 1, 0, 0], [0, 0, 0, 1], [0, 1, 1, 0]]
+
+
+def test_merge_rollups(df):
+    keys = ['kind', 'day']
+    parts = [aggregate(df.iloc[:3], keys, 'value', edges), aggregate(df.iloc[3:], keys, 'value', edges)]
+    expected = aggregate(df, keys, 'value', edges)
+    pd.testing.assert_frame_equal(merge_rollups(parts, keys), expected, check_dtype=False)
+
+
+def test_histogram_quantile():
+    values = np.random.default_rng(0).uniform(0, 40, 10_000)
+    rollup = aggregate(pd.DataFrame({'key': 0, 'value': values}), ['key'], 'value', edges)
+    for q in [0.05, 0.5, 0.9]:
+        assert histogram_quantile(rollup, 'value', edges, q)[0] == pytest.approx(np.quantile(values, q), abs=0.5)
+
+    # A single value, the estimate stays within the min and max of the row
+    rollup = aggregate(pd.DataFrame({'key': 0, 'value': [12.0]}), ['key'], 'value', edges)
+    assert histogram_quantile(rollup, 'value', edges, 0.5)[0] == 12.0
+
+
+@pytest.mark.parametrize('max_dense', [2**24, 0])
+def test_od_matrix(max_dense):
+    df = pd.DataFrame({'start_id': pd.array([3, 1, 3, None, 1, 3], dtype='Int32'), 'end_id': pd.array([1, 1, 1, 2, 5, 1], dtype='Int32'),
+                       'start_area': pd.Categorical(['a', 'b', 'a', 'a', None, 'a']), 'end_area': pd.Categorical(['c', 'a', 'c', 'a', 'b', 'a']),
+                       'minutes': [10, 20, 30, 40, 50, np.nan]})
+
+    result = od_matrix(df, 'start_id', 'end_id', ['minutes'], max_dense=max_dense)
+    assert result.values.tolist() == [[1, 1, 1, 20], [1, 5, 1, 50], [3, 1, 3, 40]]
+
+    # Categorical keys with different categories are encoded into the same labels
+    result = od_matrix(df, 'start_area', 'end_area', ['minutes'], max_dense=max_dense)
+    assert isinstance(result['start_area'].dtype, pd.CategoricalDtype)
+    assert result.astype({'start_area': str, 'end_area': str}).values.tolist() == [['a', 'a', 2, 40], ['a', 'c', 2, 40], ['b', 'a', 1, 20]]
+
+    # Trips without any known origin have no pairs
+    result = od_matrix(df.assign(start_area=pd.Categorical([None] * 6)), 'start_area', 'end_area', ['minutes'], max_dense=max_dense)
+    assert len(result) == 0 and list(result.columns) == ['start_area', 'end_area', 'count', 'minutes_sum']
+
+    parts = [od_matrix(df.iloc[:3], 'start_id', 'end_id', ['minutes']), od_matrix(df.iloc[3:], 'start_id', 'end_id', ['minutes'])]
+    expected = od_matrix(df, 'start_id', 'end_id', ['minutes'])
+    pd.testing.assert_frame_equal(merge_rollups(parts, ['start_id', 'end_id']), expected, check_dtype=False)
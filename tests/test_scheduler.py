@@ -0,0 +1,91 @@
+import threading
+import time
+from etl import instrument
+from etl.scheduler import Stage, run_stages
+import pytest
+
+
+def test_run_stages():
+    stages = [Stage('add', lambda x: x + 1), Stage('double', lambda x: x * 2, workers=3), Stage('str', str)]
+    assert run_stages(range(10), stages) == [str((i + 1) * 2) for i in range(10)]
+    assert run_stages([], stages) == []
+
+
+def test_run_stages_overlap():
+    # The first stage only finishes item 1 once the second stage has started item 0
+    second_started = threading.Event()
+
+    def first(x):
+        if x == 1:
+            assert second_started.wait(timeout=5)
+        return x
+
+    def second(x):
+        second_started.set()
+        return x
+
+    assert run_stages([0, 1, 2], [Stage('first', first), Stage('second', second)], queue_size=1) == [0, 1, 2]
+
+
+def test_run_stages_bounded_queue():
+    # With queues of one item, the first stage can never be more than a few items ahead of the last one
+    lock = threading.Lock()
+    started, finished, ahead = [], [], []
+
+    def first(x):
+        with lock:
+            started.append(x)
+            ahead.append(len(started) - len(finished))
+        return x
+
+    def last(x):
+        with lock:
+            finished.append(x)
+        return x
+
+    run_stages(range(50), [Stage('first', first), Stage('middle', lambda x: x), Stage('last', last)], queue_size=1)
+    assert max(ahead) <= 6
+
+
+def test_run_stages_ordered():
+    # Later items finish the first stage first, the ordered stage still sees them in order
+    def first(x):
+        time.sleep(0.01 * (5 - x))
+        return x
+
+    seen = []
+    stages = [Stage('first', first, workers=5), Stage('ordered', seen.append, ordered=True)]
+    run_stages(range(5), stages, queue_size=1)
+    assert seen == list(range(5))
+
+    with pytest.raises(ValueError):
+        run_stages(range(5), [Stage('ordered', seen.append, workers=2, ordered=True)])
+
+
+def test_run_stages_error():
+    def fail(x):
+        if x == 3:
+            raise KeyError(x)
+        return x
+
+    with pytest.raises(KeyError):
+        run_stages(range(100), [Stage('first', lambda x: x), Stage('fail', fail, workers=2), Stage('last', lambda x: x)])
+
+    def items():
+        yield 1
+        raise ValueError('no more items')
+
+    with pytest.raises(ValueError):
+        run_stages(items(), [Stage('first', lambda x: x)])
+
+
+def test_run_stages_instrumented():
+    instrument.reset()
+    instrument.enable()
+    try:
+        run_stages(range(3), [Stage('first', lambda x: x), Stage('second', lambda x: x)])
+    finally:
+        instrument.disable()
+    names = [record['name'] for record in instrument.records()]
+    assert names.count('first') == 3 and names.count('second') == 3
+    instrument.reset()
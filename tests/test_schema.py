@@ -0,0 +1,28 @@
+import pandas as pd
+from etl.schema import apply_schema, memory_report, memory_usage, read_dtypes
+import pytest
+
+
+@pytest.fixture
+def df() -> pd.DataFrame:
+    return pd.DataFrame({'name': ['a', 'b', 'a'], 'lat': [41.1, 41.2, 41.3], 'count': [1, 2, 3]})
+
+
+def test_apply_schema(df):
+    result = apply_schema(df, {'name': 'category', 'lat': 'float32', 'count': 'int64', 'missing': 'int32'})
+    assert isinstance(result['name'].dtype, pd.CategoricalDtype)
+    assert result['lat'].dtype == 'float32'
+    assert result['count'].dtype == 'int64'
+    assert apply_schema(result, {'name': 'category', 'lat': 'float32'}) is result
+
+
+def test_read_dtypes():
+    assert read_dtypes({'name': 'category', 'started_at': 'datetime64[ns]'}) == {'name': 'category'}
+
+
+def test_memory_report(df):
+    df = pd.concat([df] * 1000, ignore_index=True)
+    compact = apply_schema(df, {'name': 'category', 'lat': 'float32'})
+    assert memory_usage(compact) < memory_usage(df)
+    report = memory_report(df, compact)
+    assert 'float32' in report and 'smaller' in report
@@ -0,0 +1,66 @@
+import numpy as np
+import geopandas as gpd
+from shapely.geometry import Polygon, box
+from etl.spatial import PolygonIndex, first_match, haversine_km
+import pytest
+
+
+@pytest.fixture
+def regions() -> gpd.GeoDataFrame:
+    # Two squares sharing a border and a triangle, so some cells are split between polygons
+    return gpd.GeoDataFrame({'NAME': ['West', 'East', 'North'], 'AREA': ['a', 'a', 'b']},
+                            geometry=[box(0, 0, 1, 1), box(1, 0, 2, 1), Polygon([(0, 1), (2, 1), (1, 2)])], crs='EPSG:4326')
+
+
+def test_haversine_km():
+    # One degree of latitude, a degree of longitude at 60 degrees is half as long, and a null coordinate
+    distance = haversine_km(np.array([0, 60, 0], dtype='float32'), [0, 0, np.nan], [1, 60, 1], [0, 1, 1])
+    assert distance[0] == pytest.approx(111.195, abs=1e-3)
+    assert distance[1] == pytest.approx(55.6, abs=0.1)
+    assert np.isnan(distance[2])
+
+
+def test_first_match():
+    ids = first_match(np.array([2, 0, 2]), np.array([5, 1, 3]), 4)
+    assert list(ids) == [1, -1, 3, -1]
+
+
+def test_polygon_index_query(regions):
+    index = PolygonIndex(regions, grid_size=8)
+    lng = [0.5, 1.5, 1.0, 1.0, 0.2, 5.0, np.nan, 1.0]
+    lat = [0.5, 0.5, 1.5, 1.9, 1.7, 5.0, 0.5, 0.5]
+    assert list(index.query(lng, lat)) == [0, 1, 2, 2, -1, -1, -1, -1]
+    assert len(index) == 3
+
+
+def test_polygon_index_matches_spatial_join(regions):
+    rng = np.random.default_rng(0)
+    lng, lat = rng.uniform(-0.5, 2.5, 5000), rng.uniform(-0.5, 2.5, 5000)
+    points = gpd.GeoDataFrame(geometry=gpd.points_from_xy(lng, lat), crs='EPSG:4326')
+    expected = np.full(len(points), -1)
+    joined = points.sjoin(regions, predicate='within')
+    expected[joined.index] = joined['index_right']
+    for grid_size in [1, 4, 64]:
+        assert (PolygonIndex(regions, grid_size=grid_size).query(lng, lat) == expected).all()
+
+
+def test_polygon_index_workers(regions):
+    rng = np.random.default_rng(0)
+    lng, lat = rng.uniform(-0.5, 2.5, 4000), rng.uniform(-0.5, 2.5, 4000)
+    expected = PolygonIndex(regions).query(lng, lat)
+    with PolygonIndex(regions, workers=2, min_chunk_size=1000) as index:
+        assert (index.query(lng, lat) == expected).all()
+        assert index._pool is not None
+    assert index._pool is None
+
+
+def test_polygon_index_take(regions):
+    index = PolygonIndex(regions)
+    area = index.take(np.array([0, -1, 2, 1], dtype=np.int32), 'AREA')
+    assert list(area.codes) == [0, -1, 1, 0]
+    assert list(area.categories) == ['a', 'b']
+
+
+def test_polygon_index_reprojects(regions):
+    index = PolygonIndex(regions.to_crs(epsg=3857))
+    assert list(index.query([0.5, 1.5], [0.5, 0.5])) == [0, 1]
@@ -0,0 +1,99 @@
+import os
+import numpy as np
+import pandas as pd
+from etl.extract import extract_all_files_in_directory, list_files_in_directory
+from etl.schema import apply_schema
+from etl.sql import connect, copy_to_csv, copy_to_parquet, not_null_sql, read_csv_sql, reasons_sql, rule_sql, sql_type
+from etl.validate import Rule, validate
+from helpers.util_benchmark import generate_trips, write_trip_files
+from helpers.util_schema import date_format, final_trip_schema, parse_dates, raw_trip_dtype, raw_trip_schema, station_schema
+from helpers.util_sql import transform_trips_sql
+from helpers.util_transform import STATION_COLUMNS, first_seen_stations, keep_first_seen, transform_data
+import pytest
+
+duckdb = pytest.importorskip('duckdb')
+
+
+@pytest.fixture
+def csv_file(tmp_path) -> str:
+    filepath = str(tmp_path / 'trips.csv')
+    pd.DataFrame({'name': ['a', None, 'c'], 'lat': [41.1, 41.2, None],
+                  'started_at': ['2022-01-01 10:00:00', '2022-02-01 10:00:00', '2022-02-02 10:00:00']}).to_csv(filepath, index=False)
+    return filepath
+
+
+def test_sql_type():
+    assert sql_type('category') == 'VARCHAR'
+    assert sql_type('float32') == 'FLOAT'
+    assert sql_type('Int32') == 'INTEGER'
+    assert sql_type('datetime64[ns]') == 'TIMESTAMP'
+    with pytest.raises(ValueError):
+        sql_type('complex128')
+
+
+def test_read_csv_sql(csv_file):
+    con = connect(memory_limit='256MB', threads=1)
+    trips = read_csv_sql([csv_file], {'name': 'category', 'lat': 'float32', 'started_at': 'datetime64[ns]'}, '%Y-%m-%d %H:%M:%S')
+    df = con.execute(f"SELECT * FROM {trips} WHERE {not_null_sql(['name', 'lat'])}").df()
+    assert list(df['name']) == ['a']
+    assert df['lat'].dtype == 'float32'
+    assert df['started_at'].dtype == 'datetime64[ns]'
+
+
+def test_reasons_sql():
+    start = pd.Timestamp('2022-01-01')
+    df = pd.DataFrame({'n': range(6), 'id': ['r1', 'r2', None, 'r1', 'r5', 'r6'],
+                       'kind': ['a', 'b', 'a', 'c', None, 'a'],
+                       'start': [start] * 6,
+                       'end': start + pd.to_timedelta([5, 30, 10, 0.5, 60, 10], unit='min'),
+                       'x': [1.0, 11.0, 2.0, 3.0, 4.0, None],
+                       'y': [1.0, 1.0, 2.0, 3.0, 6.0, 1.0]})
+    rules = [
+        Rule('missing', 'notnull', ['id', 'kind']),
+        Rule('duration', 'span', ['start', 'end'], (pd.Timedelta(1, 'min'), pd.Timedelta(1, 'h'))),
+        Rule('outside', 'between', ['x', 'y'], [(0, 10), (0, 5)]),
+        Rule('unknown_kind', 'in', ['kind'], ['a', 'b']),
+        Rule('duplicate', 'unique', ['id']),
+    ]
+    con = connect()
+    con.register('df', df)
+    result = con.execute(f"{reasons_sql('df', rules, order_by=['n'])} ORDER BY n").df()
+    assert result['reasons'].dtype == 'uint8'
+    assert result['reasons'].tolist() == validate(df, rules).tolist()
+    with pytest.raises(ValueError):
+        rule_sql(Rule('duplicate', 'unique', ['id']))
+    with pytest.raises(ValueError):
+        reasons_sql('df', rules * 13)
+
+
+def test_copy_to_csv_and_parquet(csv_file, tmp_path):
+    con = connect()
+    trips = read_csv_sql([csv_file], {'started_at': 'datetime64[ns]'}, '%Y-%m-%d %H:%M:%S')
+    copy_to_csv(con, f"SELECT * FROM {trips}", 'out.csv', str(tmp_path), '%Y-%m-%d %H:%M:%S')
+    assert pd.read_csv(tmp_path / 'out.csv')['started_at'].tolist()[0] == '2022-01-01 10:00:00'
+
+    copy_to_parquet(con, f"SELECT * FROM {trips}", 'out.parquet', str(tmp_path), date_column='started_at')
+    assert sorted(os.listdir(tmp_path / 'out.parquet' / 'year=2022')) == ['month=1', 'month=2']
+    result = pd.read_parquet(tmp_path / 'out.parquet', filters=[('month', '=', 2)])
+    assert len(result) == 2
+
+
+def test_transform_trips_sql(tmp_path):
+    years = write_trip_files(generate_trips(2000, num_stations=100, num_months=2), str(tmp_path))
+    files = list_files_in_directory(str(tmp_path), sub_dir=years)
+    raw_df = extract_all_files_in_directory(str(tmp_path), sub_dir=years, dtype=raw_trip_dtype, parse_dates=parse_dates, date_format=date_format)
+    # A station table like `build_station_df`, a few stations are left out so some lookups miss
+    station_df = (first_seen_stations(raw_df).pipe(keep_first_seen).iloc[5:].reset_index(drop=True)
+                  .assign(station_id=lambda x: np.arange(len(x)), state='Illinois',
+                          primary_neighborhood=lambda x: 'N' + (x.index % 7).astype(str),
+                          secondary_neighborhood=lambda x: 'S' + (x.index % 3).astype(str))
+                  .loc[:, STATION_COLUMNS])
+    expected = transform_data(raw_df, station_df)
+
+    con = connect()
+    con.register('stations', apply_schema(station_df, station_schema))
+    result = con.execute(transform_trips_sql(read_csv_sql(files, raw_trip_schema, date_format), 'stations')).df()
+    result = apply_schema(result, final_trip_schema).sort_values('ride_id', ignore_index=True)
+    assert list(result.columns) == list(expected.columns)
+    assert expected['distance_km'].notna().sum() > 0 and expected['speed_kmh'].notna().sum() > 0
+    pd.testing.assert_frame_equal(result, expected.sort_values('ride_id', ignore_index=True), check_categorical=False)
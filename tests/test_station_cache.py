@@ -0,0 +1,127 @@
+import geopandas as gpd
+import pandas as pd
+from shapely.geometry import box
+from helpers import util_transform
+from helpers.util_benchmark import patched, synthetic_boundaries
+from etl.spatial import PolygonIndex
+from etl.schema import apply_schema
+from helpers.util_schema import raw_trip_schema
+from helpers.util_transform import geocode_stations, get_neighborhoods, read_station_cache, transform_data, update_station_cache
+import pytest
+
+
+@pytest.fixture
+def boundaries(tmp_path):
+    with synthetic_boundaries(str(tmp_path / 'processed')) as paths:
+        yield paths
+
+
+def stations(*rows) -> pd.DataFrame:
+    """Stations like the output of `first_seen_stations` from (name, day of January 2022, lat, lng) tuples."""
+    return pd.DataFrame({'station_name': [row[0] for row in rows],
+                         'started_at': [pd.Timestamp(2022, 1, row[1]) for row in rows],
+                         'lat': [row[2] for row in rows],
+                         'lng': [row[3] for row in rows]})
+
+
+def test_update_station_cache_ids(tmp_path, boundaries):
+    cache_path = str(tmp_path / 'stations.parquet')
+    first = update_station_cache(stations(('B', 2, 41.90, -87.65), ('A', 1, 41.88, -87.63)), cache_path)
+    assert first[['station_id', 'station_name']].values.tolist() == [[0, 'A'], [1, 'B']]
+
+    # Cached stations keep their id even when seen earlier, new ones get the next ids in first seen order
+    second = update_station_cache(stations(('A', 1, 41.88, -87.63), ('D', 5, 41.86, -87.61), ('C', 4, 41.93, -87.67)), cache_path)
+    assert second[['station_id', 'station_name']].values.tolist() == [[0, 'A'], [1, 'B'], [2, 'C'], [3, 'D']]
+    pd.testing.assert_frame_equal(second.iloc[:2], first)
+
+    # Stations without new trips come from the cache
+    pd.testing.assert_frame_equal(update_station_cache(stations(), cache_path), second)
+
+
+def test_update_station_cache_moved(tmp_path, boundaries):
+    cache_path = str(tmp_path / 'stations.parquet')
+    before = update_station_cache(stations(('A', 1, 41.88, -87.63), ('B', 2, 41.90, -87.65)), cache_path)
+    assert before['primary_neighborhood'].tolist() == ['Neighborhood 7-6', 'Neighborhood 6-7']
+
+    # A is seen later about 6 km away, it is geocoded again and keeps its id
+    after = update_station_cache(stations(('A', 5, 41.93, -87.67)), cache_path)
+    assert after[['station_id', 'station_name']].values.tolist() == [[0, 'A'], [1, 'B']]
+    assert after['primary_neighborhood'].tolist() == ['Neighborhood 6-8', 'Neighborhood 6-7']
+    assert after.loc[0, ['lat', 'lng']].tolist() == pytest.approx([41.93, -87.67])
+    pd.testing.assert_frame_equal(after.iloc[1:], before.iloc[1:])
+
+    # Coordinates seen before the move or within the tolerance do not move it
+    pd.testing.assert_frame_equal(update_station_cache(stations(('A', 3, 41.88, -87.63), ('B', 4, 41.905, -87.65)), cache_path), after)
+    pd.testing.assert_frame_equal(update_station_cache(stations(('A', 6, 41.93, -87.65)), cache_path, tolerance_km=2.0), after)
+
+
+def test_update_station_cache_rejected(tmp_path, boundaries):
+    cache_path = str(tmp_path / 'stations.parquet')
+    station_df = update_station_cache(stations(('A', 1, 41.88, -87.63), ('Indiana', 2, 41.70, -87.45)), cache_path)
+    assert station_df['station_name'].tolist() == ['A']
+    # Stations outside of Illinois are kept with a null state, so they are not geocoded again
+    cache = read_station_cache(cache_path)
+    assert cache['station_name'].tolist() == ['A', 'Indiana']
+    assert cache['state'].isna().tolist() == [False, True]
+    assert update_station_cache(stations(('Indiana', 1, 41.70, -87.45)), cache_path)['station_name'].tolist() == ['A']
+
+
+def test_update_station_cache_boundaries_changed(tmp_path, boundaries):
+    cache_path = str(tmp_path / 'stations.parquet')
+    before = update_station_cache(stations(('A', 1, 41.88, -87.63), ('B', 2, 41.90, -87.65)), cache_path)
+    assert before['primary_neighborhood'].str.startswith('Neighborhood').all()
+
+    neighborhood_path = str(tmp_path / 'everywhere.geojson')
+    gpd.GeoDataFrame({'pri_neigh': ['Everywhere'], 'sec_neigh': ['Everywhere']},
+                     geometry=[box(-88.0, 41.6, -87.5, 42.1)], crs='EPSG:4326').to_file(neighborhood_path, driver='GeoJSON')
+    util_transform.get_neighborhoods.cache_clear()
+    util_transform.get_neighborhood_index.cache_clear()
+    util_transform.get_states.cache_clear()
+    with patched(util_transform, filepath_neighborhood=neighborhood_path):
+        # The geocoding is dropped and done again with the new boundaries, the ids are kept
+        assert 'state' not in read_station_cache(cache_path).columns
+        after = update_station_cache(stations(('C', 3, 41.93, -87.67)), cache_path)
+        assert 'state' in read_station_cache(cache_path).columns
+    assert after[['station_id', 'station_name']].values.tolist() == [[0, 'A'], [1, 'B'], [2, 'C']]
+    assert (after['primary_neighborhood'] == 'Everywhere').all()
+    pd.testing.assert_frame_equal(after.iloc[:2].drop(columns=['primary_neighborhood', 'secondary_neighborhood']),
+                                  before.drop(columns=['primary_neighborhood', 'secondary_neighborhood']))
+
+
+def test_geocode_stations_stops_workers(boundaries):
+    # Queries of a single point already go to the worker processes, which are stopped once the stations are geocoded
+    index = PolygonIndex(get_neighborhoods(), workers=2, min_chunk_size=1)
+    with patched(util_transform, get_neighborhood_index=lambda: index):
+        station_df = geocode_stations(stations(('A', 1, 41.88, -87.63), ('B', 2, 41.90, -87.65)))
+    assert station_df['primary_neighborhood'].notna().all()
+    assert index._pool is None
+
+
+def test_transform_data_trip_neighborhoods(boundaries):
+    # A docked trip, a dockless e-bike trip without stations and one ending outside of Chicago
+    trips = apply_schema(pd.DataFrame({
+        'ride_id': ['r1', 'r2', 'r3'],
+        'rideable_type': ['classic_bike', 'electric_bike', 'electric_bike'],
+        'started_at': pd.to_datetime(['2022-01-01 08:00', '2022-01-01 09:00', '2022-01-01 10:00']),
+        'ended_at': pd.to_datetime(['2022-01-01 08:20', '2022-01-01 09:15', '2022-01-01 10:30']),
+        'start_station_name': ['A', None, 'B'],
+        'start_station_id': ['1', None, '2'],
+        'end_station_name': ['B', None, None],
+        'end_station_id': ['2', None, None],
+        'start_lat': [41.88, 41.86, 41.90],
+        'start_lng': [-87.63, -87.61, -87.65],
+        'end_lat': [41.90, 41.93, 41.70],
+        'end_lng': [-87.65, -87.67, -87.45],
+        'member_casual': ['member', 'casual', 'casual'],
+    }), raw_trip_schema)
+    station_df = geocode_stations(stations(('A', 1, 41.88, -87.63), ('B', 1, 41.90, -87.65)))
+
+    assert transform_data(trips, station_df)['ride_id'].tolist() == ['r1']
+    df = transform_data(trips, station_df, trip_neighborhoods=True)
+    assert df['ride_id'].tolist() == ['r1', 'r2', 'r3']
+    assert df['start_coord_neighborhood'].tolist() == ['Neighborhood 7-6', 'Neighborhood 7-6', 'Neighborhood 6-7']
+    assert df['end_coord_neighborhood'].tolist()[:2] == ['Neighborhood 6-7', 'Neighborhood 6-8']
+    assert pd.isna(df['end_coord_neighborhood'].iloc[2])
+    # Trips without a station have no station attributes
+    assert df['start_primary_neighborhood'].isna().tolist() == [False, True, False]
+    assert df['end_station_id'].isna().tolist() == [False, True, True]
@@ -1,5 +1,10 @@
 import pandas as pd
-from etl.transform import add_column, combine_data, remove_column, select_column, filter_column, sort_data, remove_duplicates
+import geopandas as gpd
+from shapely.geometry import box
+from etl.transform import (
+    add_column, add_geo_field_from_lat_long, add_lookup_columns, columnar, lookup_positions, add_region_from_lat_long, combine_data, remove_column,
+    select_column, filter_column, sort_data, remove_duplicates, filter_rows, first_by, remove_null_values, reset_index, TransformPlan
+)
 from helpers.util_tests import add_5
 import pytest
 
@@ -15,6 +20,18 @@ def test_add_column(df) -> None:
     assert sorted(list(result['A_5'].values)) == [6, 7, 8]
 
 
+@columnar
+def add_5_columnar(col: str, row: pd.DataFrame) -> pd.Series:
+    return row[col] + 5
+
+
+def test_add_column_columnar(df) -> None:
+    df.index = [5, 6, 7]
+    result = add_column(df, 'A_5', add_5_columnar, 'A')
+    assert list(result['A_5']) == [6, 7, 8]
+    assert list(result.index) == [5, 6, 7]
+
+
 def test_combine_data(df):
     df1 = pd.DataFrame({'A': [1, 2, 3], 'D': [3, 4, 5]})
     result = combine_data(df, df1, 'A')
@@ -37,6 +54,18 @@ def test_select_column(df):
 def test_filter_column(df):
     result = filter_column(df, 'B', 'equal', 4)
     assert len(result) == 2
+    assert list(filter_column(df, 'A', 'between', (2, 3))['A']) == [2, 3]
+    assert list(filter_column(df, 'C', 'in', ['a', 'c'])['A']) == [1, 3]
+    assert len(filter_column(df.assign(D=[None, 1, 2]), 'D', 'notnull')) == 2
+    with pytest.raises(ValueError):
+        filter_column(df, 'B', 'like', 4)
+
+
+def test_filter_rows(df):
+    df['D'] = pd.to_datetime(['2022-01-01', '2022-02-01', '2022-03-01'])
+    result = filter_rows(df, "1 < A <= 3 and (C in @values or D < @date)", values=['c'], date=pd.Timestamp('2022-02-15'))
+    assert list(result['A']) == [2, 3]
+    assert len(filter_rows(df, "B == 4 or C.notna()")) == 3
 
 
 def test_sort_data(df):
@@ -44,6 +73,109 @@ def test_sort_data(df):
     assert (result['A'] == [3, 2, 1]).all()
 
 
+def test_first_by():
+    df = pd.DataFrame({'key': ['x', 'y', 'x', None, 'y', 'z'], 'time': [3, 2, 1, 0, 2, None]}, index=[10, 11, 12, 13, 14, 15])
+    for dtype in [object, 'category']:
+        result = first_by(df.astype({'key': dtype}), 'key', 'time')
+        assert list(result.index) == [11, 12]
+        assert list(result['key']) == ['y', 'x']
+
+
 def test_remove_duplicates(df):
     result = remove_duplicates(df, ['B'])
     assert len(result) == 2
+
+
+def test_add_region_from_lat_long():
+    regions = gpd.GeoDataFrame({'NAME': ['West', 'East']}, geometry=[box(0, 0, 1, 1), box(1, 0, 2, 1)], crs='EPSG:4326')
+    points = pd.DataFrame({'lng': [0.5, 1.5, 5.0, 1.5], 'lat': [0.5, 0.5, 5.0, 0.5]}, index=[10, 11, 12, 13])
+    result = add_region_from_lat_long(points, regions, 'lng', 'lat', 'NAME', 'region')
+    assert list(result.index) == [10, 11, 12, 13]
+    assert list(result['region']) == ['West', 'East', 'None', 'East']
+
+    result = add_region_from_lat_long(points, regions, 'lng', 'lat', 'NAME', 'region', bbox=(0, 0, 1, 1))
+    assert list(result['region']) == ['West', 'None', 'None', 'None']
+
+
+def test_add_geo_field_from_lat_long():
+    regions = gpd.GeoDataFrame({'NAME': ['West', 'East']}, geometry=[box(0, 0, 1, 1), box(1, 0, 2, 1)], crs='EPSG:4326')
+    points = pd.DataFrame({'id': [1, 2, 3], 'lng': [1.5, 5.0, 0.5], 'lat': [0.5, 5.0, 0.5]}, index=[10, 11, 12])
+    result = add_geo_field_from_lat_long(points, regions, 'lng', 'lat')
+    assert list(result.columns) == ['id', 'lng', 'lat', 'NAME']
+    assert list(result['id']) == [1, 3]
+    assert list(result['NAME']) == ['East', 'West']
+
+
+def test_add_lookup_columns():
+    lookup = pd.DataFrame({'name': ['x', 'y', 'z'], 'id': [1, 2, 3], 'area': ['n', 's', 'n']})
+    for dtype in [object, 'category']:
+        df = pd.DataFrame({'start': ['y', 'x', 'w', None], 'end': ['z', 'z', 'x', 'y']}, index=[3, 1, 2, 0]).astype(dtype)
+        result = add_lookup_columns(df, lookup, 'name', {'start': 'start_', 'end': 'end_'})
+        assert list(result.columns) == ['start', 'end', 'start_id', 'start_area', 'end_id', 'end_area']
+        assert list(result.index) == [3, 1, 2, 0]
+
+        expected = (df
+                    .merge(lookup.rename(columns=lambda col: 'start_' + col), left_on='start', right_on='start_name', how='left')
+                    .merge(lookup.rename(columns=lambda col: 'end_' + col), left_on='end', right_on='end_name', how='left')
+                    .drop(columns=['start', 'end', 'start_name', 'end_name']))
+        pd.testing.assert_frame_equal(result.drop(columns=['start', 'end']).reset_index(drop=True), expected)
+
+
+def test_transform_plan():
+    lookup = pd.DataFrame({'name': ['a', 'b'], 'id': [1, 2]})
+    df = pd.DataFrame({'A': [1, 2, 3, None, 5], 'B': [4, 4, 6, 7, 1], 'C': ['a', 'b', 'c', 'a', 'b']}, index=[9, 8, 7, 6, 5])
+    steps = [(remove_null_values,),
+             (add_lookup_columns, lookup, 'name', {'C': 'c_'}),
+             (add_column, 'A_5', add_5_columnar, 'A'),
+             (remove_column, 'B'),
+             (filter_column, 'A_5', 'greater', 6),
+             (add_column, 'A_10', add_5, 'A_5'),
+             (filter_column, 'A_10', 'less', 15),
+             (filter_rows, "A_5 >= A + 5 and C != 'x'")]
+    expected, plan = df, TransformPlan(df)
+    for func, *args in steps:
+        expected, plan = expected.pipe(func, *args), plan.pipe(func, *args)
+    result = plan.collect()
+    pd.testing.assert_frame_equal(result, expected)
+    assert list(result.index) == [8, 7]
+
+    # Only the nulls of the subset remove a row
+    pd.testing.assert_frame_equal(TransformPlan(df).pipe(remove_null_values, ['B', 'C']).collect(), df)
+    pd.testing.assert_frame_equal(TransformPlan(df).pipe(remove_null_values, subset=['A']).collect(), df.dropna())
+
+    # Other functions materialize the plan first
+    result = TransformPlan(df).pipe(filter_column, 'B', 'equal', 4).pipe(reset_index, drop=True).pipe(select_column, ['C']).collect()
+    pd.testing.assert_frame_equal(result, df.pipe(filter_column, 'B', 'equal', 4).pipe(reset_index, drop=True).pipe(select_column, ['C']))
+
+    with pytest.raises(ValueError):
+        TransformPlan(df).pipe(filter_column, 'B', 'like', 4).collect()
+
+
+@columnar(inputs=['B'])
+def add_b(col, row):
+    return row[col] + row['B']
+
+
+@columnar
+def add_b_undeclared(col, row):
+    return row[col] + row['B']
+
+
+def test_transform_plan_columnar_inputs(df):
+    # Columns read from row besides the arguments are only there when declared
+    expected = add_column(df, 'D', add_b, 'A')
+    pd.testing.assert_frame_equal(TransformPlan(df).pipe(add_column, 'D', add_b, 'A').pipe(select_column, ['C', 'D']).collect(),
+                                  expected[['C', 'D']])
+    pd.testing.assert_frame_equal(add_column(df, 'D', add_b_undeclared, 'A'), expected)
+    with pytest.raises(KeyError):
+        TransformPlan(df).pipe(add_column, 'D', add_b_undeclared, 'A').collect()
+
+
+def test_lookup_positions():
+    lookup_index = pd.Index(['a', 'b', 'c'])
+    assert lookup_positions(pd.Series(['c', None, 'a', 'x', 'c']), lookup_index).tolist() == [2, -1, 0, -1, 2]
+    assert lookup_positions(pd.Series(pd.Categorical(['b', None], categories=['x', 'b'])), lookup_index).tolist() == [1, -1]
+    # Only null keys, there is nothing to look up
+    assert lookup_positions(pd.Series([None, None], dtype=object), lookup_index).tolist() == [-1, -1]
+    assert lookup_positions(pd.Series(pd.Categorical([None, None])), lookup_index).tolist() == [-1, -1]
+    assert lookup_positions(pd.Series([], dtype=object), lookup_index).tolist() == []
@@ -0,0 +1,55 @@
+import numpy as np
+import pandas as pd
+from etl.validate import Rule, rule_counts, split_valid, validate, violations
+import pytest
+
+rules = [
+    Rule('missing', 'notnull', ['id', 'kind']),
+    Rule('duration', 'span', ['start', 'end'], (pd.Timedelta(1, 'min'), pd.Timedelta(1, 'h'))),
+    Rule('outside', 'between', ['x', 'y'], [(0, 10), (0, 5)]),
+    Rule('unknown_kind', 'in', ['kind'], ['a', 'b']),
+    Rule('duplicate', 'unique', ['id']),
+]
+
+
+@pytest.fixture
+def df() -> pd.DataFrame:
+    start = pd.Timestamp('2022-01-01')
+    return pd.DataFrame({'id': ['r1', 'r2', None, 'r1', 'r5', 'r6'],
+                         'kind': pd.Categorical(['a', 'b', 'a', 'c', None, 'a']),
+                         'start': [start] * 6,
+                         'end': start + pd.to_timedelta([5, 30, 10, 0.5, 60, 10], unit='min'),
+                         'x': [1.0, 11.0, 2.0, 3.0, 4.0, np.nan],
+                         'y': [1.0, 1.0, 2.0, 3.0, 6.0, 1.0]})
+
+
+def test_violations(df):
+    assert violations(df, rules[0]).tolist() == [False, False, True, False, True, False]
+    assert violations(df, rules[1]).tolist() == [False, False, False, True, True, False]
+    # Null values only break 'notnull' rules
+    assert violations(df, rules[2]).tolist() == [False, True, False, False, True, False]
+    assert violations(df, rules[3]).tolist() == [False, False, False, True, False, False]
+    assert violations(df, rules[4]).tolist() == [False, False, False, True, False, False]
+    with pytest.raises(ValueError):
+        violations(df, Rule('bad', 'unknown', ['x']))
+
+
+def test_validate(df):
+    reasons = validate(df, rules)
+    assert reasons.dtype == np.uint8
+    assert reasons.tolist() == [0, 4, 1, 2 | 8 | 16, 1 | 2 | 4, 0]
+    assert rule_counts(reasons, rules).to_dict() == {'missing': 2, 'duration': 2, 'outside': 2, 'unknown_kind': 1, 'duplicate': 1}
+    assert validate(df, rules * 2).dtype == np.uint16
+    with pytest.raises(ValueError):
+        validate(df, rules * 13)
+
+
+def test_split_valid(df):
+    clean_df, rejected_df = split_valid(df, rules)
+    pd.testing.assert_frame_equal(clean_df, df.iloc[[0, 5]])
+    pd.testing.assert_frame_equal(rejected_df.drop(columns='reasons'), df.iloc[[1, 2, 3, 4]])
+    assert rejected_df['reasons'].tolist() == [4, 1, 26, 7]
+
+    clean_df, rejected_df = split_valid(df.iloc[[0, 5]], rules)
+    assert len(clean_df) == 2 and len(rejected_df) == 0
+    assert list(rejected_df.columns) == [*df.columns, 'reasons']